@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 import dj_database_url
 from dotenv import load_dotenv # type: ignore
 # Load environment variables from .env file
@@ -96,6 +97,7 @@ SOCIALACCOUNT_ADAPTER = 'allauth.socialaccount.adapter.DefaultSocialAccountAdapt
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'users.middleware.QueryBudgetMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -105,6 +107,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
     'users.middleware.RolePickerMiddleware',
+    'users.middleware.ProfilingMiddleware',
     'django_htmx.middleware.HtmxMiddleware',
 ]
 
@@ -121,6 +124,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'chat.context_processors.chat_nav',
             ],
         },
     },
@@ -138,12 +142,59 @@ CACHES = {
     }
 }
 
-# For Django Channels (if using Redis for WebSockets)
-CHANNEL_LAYERS = {
-    "default": {
-    "BACKEND": "channels.layers.InMemoryChannelLayer",
-    },
-}
+# `manage.py test` runs on a per-process in-memory cache, so the suite needs no Redis and
+# never reads or clears keys a running server uses.
+if sys.argv[1:2] == ["test"]:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# For Django Channels. With CHANNEL_REDIS_URL set, every Daphne process shares one Redis
+# channel layer, so chat and notification pushes reach sockets served by other processes.
+# Several space-separated URLs shard channels and groups across those Redis servers.
+# Unset (local development), the in-memory layer only reaches this process's own sockets.
+CHANNEL_REDIS_URLS = os.environ.get("CHANNEL_REDIS_URL", "").split()
+if CHANNEL_REDIS_URLS:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": CHANNEL_REDIS_URLS,
+                "prefix": os.environ.get("CHANNEL_PREFIX", "ligameet"),
+                # Messages per channel before sends fail; room fan-out bursts need more than the default 100
+                "capacity": int(os.environ.get("CHANNEL_CAPACITY", "500")),
+                "expiry": 30,  # seconds an undelivered message waits for a slow socket
+                # Sockets open longer than this drop out of their groups; a day outlasts any browser tab we care about
+                "group_expiry": int(os.environ.get("CHANNEL_GROUP_EXPIRY", "86400")),
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
+
+# Chat write-behind (chat.ingest). With CHAT_WRITE_BEHIND=1 a chat message is broadcast as soon
+# as it arrives and saved with the others of its batch, every CHAT_FLUSH_INTERVAL_MS or every
+# CHAT_FLUSH_BATCH messages, whichever comes first. A graceful stop saves what is still buffered;
+# a crash loses at most one interval of messages. Message ids then come from a counter in CACHES,
+# which must be shared by every process (Redis).
+CHAT_WRITE_BEHIND = os.environ.get("CHAT_WRITE_BEHIND") == "1"
+CHAT_FLUSH_INTERVAL = int(os.environ.get("CHAT_FLUSH_INTERVAL_MS", "200")) / 1000  # seconds
+CHAT_FLUSH_BATCH = int(os.environ.get("CHAT_FLUSH_BATCH", "100"))
+CHAT_FLUSH_RETRIES = 3  # flushes a refused batch is kept for before its failing rows are dropped
+
+# Chat flood control (chat.flow): messages a second each socket, and each user over all of
+# their sockets, may send, and how many can be saved up for a burst. None turns a limit off.
+CHAT_SOCKET_RATE = 2
+CHAT_SOCKET_BURST = 10
+CHAT_USER_RATE = 3
+CHAT_USER_BURST = 15
+CHAT_OUTBOX_SIZE = 100  # frames waiting for a slow client before its oldest are dropped; Daphne rarely lets them wait (see chat.flow.Outbox)
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -244,6 +295,19 @@ X_FRAME_OPTIONS = "SAMEORIGIN"
 SILENCED_SYSTEM_CHECKS = ["security.W019"]
 
 
+# Per-request SQL query counts against each view's @query_budget (users.middleware.QueryBudgetMiddleware).
+# On with DEBUG; QUERY_BUDGET=1 turns it on in production too, where it keeps counts and time, never the SQL.
+QUERY_BUDGET_ENABLED = os.environ.get("QUERY_BUDGET", "1" if DEBUG else "0") == "1"
+
+# Request profiling (users.middleware.ProfilingMiddleware), listed at /admin/profiles/
+PROFILING_SAMPLE_PERCENT = float(os.environ.get("PROFILING_SAMPLE_PERCENT", "0"))  # % of requests profiled; staff can always send the header
+PROFILING_HEADER = 'X-Profile'
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN")  # lets non-staff clients (e.g. the load test) trigger a capture
+PROFILING_MODE = os.environ.get("PROFILING_MODE", "cprofile")  # or "sample"
+PROFILING_DIR = os.environ.get("PROFILING_DIR")  # defaults to <tmp>/ligameet-profiles
+PROFILING_MAX_CAPTURES = int(os.environ.get("PROFILING_MAX_CAPTURES", "50"))
+
+
 # mobile
 ALLOWED_HOSTS = os.environ.get("ALLOWED_HOSTS").split(" ")
 
@@ -23,6 +23,8 @@ from users import views as user_views
 
 
 urlpatterns = [
+    path('admin/profiles/', user_views.profiling_captures, name='profiling-captures'),
+    path('admin/profiles/<str:capture_id>/<str:kind>/', user_views.profiling_capture_download, name='profiling-capture-download'),
     path('admin/', admin.site.urls),
     path('register/', user_views.register, name='register'),
     path('profile/', user_views.profile, name='profile'),
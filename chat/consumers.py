@@ -1,81 +1,212 @@
-from channels.generic.websocket import WebsocketConsumer
-from django.shortcuts import get_object_or_404
+import asyncio
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.template.loader import render_to_string
-from asgiref.sync import async_to_sync
 import json
 from .models import *
+from .context_processors import invalidate_chat_nav
+from .forms import ChatmessageCreateForm
+from . import flow, presence
+from .ingest import message_buffer, next_message_id, write_behind
+from ligameet.notifications import notification_group
 
-class ChatroomConsumer(WebsocketConsumer):
-    def connect(self):
-        self.user = self.scope['user']
+# Online-count broadcasts waiting out their debounce window; referenced so they are not garbage collected
+pending_broadcasts = set()
+
+
+class ChatroomConsumer(AsyncWebsocketConsumer):
+    """A chat room socket, served on the event loop without holding a thread.
+
+    The database is only used in the database_sync_to_async methods. A new message is
+    saved and rendered once, by its author's socket, and the group event carries the
+    HTML; recipients just pick their variant and send it, with no query or render each.
+    With CHAT_WRITE_BEHIND the message is broadcast before it is saved (see chat.ingest).
+    Who is online lives in the cache (see chat.presence), and joins and leaves are
+    broadcast at most once per BROADCAST_DELAY per room. Frames in are rate limited and
+    frames out go through a bounded Outbox (see chat.flow).
+    """
+    async def connect(self):
         self.chatroom_name = self.scope['url_route']['kwargs']['chatroom_name']
-        self.chatroom = get_object_or_404(ChatGroup, group_name=self.chatroom_name)
-        
+        self.chatroom = None
+        if not self.scope['user'].is_authenticated:
+            await self.close()
+            return
+        self.user, self.chatroom = await self.load_user_and_chatroom()
+        if self.chatroom is None:
+            await self.close()
+            return
+        self.last_seen_message_id = 0
+        self.bucket = flow.TokenBucket(getattr(settings, 'CHAT_SOCKET_RATE', 2), getattr(settings, 'CHAT_SOCKET_BURST', 10))
+        self.throttled = False
+        self.dropping = False
+        self.outbox = flow.Outbox(self.send, getattr(settings, 'CHAT_OUTBOX_SIZE', 100), on_error=self.close)
+
         #connects the chanel to a group
-        async_to_sync(self.channel_layer.group_add)( 
-            self.chatroom_name, self.channel_name
-        )
-        
-        # add and update online users
-        if self.user not in self.chatroom.users_online.all():
-            self.chatroom.users_online.add(self.user)
-            self.update_online_count()
-
-        self.accept()
-
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(
-            self.chatroom_name, self.channel_name
-        )
+        await self.channel_layer.group_add(self.chatroom_name, self.channel_name)
+
+        # add and update online users; a user's extra tabs only need the current count
+        self.presence = presence.SocketPresence(self.chatroom.id, self.user.id)
+        came_online = await self.presence.join()
+        if came_online:
+            await self.online_count_changed()
+        await self.accept()
+        if not came_online:
+            html = await cache.aget(presence.online_count_html_key(self.chatroom.id))
+            if html:
+                await self.queue(html, coalesce='online_count')
+            else:
+                await self.online_count_changed()
+        self.heartbeat = asyncio.create_task(self.keep_present())
+
+    async def disconnect(self, close_code):
+        if self.chatroom is None:
+            return
+        self.heartbeat.cancel()
+        self.outbox.close()
+        await self.channel_layer.group_discard(self.chatroom_name, self.channel_name)
         # remove and update online users
-        if self.user in self.chatroom.users_online.all():
-            self.chatroom.users_online.remove(self.user)
-            self.update_online_count()
-
-    def receive(self, text_data): #receive data from form in json
-        text_data_json = json.loads(text_data)  #converts json file to python object
-        body = text_data_json['body']
-
-        message = GroupMessage.objects.create(
-            body = body, 
-            author = self.user,
-            group = self.chatroom
-        )
-        
-        event = {
-            'type': 'message_handler',
-            'message_id': message.id,
-        }
-        async_to_sync(self.channel_layer.group_send)(
-            self.chatroom_name, event
-        )
-
-    def message_handler(self, event):
-        message_id = event['message_id']
-        message = GroupMessage.objects.get(id=message_id)
-        message.is_read = True
-        context = {
-            'message': message,
-            'user': self.user,
-        }
-        html = render_to_string("chat/partials/chat_message_p.html", context=context)
-        self.send(text_data=html)
+        if await self.presence.leave():
+            await self.online_count_changed()
+        # Messages seen live are read; the cursor moves once here instead of once per message
+        if self.last_seen_message_id:
+            await self.mark_read(self.last_seen_message_id)
 
-    def update_online_count(self):
-        online_count = self.chatroom.users_online.count() -1
+    async def receive(self, text_data): #receive data from form in json
+        if len(text_data) > flow.MAX_FRAME_BYTES:
+            await flow.count('oversized')
+            await self.close(code=1009)  # message too big
+            return
+        try:
+            form = ChatmessageCreateForm({'body': json.loads(text_data)['body']})  #converts json file to python object
+        except (ValueError, KeyError, TypeError):
+            form = None
+        if form is None or not form.is_valid():
+            await flow.count('invalid')
+            return
+        # The socket's own bucket first, so a single flooding tab is turned away without a cache round trip
+        if not self.bucket.take() or not await flow.take_user_token(self.user.id):
+            await self.refuse_throttled()
+            return
+        self.throttled = False
 
-        event={
-            'type': 'online_count_handler', #handles the event
-            'online_count': online_count
-        }
-        #broadcast to channel
-        async_to_sync(self.channel_layer.group_send)(self.chatroom_name, event)
+        message, event = await self.save_message(form.cleaned_data['body'])
+        await self.channel_layer.group_send(self.chatroom_name, event)
+        if write_behind():
+            message_buffer.add(message)  # saved with the next batch
+
+    async def message_handler(self, event):
+        self.last_seen_message_id = max(self.last_seen_message_id, event['message_id'])
+        await self.queue(event['author_html'] if event['author_id'] == self.user.id else event['html'])
+
+    async def queue(self, text, coalesce=None):
+        outcome = self.outbox.put(text, coalesce)
+        if outcome:
+            await flow.count(outcome)
+            if outcome == 'dropped' and not self.dropping:
+                flow.logger.warning('Chat socket of user %s in %s fell behind; dropping its oldest frames', self.user.id, self.chatroom_name)
+        self.dropping = outcome == 'dropped'
+
+    async def refuse_throttled(self):
+        await flow.count('throttled')
+        if not self.throttled:  # one notice and log line per streak, so a flood is not answered frame for frame
+            self.throttled = True
+            flow.logger.warning('Throttled chat messages from user %s in %s', self.user.id, self.chatroom_name)
+            await self.queue(render_to_string('chat/partials/chat_throttled.html'), coalesce='throttled')
+
+    async def keep_present(self):
+        while True:
+            await asyncio.sleep(presence.PRESENCE_HEARTBEAT)
+            await self.presence.heartbeat()
 
-    def online_count_handler(self, event):
-        online_count = event['online_count']
+    async def online_count_changed(self):
+        # One socket per room and window does the broadcast, after the window's other changes
+        if await presence.claim_broadcast(self.chatroom.id):
+            task = asyncio.create_task(self.broadcast_online_count())
+            pending_broadcasts.add(task)  # outlives this socket if it closes first
+            task.add_done_callback(pending_broadcasts.discard)
+
+    async def broadcast_online_count(self):
+        await asyncio.sleep(presence.BROADCAST_DELAY + 0.1)  # past the claim's expiry, so later changes claim their own
+        members = await self.load_members()
+        online_user_ids = await presence.online_user_ids(self.chatroom.id, [member.id for member in members])
         context = {
-            'online_count': online_count,
-            'chat_group': self.chatroom
+            'online_count': max(len(online_user_ids) - 1, 0),
+            'members': members,
+            'online_user_ids': online_user_ids,
         }
         html = render_to_string("chat/partials/online_count.html", context)
-        self.send(text_data=html)
+        await cache.aset(presence.online_count_html_key(self.chatroom.id), html, presence.PRESENCE_TTL)
+        #broadcast to channel
+        await self.channel_layer.group_send(self.chatroom_name, {
+            'type': 'online_count_handler', #handles the event
+            'html': html,
+        })
+
+    async def online_count_handler(self, event):
+        await self.queue(event['html'], coalesce='online_count')
+
+    @database_sync_to_async
+    def load_user_and_chatroom(self):
+        # The profile comes along because messages render the author's picture and name
+        user = User.objects.select_related('profile').get(pk=self.scope['user'].pk)
+        return user, ChatGroup.objects.filter(group_name=self.chatroom_name).first()
+
+    @database_sync_to_async
+    def save_message(self, body):
+        """Saves the message and renders it the two ways it is shown: to its author and to everyone else.
+
+        With write-behind on, the message only gets its id here and is left unsaved for the buffer.
+        """
+        if write_behind():
+            message = GroupMessage(id=next_message_id(), body=body, author=self.user, group=self.chatroom)
+        else:
+            message = GroupMessage.objects.create(body=body, author=self.user, group=self.chatroom)
+        return message, {
+            'type': 'message_handler',
+            'message_id': message.id,
+            'author_id': self.user.id,
+            'author_html': render_to_string("chat/partials/chat_message_p.html", {'message': message, 'user': self.user}),
+            'html': render_to_string("chat/partials/chat_message_p.html", {'message': message, 'user': None}),
+        }
+
+    @database_sync_to_async
+    def load_members(self):
+        return list(self.chatroom.members.select_related('profile'))
+
+    @database_sync_to_async
+    def mark_read(self, message_id):
+        if ChatReadCursor.advance(self.user.id, self.chatroom.id, message_id):
+            invalidate_chat_nav([self.user.id])
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """Pushes the user's new notifications and unread-count changes to their open pages.
+
+    It only relays what ligameet.notifications sends to the user's group, so it never
+    touches the database and runs on the event loop instead of holding a worker thread.
+    """
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        self.group_name = notification_group(self.user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def notification_new(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'notification',
+            'notification': event['notification'],
+            'unread_delta': event['unread_delta'],
+        }))
+
+    async def notification_count(self, event):
+        await self.send(text_data=json.dumps({'type': 'unread_count', 'unread_delta': event['unread_delta']}))
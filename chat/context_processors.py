@@ -0,0 +1,102 @@
+import time
+
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject, cached_property
+from .models import ChatGroup, ChatReadCursor
+
+CHAT_NAV_TIMEOUT = 60 * 30  # seconds; messages, reads and membership changes invalidate it first
+
+
+def chat_nav_cache_key(user_id):
+    return f'chat:nav:{user_id}'
+
+
+def chat_group_version_key(group_id):
+    return f'chat:nav:group:{group_id}'
+
+
+def invalidate_chat_nav(user_ids):
+    """Drops the cached chat menu of these users, e.g. one who read a room or joined or left one."""
+    cache.delete_many([chat_nav_cache_key(user_id) for user_id in set(user_ids)])
+
+
+def bump_chat_groups(group_ids):
+    """Moves these groups to a new version, which stales every cached menu showing them.
+
+    One cache write per group however many members it has, so a message to a big room
+    costs the same as one to a private chat; each member's menu is rebuilt on its next read.
+    """
+    for group_id in set(group_ids):
+        key = chat_group_version_key(group_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # The version was evicted; a timestamp cannot collide with versions still cached
+            cache.set(key, int(time.time() * 1000), None)
+
+
+def build_chat_nav(user):
+    """The navbar chat menu of `user` with each chat's unread count, in three queries.
+
+    Also returns the versions its groups had before the counts were read, so a message
+    landing while it is built leaves the menu stale rather than cached as current.
+    """
+    groups = list(user.chat_groups.order_by('id').values('id', 'group_name', 'groupchat_name', 'is_private'))
+    versions = cache.get_many([chat_group_version_key(group['id']) for group in groups])
+
+    # The other member of each private chat is shown by username
+    partners = {}
+    private_ids = [group['id'] for group in groups if group['is_private']]
+    if private_ids:
+        memberships = ChatGroup.members.through.objects.filter(chatgroup_id__in=private_ids).exclude(user_id=user.id)
+        for chatgroup_id, username in memberships.order_by('user_id').values_list('chatgroup_id', 'user__username'):
+            partners.setdefault(chatgroup_id, []).append(username)
+
+    unread = ChatReadCursor.unread_counts(user)
+    chats = []
+    for group in groups:
+        count = unread.get(group['id'], 0)
+        if group['groupchat_name']:
+            chats.append({'group_name': group['group_name'], 'label': group['groupchat_name'][:30], 'unread': count})
+        if group['is_private']:
+            chats.extend(
+                {'group_name': group['group_name'], 'label': username, 'unread': count}
+                for username in partners.get(group['id'], [])
+            )
+
+    return {'chats': chats, 'has_unread': bool(unread), 'versions': versions}
+
+
+class ChatNav:
+    """Looked up only when a template uses it, so pages without the navbar pay nothing."""
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def data(self):
+        key = chat_nav_cache_key(self.user.pk)
+        data = cache.get(key)
+        if data is not None and cache.get_many(list(data['versions'])) == data['versions']:
+            return data
+        data = build_chat_nav(self.user)
+        cache.set(key, data, CHAT_NAV_TIMEOUT)
+        return data
+
+    def __iter__(self):
+        return iter(self.data['chats'])
+
+    def __len__(self):
+        return len(self.data['chats'])
+
+
+def chat_nav(request):
+    """`chat_nav` (the navbar chat list) and `has_unread_messages` for every template."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    nav = ChatNav(user)
+    return {
+        'chat_nav': nav,
+        'has_unread_messages': SimpleLazyObject(lambda: nav.data['has_unread']),
+    }
@@ -0,0 +1,17 @@
+"""Atomic cache counters for async code.
+
+Django's aincr and adecr are a get followed by a set on every built-in backend, so two
+sockets counting at once can lose an update, and the set also swaps the key's timeout
+for the default one. These run the backend's own incr and decr instead, which Redis
+does atomically and LocMemCache under its lock, keeping the timeout.
+"""
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+
+async def incr(key, delta=1):
+    return await sync_to_async(cache.incr)(key, delta)
+
+
+async def decr(key, delta=1):
+    return await sync_to_async(cache.decr)(key, delta)
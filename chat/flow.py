@@ -0,0 +1,157 @@
+"""Flood control for chat sockets: rate limits on what they receive, bounds on what they send.
+
+Each socket has its own token bucket, in memory, and each user one more over all of
+their sockets, kept in the cache so it holds across processes. Frames that find either
+bucket empty are dropped. What a socket sends goes through an Outbox, so a client that
+reads slower than its room talks loses its oldest chat frames instead of growing a
+buffer without bound.
+
+Throttled and dropped frames are counted in the cache (see flow_metrics) and logged.
+"""
+import asyncio
+import collections
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from . import counters
+
+logger = logging.getLogger(__name__)
+
+MAX_FRAME_BYTES = 4096  # a message is at most 300 characters; bigger frames are not from our form
+BUCKET_TTL = 60 * 60  # seconds an idle user's bucket is kept; a new one starts full
+METRICS = ('throttled', 'dropped', 'coalesced', 'oversized', 'invalid')
+
+
+class TokenBucket:
+    """`rate` tokens a second, up to `burst` saved up; one per frame. A rate of None lets everything through."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        if self.rate is None:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def user_bucket_key(user_id):
+    return f'chat:flow:user:{user_id}'
+
+
+async def take_user_token(user_id):
+    """One token from the user's shared bucket, in two cache round trips and without a lock.
+
+    The bucket is a start time and a count of tokens spent, which only ever goes up with
+    incr: the tokens left are burst + rate * (now - start) - spent. When a quiet user has
+    earned more than `burst`, spent is moved up so no more than that is saved.
+    """
+    rate, burst = getattr(settings, 'CHAT_USER_RATE', 3), getattr(settings, 'CHAT_USER_BURST', 15)
+    if rate is None:
+        return True
+    key = user_bucket_key(user_id)
+    now = time.time()
+    try:
+        spent = await counters.incr(f'{key}:spent')
+    except ValueError:
+        await cache.aadd(f'{key}:start', now, BUCKET_TTL)
+        await cache.aadd(f'{key}:spent', 0, BUCKET_TTL)
+        spent = await counters.incr(f'{key}:spent')
+    start = await cache.aget(f'{key}:start')
+    if start is None:  # expired on its own
+        await cache.aadd(f'{key}:start', now, BUCKET_TTL)
+        start = now
+
+    earned = rate * (now - start)
+    if spent > burst + earned:
+        await counters.decr(f'{key}:spent')  # a refused frame costs nothing
+        return False
+    if spent < earned:
+        await counters.incr(f'{key}:spent', int(earned - spent))
+    return True
+
+
+async def count(metric, n=1):
+    key = f'chat:flow:metrics:{metric}'
+    try:
+        await counters.incr(key, n)
+    except ValueError:
+        await cache.aadd(key, 0, None)
+        await counters.incr(key, n)
+
+
+def flow_metrics():
+    """How many frames have been throttled, dropped, coalesced, refused as oversized or invalid, across processes."""
+    values = cache.get_many([f'chat:flow:metrics:{metric}' for metric in METRICS])
+    return {metric: values.get(f'chat:flow:metrics:{metric}', 0) for metric in METRICS}
+
+
+class Outbox:
+    """Frames waiting for a socket's send, at most `size` of them.
+
+    When it is full the oldest frame is dropped. A frame put with a `coalesce` key
+    replaces the one with that key still waiting, e.g. online counts, where only
+    the newest matters. Sends happen in order on a task of the outbox's own, so a
+    slow client holds up only its own frames. If a send fails the error is logged,
+    the waiting frames are dropped and `on_error` (e.g. the socket's close) is awaited.
+
+    Frames only wait here while the ASGI `send` waits for the client. Servers that
+    drain the socket before returning (uvicorn, hypercorn) do that, and a slow reader
+    fills the outbox. Daphne returns as soon as the frame is in Twisted's write buffer,
+    which has no limit, so behind Daphne the outbox rarely fills. A slow reader's frames
+    pile up in that buffer instead. There, only the rate limits on what the room's
+    senders may send bound how much can pile up.
+    """
+
+    def __init__(self, send, size, on_error=None):
+        self.send = send
+        self.size = size
+        self.on_error = on_error
+        self.frames = collections.deque()
+        self.ready = asyncio.Event()
+        self.sender = None
+
+    def put(self, text, coalesce=None):
+        """Queues a frame; returns the metric the put counts towards, if any."""
+        outcome = None
+        if coalesce is not None:
+            for frame in self.frames:
+                if frame[0] == coalesce:
+                    frame[1] = text
+                    return 'coalesced'
+        if len(self.frames) >= self.size:
+            self.frames.popleft()
+            outcome = 'dropped'
+        self.frames.append([coalesce, text])
+        self.ready.set()
+        if self.sender is None:
+            self.sender = asyncio.create_task(self.run())
+        return outcome
+
+    async def run(self):
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.frames:
+                    _, text = self.frames.popleft()
+                    await self.send(text_data=text)
+        except Exception:
+            logger.exception('Sending to a chat socket failed; dropping its %d waiting frames', len(self.frames))
+            self.frames.clear()
+            if self.on_error is not None:
+                await self.on_error()
+
+    def close(self):
+        if self.sender is not None:
+            self.sender.cancel()
@@ -0,0 +1,146 @@
+"""Write-behind persistence of chat messages, on when settings.CHAT_WRITE_BEHIND is.
+
+A message gets its id from a counter in the cache, is rendered and broadcast right
+away, and waits in this process's MessageBuffer until the next flush saves it with
+one bulk_create. Flushes run every CHAT_FLUSH_INTERVAL seconds, or as soon as
+CHAT_FLUSH_BATCH messages are waiting. What a graceful stop leaves in the buffer is
+saved at exit, so only a crash can lose messages, at most one interval's worth.
+
+Because ids are handed out before the rows exist, every GroupMessage takes its id
+from the counter while the mode is on (see GroupMessage.save), so the database's
+own sequence never hands out one that is already taken. After turning the mode off
+on PostgreSQL, bring the sequence past them with `manage.py sqlsequencereset chat`.
+
+A batch the database refuses is kept for the next flush, up to CHAT_FLUSH_RETRIES
+times. After that it is saved in halves until the rows that still fail (say, their
+room was deleted meanwhile) are alone; those are logged and dropped.
+"""
+import asyncio
+import atexit
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.db.models import Max
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_ID_KEY = 'chat:message_id'
+# Skipped when the counter is (re)started from the table, e.g. after the cache lost it: far
+# more ids than can be waiting unflushed in every process together
+MESSAGE_ID_HEADROOM = 100_000
+
+
+def write_behind():
+    return getattr(settings, 'CHAT_WRITE_BEHIND', False)
+
+
+def next_message_id():
+    """The next GroupMessage id, shared by every process through the cache."""
+    try:
+        return cache.incr(MESSAGE_ID_KEY)
+    except ValueError:
+        from .models import GroupMessage  # Import here to avoid circular import
+        start = (GroupMessage.objects.aggregate(Max('id'))['id__max'] or 0) + MESSAGE_ID_HEADROOM
+        cache.add(MESSAGE_ID_KEY, start, None)
+        return cache.incr(MESSAGE_ID_KEY)
+
+
+def save_messages(messages):
+    """Saves a batch with one insert and does what the GroupMessage post_save receiver does per message, per group."""
+    from .context_processors import bump_chat_groups  # Import here to avoid circular import
+    from .models import ChatGroup, ChatReadCursor, GroupMessage
+
+    latest = {}
+    own_latest = {}
+    for message in messages:
+        latest[message.group_id] = max(latest.get(message.group_id, 0), message.id)
+        key = (message.author_id, message.group_id)
+        own_latest[key] = max(own_latest.get(key, 0), message.id)
+
+    with transaction.atomic():
+        GroupMessage.objects.bulk_create(messages)
+        for group_id, message_id in latest.items():
+            ChatGroup.objects.filter(pk=group_id, latest_message_id__lt=message_id).update(latest_message_id=message_id)
+        for (author_id, group_id), message_id in own_latest.items():
+            ChatReadCursor.advance(author_id, group_id, message_id)  # your own message is never unread
+    bump_chat_groups(latest)
+
+
+def save_messages_or_drop(messages):
+    """Saves a batch, halving it on a database error until the rows that fail are alone, and drops those.
+
+    Returns the number of messages dropped.
+    """
+    try:
+        save_messages(messages)
+        return 0
+    except DatabaseError:
+        if len(messages) == 1:
+            message = messages[0]
+            logger.exception('Dropped chat message %s for group %s: it could not be saved', message.id, message.group_id)
+            return 1
+    middle = len(messages) // 2
+    return save_messages_or_drop(messages[:middle]) + save_messages_or_drop(messages[middle:])
+
+
+class MessageBuffer:
+    """Broadcast messages waiting to be saved, and the task that flushes them.
+
+    It is only touched from the event loop, so it needs no lock. The flush task exits
+    once the buffer is empty and the next message starts a new one.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.flusher = None
+        self.full = None
+        self.failed_flushes = 0
+
+    def add(self, message):
+        self.messages.append(message)
+        loop = asyncio.get_running_loop()
+        if self.flusher is None or self.flusher.done() or self.flusher.get_loop() is not loop:
+            self.full = asyncio.Event()
+            self.flusher = loop.create_task(self.run())
+        if len(self.messages) >= getattr(settings, 'CHAT_FLUSH_BATCH', 100):
+            self.full.set()
+
+    async def run(self):
+        while self.messages:
+            try:
+                await asyncio.wait_for(self.full.wait(), getattr(settings, 'CHAT_FLUSH_INTERVAL', 0.2))
+            except asyncio.TimeoutError:
+                pass
+            self.full.clear()
+            await self.flush()
+
+    async def flush(self):
+        batch, self.messages = self.messages, []
+        if not batch:
+            return
+        try:
+            await database_sync_to_async(save_messages)(batch)
+        except DatabaseError:
+            self.failed_flushes += 1
+            if self.failed_flushes <= getattr(settings, 'CHAT_FLUSH_RETRIES', 3):
+                # Kept for the next flush rather than lost; the messages were already delivered
+                logger.exception('Could not save %d chat messages; retrying with the next flush', len(batch))
+                self.messages[:0] = batch
+                return
+            self.failed_flushes = 0
+            logger.exception('Could not save %d chat messages after retrying; saving them in halves', len(batch))
+            await database_sync_to_async(save_messages_or_drop)(batch)
+        else:
+            self.failed_flushes = 0
+
+    def flush_at_exit(self):
+        batch, self.messages = self.messages, []
+        if batch:
+            save_messages_or_drop(batch)
+
+
+message_buffer = MessageBuffer()
+atexit.register(message_buffer.flush_at_exit)
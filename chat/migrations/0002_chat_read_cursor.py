@@ -0,0 +1,53 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, Min
+
+
+def start_cursors(apps, schema_editor):
+    """Each member has read up to just before the oldest message still unread for them (is_read, not theirs)."""
+    ChatGroup = apps.get_model('chat', 'ChatGroup')
+    GroupMessage = apps.get_model('chat', 'GroupMessage')
+    ChatReadCursor = apps.get_model('chat', 'ChatReadCursor')
+
+    for group in ChatGroup.objects.annotate(latest=Max('chat_messages__id')).exclude(latest=None).iterator():
+        ChatGroup.objects.filter(pk=group.pk).update(latest_message_id=group.latest)
+        first_unread_by_author = dict(
+            GroupMessage.objects.filter(group=group, is_read=False).values_list('author').annotate(first=Min('id')).order_by()
+        )
+        cursors = []
+        for member_id in group.members.values_list('id', flat=True):
+            unread = [first for author_id, first in first_unread_by_author.items() if author_id != member_id]
+            cursors.append(ChatReadCursor(user_id=member_id, group_id=group.pk, last_read_message_id=min(unread) - 1 if unread else group.latest))
+        ChatReadCursor.objects.bulk_create(cursors, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatgroup',
+            name='latest_message_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ChatReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='chat.chatgroup')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_read_cursors', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'group'), name='unique_chat_read_cursor')],
+            },
+        ),
+        migrations.RunPython(start_cursors, migrations.RunPython.noop),
+    ]
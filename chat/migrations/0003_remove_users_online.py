@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_chat_read_cursor'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='chatgroup',
+            name='users_online',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:18
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_group_message_history_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='groupmessage',
+            name='is_read',
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+
+def set_private_keys(apps, schema_editor):
+    """Keys each existing two-member private chat; where a pair already has duplicates, the oldest one gets the key."""
+    ChatGroup = apps.get_model('chat', 'ChatGroup')
+    Membership = ChatGroup.members.through
+
+    members = {}
+    for chatgroup_id, user_id in Membership.objects.filter(chatgroup__is_private=True).values_list('chatgroup_id', 'user_id'):
+        members.setdefault(chatgroup_id, []).append(user_id)
+
+    keyed = set()
+    for chatgroup_id in sorted(members):
+        pair = members[chatgroup_id]
+        if len(pair) != 2:
+            continue
+        key = '-'.join(str(pk) for pk in sorted(pair))
+        if key not in keyed:
+            ChatGroup.objects.filter(pk=chatgroup_id).update(private_key=key)
+            keyed.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_remove_groupmessage_is_read'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatgroup',
+            name='private_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(set_private_keys, migrations.RunPython.noop),
+    ]
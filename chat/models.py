@@ -1,22 +1,29 @@
-from django.db import models
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 import shortuuid
 from ligameet.models import Team
+from ligameet.pagination import CursorPaginator
+from .ingest import next_message_id, write_behind
+
+CHAT_HISTORY_PAGE = 30  # messages rendered with the room and fetched per scroll-back
 
 class ChatGroup(models.Model):
     group_name = models.CharField(max_length=128, unique=True, blank=True)
     groupchat_name = models.CharField(max_length=128, null=True, blank=True)
     admin = models.ForeignKey(User, related_name='groupchats', blank=True, null=True, on_delete=models.SET_NULL)
-    users_online = models.ManyToManyField(User, related_name='online_in_groups', blank=True)
     members = models.ManyToManyField(User, related_name='chat_groups', blank=True)
     is_private = models.BooleanField(default=False)
     team = models.ForeignKey(Team , on_delete=models.CASCADE, related_name='chat_groups', null=True, blank=True)
+    latest_message_id = models.BigIntegerField(default=0)  # id of the newest message, kept up to date on create
+    private_key = models.CharField(max_length=64, unique=True, null=True, blank=True)  # "<lower id>-<higher id>" of a private chat's pair
 
     def __str__(self):
         return self.group_name
     
     def has_unread_messages(self, user):
-        return self.chat_messages.filter(is_read=False).exclude(author=user).exists()
+        return self.latest_message_id > ChatReadCursor.last_read_for(user, self)
 
     
     def save(self, *args, **kwargs):
@@ -24,6 +31,25 @@ class ChatGroup(models.Model):
             self.group_name = shortuuid.uuid()
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def private_pair_key(user_id, other_user_id):
+        return '-'.join(str(pk) for pk in sorted((user_id, other_user_id)))
+
+    @classmethod
+    def private_chat(cls, user, other_user):
+        """The private chat of these two users, created on first use; found with one lookup on the unique pair key."""
+        key = cls.private_pair_key(user.pk, other_user.pk)
+        chatroom = cls.objects.filter(private_key=key).first()
+        if chatroom is not None:
+            return chatroom
+        try:
+            with transaction.atomic():
+                chatroom = cls.objects.create(is_private=True, private_key=key)
+                chatroom.members.add(other_user, user)
+            return chatroom
+        except IntegrityError:  # created by a concurrent request in between
+            return cls.objects.get(private_key=key)
+
     
 
 class GroupMessage(models.Model):
@@ -31,11 +57,84 @@ class GroupMessage(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     body = models.CharField(max_length=300)
     created = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
 
     def __str__(self):
-        return f'{self.author.username} : {self.body} - {self.is_read}'
+        return f'{self.author.username} : {self.body}'
+
+    def save(self, *args, **kwargs):
+        if self.pk is None and write_behind():
+            # Ids come from the write-behind counter, so the table's sequence cannot reuse a buffered message's
+            self.pk = next_message_id()
+            kwargs['force_insert'] = True
+        super().save(*args, **kwargs)
     
     class Meta:
         ordering = ['-created']
-        
\ No newline at end of file
+        indexes = [
+            models.Index(fields=['group', 'created'], name='chat_message_group_created_idx'),
+            models.Index(fields=['group', 'id'], name='chat_message_group_id_idx'),  # unread counts: ids past a cursor
+        ]
+
+    @classmethod
+    def history(cls, group, cursor=None, per_page=CHAT_HISTORY_PAGE):
+        """One page of the group's messages, newest first, starting before `cursor`; each page is one indexed query."""
+        messages = group.chat_messages.select_related('author__profile')
+        return CursorPaginator(messages, ('-created', '-id'), per_page).page(cursor)
+
+
+class ChatReadCursor(models.Model):
+    """The newest message of a group a member has seen; everything after it is unread for them."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_read_cursors')
+    group = models.ForeignKey(ChatGroup, on_delete=models.CASCADE, related_name='read_cursors')
+    last_read_message_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'group'], name='unique_chat_read_cursor'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} read {self.group_id} up to {self.last_read_message_id}'
+
+    @classmethod
+    def last_read_for(cls, user, group):
+        return cls.objects.filter(user=user, group=group).values_list('last_read_message_id', flat=True).first() or 0
+
+    @classmethod
+    def advance(cls, user_id, group_id, message_id):
+        """Moves the cursor forward to `message_id`, never back. Returns whether it moved.
+
+        One upsert whose update only applies to an older cursor, so it is a single
+        statement whether or not the row exists, and concurrent reads landing out of
+        order cannot rewind it.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, group_id, last_read_message_id) VALUES (%s, %s, %s) '
+                f'ON CONFLICT (user_id, group_id) DO UPDATE SET last_read_message_id = excluded.last_read_message_id '
+                f'WHERE {table}.last_read_message_id < excluded.last_read_message_id',
+                [user_id, group_id, message_id],
+            )
+            return cursor.rowcount > 0
+
+    @classmethod
+    def unread_counts(cls, user):
+        """{group id: messages from others newer than the user's cursor} for every group of theirs with any, in one query.
+
+        Only groups unread_groups finds behind get counted, each over its own messages past
+        the cursor on the (group, id) index, so the cost follows what is unread, not the history.
+        A member without a cursor has read nothing, as in last_read_for and unread_groups.
+        """
+        unread = GroupMessage.objects.filter(group=OuterRef('pk'), id__gt=OuterRef('last_read')).exclude(author=user)
+        unread = unread.order_by().values('group').annotate(unread=Count('id')).values('unread')
+        counts = cls.unread_groups(user).annotate(unread=Subquery(unread)).values_list('pk', 'unread')
+        return {group_id: count for group_id, count in counts if count}
+
+    @classmethod
+    def unread_groups(cls, user):
+        """The user's groups with a message newer than their cursor: a lookup per membership, no message scan."""
+        last_read = cls.objects.filter(user=user, group=OuterRef('pk')).values('last_read_message_id')
+        return user.chat_groups.annotate(
+            last_read=Coalesce(Subquery(last_read), 0, output_field=models.BigIntegerField())
+        ).filter(latest_message_id__gt=F('last_read'))
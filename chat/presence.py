@@ -0,0 +1,91 @@
+"""Who has a chat room open, kept in the cache instead of the database.
+
+Every open socket counts once for its (room, user) pair, so a user with three tabs stays
+online until the last one closes. Counts are kept per PRESENCE_WINDOW: each socket adds
+itself to the count of every window it is open in, on its first heartbeat there, and a
+user is online while the current or the previous window counts anyone. So the count is
+rebuilt from the live sockets every window: one the cache lost (eviction, restart)
+comes back right, and the sockets of a crashed process stop counting on their own.
+"""
+import time
+
+from django.core.cache import cache
+from . import counters
+
+PRESENCE_WINDOW = 45  # seconds
+PRESENCE_HEARTBEAT = 20  # seconds; under half a window, so a late beat still counts a socket in every window
+PRESENCE_TTL = 2 * PRESENCE_WINDOW  # a window's count is read during that window and the next
+BROADCAST_DELAY = 1  # seconds; joins and leaves within it go out as one online-count broadcast
+
+
+def current_window():
+    return int(time.time() // PRESENCE_WINDOW)
+
+
+def presence_key(room_id, user_id, window):
+    return f'chat:presence:{room_id}:{user_id}:{window}'
+
+
+def online_count_html_key(room_id):
+    return f'chat:presence:{room_id}:html'
+
+
+class SocketPresence:
+    """One open socket's part in its user's presence in a room: the windows it has counted itself in."""
+
+    def __init__(self, room_id, user_id):
+        self.room_id = room_id
+        self.user_id = user_id
+        self.windows = set()
+
+    async def count_in(self, window):
+        key = presence_key(self.room_id, self.user_id, window)
+        await cache.aadd(key, 0, PRESENCE_TTL)
+        try:
+            sockets = await counters.incr(key)
+        except ValueError:  # expired between the add and the incr
+            await cache.aset(key, 1, PRESENCE_TTL)
+            sockets = 1
+        self.windows.add(window)
+        return sockets
+
+    async def join(self):
+        """Counts the socket in. Returns whether that brought the user online."""
+        window = current_window()
+        sockets = await self.count_in(window)
+        return sockets == 1 and not await cache.aget(presence_key(self.room_id, self.user_id, window - 1))
+
+    async def heartbeat(self):
+        """Counts the socket in the current window, once."""
+        window = current_window()
+        if window not in self.windows:
+            await self.count_in(window)
+            self.windows &= {window - 1, window}
+
+    async def leave(self):
+        """Takes the socket out of the counts still read. Returns whether that took the user offline."""
+        window = current_window()
+        for counted in self.windows & {window - 1, window}:
+            try:
+                await counters.decr(presence_key(self.room_id, self.user_id, counted))
+            except ValueError:  # already expired
+                pass
+        self.windows.clear()
+        return self.user_id not in await online_user_ids(self.room_id, [self.user_id])
+
+
+async def online_user_ids(room_id, user_ids):
+    """The ones among `user_ids` with at least one socket open in the room, in one cache round trip."""
+    window = current_window()
+    keys = {presence_key(room_id, user_id, counted): user_id for user_id in user_ids for counted in (window - 1, window)}
+    counts = await cache.aget_many(keys)
+    return {keys[key] for key, sockets in counts.items() if sockets and sockets > 0}
+
+
+async def claim_broadcast(room_id):
+    """True for exactly one caller, across processes, per BROADCAST_DELAY window of changes in a room.
+
+    That caller broadcasts the room's count once the window closes, so a reconnect storm
+    costs one broadcast per window instead of one per socket.
+    """
+    return await cache.aadd(f'chat:presence:{room_id}:broadcast', 1, BROADCAST_DELAY)
@@ -1,6 +1,7 @@
 from django.urls import path
-from .consumers import ChatroomConsumer
+from .consumers import ChatroomConsumer, NotificationConsumer
 
 websocket_urlpatterns = [
     path("ws/chatroom/<str:chatroom_name>", ChatroomConsumer.as_asgi()),
+    path("ws/notifications", NotificationConsumer.as_asgi()),
 ]
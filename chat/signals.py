@@ -0,0 +1,45 @@
+from django.db.models.signals import post_save, pre_delete, m2m_changed
+from django.dispatch import receiver
+from .context_processors import bump_chat_groups, invalidate_chat_nav
+from .models import ChatGroup, ChatReadCursor, GroupMessage
+
+
+@receiver(post_save, sender=GroupMessage)  #a new message lights up the unread dot of the room's members
+def track_new_message(sender, instance, created, **kwargs):
+    if created:
+        ChatGroup.objects.filter(pk=instance.group_id, latest_message_id__lt=instance.id).update(latest_message_id=instance.id)
+        ChatReadCursor.advance(instance.author_id, instance.group_id, instance.id)  # your own message is never unread
+        bump_chat_groups([instance.group_id])
+
+
+@receiver(post_save, sender=ChatGroup)  #renamed rooms show their new name
+@receiver(pre_delete, sender=ChatGroup)  #deleted rooms leave the menu
+def invalidate_chat_nav_on_group(sender, instance, **kwargs):
+    bump_chat_groups([instance.pk])
+
+
+@receiver(m2m_changed, sender=ChatGroup.members.through)
+def invalidate_chat_nav_on_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        if reverse:  # user.chat_groups.add(...): the user's menu and the other members' private chat names
+            invalidate_chat_nav([instance.pk])
+            bump_chat_groups(pk_set)
+        else:
+            invalidate_chat_nav(pk_set)
+            bump_chat_groups([instance.pk])
+    elif action == 'pre_clear':
+        if reverse:
+            invalidate_chat_nav([instance.pk])
+            bump_chat_groups(instance.chat_groups.values_list('id', flat=True))
+        else:
+            bump_chat_groups([instance.pk])
+
+
+@receiver(m2m_changed, sender=ChatGroup.members.through)  #new members get a cursor, so reading a room is a single UPDATE
+def start_read_cursors(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add' and pk_set:
+        if reverse:
+            cursors = [ChatReadCursor(user_id=instance.pk, group_id=group_id) for group_id in pk_set]
+        else:
+            cursors = [ChatReadCursor(user_id=user_id, group_id=instance.pk) for user_id in pk_set]
+        ChatReadCursor.objects.bulk_create(cursors, ignore_conflicts=True)
@@ -1,3 +1,586 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import time
+import uuid
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from fakeredis.aioredis import FakeConnection
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels_redis.core import RedisChannelLayer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from ligameet.models import Notification
+from ligameet.notifications import notification_group
+from ligameet.tests import LOCMEM_CACHE, QueryBudgetTestCase
+from users.middleware import QueryRecorder
+from . import flow, presence
+from .consumers import ChatroomConsumer, NotificationConsumer, pending_broadcasts
+from .ingest import message_buffer, next_message_id
+from .context_processors import ChatNav
+from .models import CHAT_HISTORY_PAGE, ChatGroup, ChatReadCursor, GroupMessage
+
+# The Redis channel layer tests use an in-process fakeredis server, or the real Redis at this URL when it is set
+TEST_CHANNEL_REDIS_URL = os.environ.get('TEST_CHANNEL_REDIS_URL')
+
+
+def redis_channel_layers():
+    """CHANNEL_LAYERS shaped like the production Redis layer, under a prefix of its own so runs cannot collide.
+
+    Without TEST_CHANNEL_REDIS_URL every layer built from it shares one fakeredis server,
+    which runs the layer's Lua scripts too, so separate workers still meet in one Redis.
+    """
+    if TEST_CHANNEL_REDIS_URL:
+        host = TEST_CHANNEL_REDIS_URL
+    else:
+        host = {'connection_class': FakeConnection, 'server': fakeredis.FakeServer()}
+    return {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [host], 'prefix': f'test-{uuid.uuid4().hex[:8]}', 'capacity': 500, 'expiry': 30},
+        },
+    }
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChatQueryBudgetTests(QueryBudgetTestCase):
+    def test_team_chatroom(self):
+        chat_group = ChatGroup.objects.get(team=self.league['team'])
+        response = self.get_within_budget(reverse('chatroom', args=[chat_group.group_name]), self.league['coach'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['chat_messages']), 5)
+        # Opening the room moves the coach's read cursor to the newest message
+        self.assertFalse(chat_group.has_unread_messages(self.league['coach']))
+        self.assertEqual(ChatReadCursor.last_read_for(self.league['coach'], chat_group), chat_group.latest_message_id)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChatNavTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob = User.objects.create_user('alice'), User.objects.create_user('bob')
+        self.room = ChatGroup.objects.create(groupchat_name='Team Room', admin=self.alice)
+        self.room.members.add(self.alice, self.bob)
+        self.private = ChatGroup.objects.create(is_private=True)
+        self.private.members.add(self.alice, self.bob)
+
+    def nav(self, user, queries=None):
+        with QueryRecorder() as recorded:
+            nav = ChatNav(user)
+            result = [chat['label'] for chat in nav], nav.data['has_unread']
+        if queries is not None:
+            self.assertEqual(recorded.count, queries)
+        return result
+
+    def test_built_in_fixed_queries_then_cached(self):
+        self.assertEqual(self.nav(self.alice, queries=3), (['Team Room', 'bob'], False))
+        self.assertEqual(self.nav(self.alice, queries=0), (['Team Room', 'bob'], False))
+
+    def test_new_message_and_read_invalidate(self):
+        self.nav(self.alice)
+        GroupMessage.objects.create(group=self.room, author=self.bob, body='hi')
+        self.assertEqual(self.nav(self.alice)[1], True)
+
+        self.alice.profile.role = 'Player'
+        self.alice.profile.save()
+        self.client.force_login(self.alice)
+        self.client.get(reverse('chatroom', args=[self.room.group_name]))
+        self.assertEqual(self.nav(self.alice)[1], False)
+
+    def test_room_changes_stale_every_member_without_deleting_their_menus(self):
+        self.nav(self.alice), self.nav(self.bob)
+        with mock.patch.object(cache, 'delete_many') as delete_many:
+            GroupMessage.objects.create(group=self.room, author=self.alice, body='hi')
+        delete_many.assert_not_called()
+        self.assertEqual(self.nav(self.bob)[1], True)
+        self.assertEqual(self.nav(self.alice)[1], False)
+
+        self.room.groupchat_name = 'Renamed'
+        self.room.save()
+        self.assertEqual(self.nav(self.bob, queries=3)[0], ['Renamed', 'alice'])
+
+    def test_membership_changes_invalidate(self):
+        carol = User.objects.create_user('carol')
+        self.assertEqual(self.nav(carol)[0], [])
+        self.room.members.add(carol)
+        self.assertEqual(self.nav(carol)[0], ['Team Room'])
+        carol.chat_groups.remove(self.room)
+        self.assertEqual(self.nav(carol)[0], [])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChatReadCursorTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob = User.objects.create_user('alice'), User.objects.create_user('bob')
+        self.room = ChatGroup.objects.create(groupchat_name='Team Room', admin=self.alice)
+        self.room.members.add(self.alice, self.bob)
+
+    def test_new_message_is_unread_for_the_others_only(self):
+        message = GroupMessage.objects.create(group=self.room, author=self.bob, body='hi')
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.latest_message_id, message.id)
+        self.assertTrue(self.room.has_unread_messages(self.alice))
+        self.assertFalse(self.room.has_unread_messages(self.bob))
+        self.assertEqual(list(ChatReadCursor.unread_groups(self.alice)), [self.room])
+        self.assertFalse(ChatReadCursor.unread_groups(self.bob).exists())
+
+    def test_advance_never_moves_back(self):
+        first = GroupMessage.objects.create(group=self.room, author=self.bob, body='one')
+        second = GroupMessage.objects.create(group=self.room, author=self.bob, body='two')
+        self.assertTrue(ChatReadCursor.advance(self.alice.id, self.room.id, second.id))
+        self.assertFalse(ChatReadCursor.advance(self.alice.id, self.room.id, first.id))
+        self.assertEqual(ChatReadCursor.last_read_for(self.alice, self.room), second.id)
+
+    def test_unread_counts_for_every_group_in_one_query(self):
+        other = ChatGroup.objects.create(groupchat_name='Other Room', admin=self.bob)
+        other.members.add(self.alice, self.bob)
+        first = GroupMessage.objects.create(group=self.room, author=self.bob, body='one')
+        for body in ('two', 'three'):
+            GroupMessage.objects.create(group=self.room, author=self.bob, body=body)
+        GroupMessage.objects.create(group=other, author=self.alice, body='mine')
+        ChatReadCursor.advance(self.alice.id, self.room.id, first.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(ChatReadCursor.unread_counts(self.alice), {self.room.id: 2})
+        self.assertEqual(ChatReadCursor.unread_counts(self.bob), {other.id: 1})
+
+    def test_member_without_a_cursor_has_read_nothing(self):
+        GroupMessage.objects.create(group=self.room, author=self.bob, body='one')
+        GroupMessage.objects.create(group=self.room, author=self.alice, body='two')
+        ChatReadCursor.objects.filter(user=self.alice).delete()  # e.g. rooms without messages when 0002 ran
+        self.assertEqual(ChatReadCursor.unread_counts(self.alice), {self.room.id: 1})
+        self.assertEqual(list(ChatReadCursor.unread_groups(self.alice)), [self.room])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob = User.objects.create_user('alice'), User.objects.create_user('bob')
+        self.alice.profile.role = 'Player'
+        self.alice.profile.save()
+        self.room = ChatGroup.objects.create(groupchat_name='Team Room', admin=self.bob)
+        self.room.members.add(self.alice, self.bob)
+        GroupMessage.objects.bulk_create(
+            GroupMessage(group=self.room, author=self.bob, body=f'message {i}') for i in range(CHAT_HISTORY_PAGE + 5)
+        )
+        self.client.force_login(self.alice)
+
+    def test_scrolls_back_a_page_at_a_time(self):
+        response = self.client.get(reverse('chatroom', args=[self.room.group_name]))
+        self.assertEqual(len(response.context['chat_messages']), CHAT_HISTORY_PAGE)
+        cursor = response.context['older_messages_cursor']
+        self.assertContains(response, 'id="older-messages"')
+
+        response = self.client.get(reverse('chat-history', args=[self.room.group_name]), {'cursor': cursor})
+        shown = [message.body for message in response.context['chat_messages']]
+        self.assertEqual(shown, [f'message {i}' for i in range(4, -1, -1)])  # the oldest five, newest first
+        self.assertIsNone(response.context['older_messages_cursor'])
+        self.assertNotContains(response, 'id="older-messages"')
+
+    def test_private_history_is_for_members_only(self):
+        private = ChatGroup.objects.create(is_private=True)
+        private.members.add(self.bob, User.objects.create_user('carol'))
+        response = self.client.get(reverse('chat-history', args=[private.group_name]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_private_room_is_not_read_by_outsiders(self):
+        private = ChatGroup.objects.create(is_private=True)
+        private.members.add(self.bob, User.objects.create_user('carol'))
+        GroupMessage.objects.create(group=private, author=self.bob, body='just us')
+        response = self.client.get(reverse('chatroom', args=[private.group_name]))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(ChatReadCursor.objects.filter(user=self.alice, group=private).exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PrivateChatTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob = User.objects.create_user('alice'), User.objects.create_user('bob')
+
+    def test_one_room_per_pair_whoever_starts_it(self):
+        room = ChatGroup.private_chat(self.alice, self.bob)
+        self.assertEqual(room.private_key, f'{self.alice.pk}-{self.bob.pk}')
+        self.assertEqual(set(room.members.all()), {self.alice, self.bob})
+        with self.assertNumQueries(1):
+            self.assertEqual(ChatGroup.private_chat(self.bob, self.alice), room)
+
+    def test_start_chat_redirects_to_the_existing_room(self):
+        room = ChatGroup.private_chat(self.alice, self.bob)
+        self.bob.profile.role = 'Player'
+        self.bob.profile.save()
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('start-chat', args=['alice']))
+        self.assertRedirects(response, reverse('chatroom', args=[room.group_name]), fetch_redirect_response=False)
+        self.assertEqual(ChatGroup.objects.filter(is_private=True).count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class NotificationConsumerTests(TestCase):
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    async def test_pushes_new_notifications_and_count_changes(self):
+        user = await sync_to_async(User.objects.create_user)('fan')
+        communicator, connected = await self.connect(user)
+        self.assertTrue(connected)
+
+        def notify_then_read():
+            with self.captureOnCommitCallbacks(execute=True):
+                notification = Notification.objects.create(user=user, message='Game on')
+            with self.captureOnCommitCallbacks(execute=True):
+                notification.mark_read()
+            return notification
+        notification = await sync_to_async(notify_then_read)()
+
+        pushed = await communicator.receive_json_from()
+        self.assertEqual(pushed['type'], 'notification')
+        self.assertEqual((pushed['notification']['id'], pushed['notification']['message']), (notification.id, 'Game on'))
+        self.assertEqual(pushed['unread_delta'], 1)
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'unread_count', 'unread_delta': -1})
+        await communicator.disconnect()
+
+    async def test_anonymous_users_are_turned_away(self):
+        communicator, connected = await self.connect(AnonymousUser())
+        self.assertFalse(connected)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChatroomConsumerTests(TransactionTestCase):
+    # database_sync_to_async closes connections between calls, which a TestCase transaction cannot survive
+    def setUp(self):
+        cache.clear()
+        message_buffer.messages = []
+        self.alice, self.bob, self.carol = (User.objects.create_user(name) for name in ('alice', 'bob', 'carol'))
+        self.alice.profile.FIRST_NAME = 'Alice'
+        self.alice.profile.save()
+        self.room = ChatGroup.objects.create(groupchat_name='Team Room', admin=self.alice)
+        self.room.members.add(self.alice, self.bob, self.carol)
+
+    async def join(self, user):
+        communicator = WebsocketCommunicator(ChatroomConsumer.as_asgi(), f'/ws/chatroom/{self.room.group_name}')
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'chatroom_name': self.room.group_name}}
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    async def drain(self, communicator):
+        await asyncio.gather(*pending_broadcasts)  # debounced online counts
+        while not await communicator.receive_nothing(timeout=0.05):
+            await communicator.receive_from()
+
+    async def test_message_saved_once_and_rendered_for_each_side(self):
+        sockets = []
+        for user in (self.alice, self.bob, self.carol):
+            communicator, connected = await self.join(user)
+            self.assertTrue(connected)
+            sockets.append(communicator)
+        for communicator in sockets:
+            await self.drain(communicator)  # online counts
+
+        alice, bob, carol = sockets
+        await alice.send_json_to({'body': 'Practice at six'})
+        author_html = await alice.receive_from()
+        self.assertIn('bg-green-200', author_html)
+        for communicator in (bob, carol):
+            html = await communicator.receive_from()
+            self.assertIn('Practice at six', html)
+            self.assertIn('@alice', html)
+        self.assertEqual(await sync_to_async(GroupMessage.objects.count)(), 1)
+
+        # What bob saw live is read once he leaves the room
+        await bob.disconnect()
+        message = await sync_to_async(GroupMessage.objects.get)()
+        self.assertEqual(await sync_to_async(ChatReadCursor.last_read_for)(self.bob, self.room), message.id)
+        for communicator in (alice, carol):
+            await communicator.disconnect()
+        await asyncio.gather(*pending_broadcasts)
+
+    async def test_joins_within_the_window_are_broadcast_once(self):
+        sockets = []
+        for user in (self.alice, self.bob, self.carol, self.carol):  # carol has two tabs open
+            communicator, connected = await self.join(user)
+            sockets.append(communicator)
+        await asyncio.gather(*pending_broadcasts)
+        for communicator in sockets:
+            html = await communicator.receive_from()
+            self.assertIn('id="online-count"', html)
+            self.assertEqual(html.split('<style>')[0].split()[-1], '2')  # three people online, counted by the others
+            self.assertTrue(await communicator.receive_nothing(timeout=0.05))
+
+        # Closing one of carol's tabs leaves her online, so nothing is broadcast
+        await sockets[3].disconnect()
+        self.assertEqual(pending_broadcasts, set())
+        self.assertEqual(
+            await presence.online_user_ids(self.room.id, [self.alice.id, self.bob.id, self.carol.id]),
+            {self.alice.id, self.bob.id, self.carol.id},
+        )
+        for communicator in sockets[:3]:
+            await communicator.disconnect()
+        await asyncio.gather(*pending_broadcasts)
+        self.assertEqual(await presence.online_user_ids(self.room.id, [self.alice.id, self.bob.id, self.carol.id]), set())
+
+    async def test_write_behind_broadcasts_first_and_saves_in_batches(self):
+        with self.settings(CHAT_WRITE_BEHIND=True, CHAT_FLUSH_INTERVAL=60, CHAT_FLUSH_BATCH=3):
+            alice, connected = await self.join(self.alice)
+            bob, connected = await self.join(self.bob)
+            for communicator in (alice, bob):
+                await self.drain(communicator)
+
+            for body in ('one', 'two', 'three'):
+                await alice.send_json_to({'body': body})
+                self.assertIn(body, await alice.receive_from())
+                self.assertIn(body, await bob.receive_from())
+                if body == 'two':
+                    self.assertEqual(await sync_to_async(GroupMessage.objects.count)(), 0)  # delivered, not saved yet
+            await bob.receive_nothing(timeout=0.05)
+            await message_buffer.flusher  # the third message filled the batch
+
+            messages = await sync_to_async(list)(GroupMessage.objects.order_by('id').values_list('id', 'body'))
+            self.assertEqual([body for _, body in messages], ['one', 'two', 'three'])
+            await sync_to_async(self.room.refresh_from_db)()
+            self.assertEqual(self.room.latest_message_id, messages[-1][0])
+            self.assertEqual(await sync_to_async(ChatReadCursor.last_read_for)(self.alice, self.room), messages[-1][0])
+            for communicator in (alice, bob):
+                await communicator.disconnect()
+            await asyncio.gather(*pending_broadcasts)
+
+    def test_write_behind_saves_what_is_buffered_at_exit(self):
+        with self.settings(CHAT_WRITE_BEHIND=True):
+            message_buffer.messages.append(
+                GroupMessage(id=next_message_id(), group=self.room, author=self.alice, body='last words')
+            )
+            message_buffer.flush_at_exit()
+        self.assertEqual(list(GroupMessage.objects.values_list('body', flat=True)), ['last words'])
+        self.assertEqual(message_buffer.messages, [])
+
+    async def test_write_behind_drops_rows_that_keep_failing(self):
+        with self.settings(CHAT_WRITE_BEHIND=True, CHAT_FLUSH_RETRIES=2):
+            taken = await sync_to_async(GroupMessage.objects.create)(group=self.room, author=self.alice, body='first')
+            good = GroupMessage(id=await sync_to_async(next_message_id)(), group=self.room, author=self.bob, body='kept')
+            clash = GroupMessage(id=taken.id, group=self.room, author=self.carol, body='id clash')
+            message_buffer.messages = [clash, good]
+
+            for _ in range(2):
+                with self.assertLogs('chat.ingest', 'ERROR'):
+                    await message_buffer.flush()
+                self.assertEqual(message_buffer.messages, [clash, good])  # kept for a retry
+            with self.assertLogs('chat.ingest', 'ERROR') as logs:
+                await message_buffer.flush()
+            self.assertEqual(message_buffer.messages, [])
+            self.assertTrue(any(f'Dropped chat message {taken.id}' in line for line in logs.output))
+
+        bodies = await sync_to_async(list)(GroupMessage.objects.order_by('id').values_list('body', flat=True))
+        self.assertEqual(bodies, ['first', 'kept'])
+
+    async def test_floods_are_throttled_and_oversized_frames_refused(self):
+        with self.settings(CHAT_SOCKET_RATE=0.001, CHAT_SOCKET_BURST=2):
+            alice, connected = await self.join(self.alice)
+            await self.drain(alice)
+            for n in range(4):
+                await alice.send_json_to({'body': f'spam {n}'})
+            frames = ''.join([await alice.receive_from() for _ in range(3)])
+            self.assertIn('spam 0', frames)
+            self.assertIn('spam 1', frames)
+            self.assertEqual(frames.count('too fast'), 1)  # once for the streak, not once per refused frame
+            self.assertTrue(await alice.receive_nothing(timeout=0.05))
+            self.assertEqual(await sync_to_async(GroupMessage.objects.count)(), 2)
+            self.assertEqual((await sync_to_async(flow.flow_metrics)())['throttled'], 2)
+
+            await alice.send_to(text_data=json.dumps({'body': 'x' * flow.MAX_FRAME_BYTES}))
+            self.assertEqual(await alice.receive_output(), {'type': 'websocket.close', 'code': 1009})
+            await alice.disconnect()
+            await asyncio.gather(*pending_broadcasts)
+
+    async def test_slow_reader_loses_its_oldest_frames(self):
+        # A server whose send waits for the client to read, as uvicorn's does; Daphne's never waits
+        reading = asyncio.Event()
+        reading.set()
+        consumer = ChatroomConsumer.as_asgi()
+
+        async def behind_slow_transport(scope, receive, send):
+            async def send_when_read(message):
+                if message['type'] == 'websocket.send':
+                    await reading.wait()
+                await send(message)
+            return await consumer(scope, receive, send_when_read)
+
+        with self.settings(CHAT_OUTBOX_SIZE=3):
+            bob = WebsocketCommunicator(behind_slow_transport, f'/ws/chatroom/{self.room.group_name}')
+            bob.scope['user'] = self.bob
+            bob.scope['url_route'] = {'kwargs': {'chatroom_name': self.room.group_name}}
+            self.assertTrue((await bob.connect())[0])
+            await self.drain(bob)
+
+            reading.clear()
+            with self.assertLogs('chat.flow', 'WARNING'):
+                for n in range(10):
+                    await get_channel_layer().group_send(self.room.group_name, {
+                        'type': 'message_handler', 'message_id': n + 1, 'author_id': self.alice.id,
+                        'author_html': f'm{n}', 'html': f'm{n}',
+                    })
+                self.assertTrue(await bob.receive_nothing(timeout=0.2))
+            reading.set()
+
+            # m0 was already being sent; of the rest, the newest that fit the outbox
+            self.assertEqual([await bob.receive_from() for _ in range(4)], ['m0', 'm7', 'm8', 'm9'])
+            self.assertTrue(await bob.receive_nothing(timeout=0.05))
+            self.assertEqual((await sync_to_async(flow.flow_metrics)())['dropped'], 6)
+            await bob.disconnect()
+            await asyncio.gather(*pending_broadcasts)
+
+    async def test_unknown_rooms_and_anonymous_users_are_turned_away(self):
+        _, connected = await self.join(AnonymousUser())
+        self.assertFalse(connected)
+        self.room.group_name = 'no-such-room'
+        _, connected = await self.join(self.alice)
+        self.assertFalse(connected)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PresenceTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    async def test_counts_sockets_per_user(self):
+        first, second = presence.SocketPresence(1, 7), presence.SocketPresence(1, 7)
+        self.assertTrue(await first.join())
+        self.assertFalse(await second.join())  # second tab
+        self.assertEqual(await presence.online_user_ids(1, [7, 8]), {7})
+        self.assertFalse(await first.leave())
+        self.assertTrue(await second.leave())
+        self.assertEqual(await presence.online_user_ids(1, [7, 8]), set())
+
+    async def test_counts_are_rebuilt_every_window(self):
+        window = presence.current_window()
+        tabs = [presence.SocketPresence(1, 7) for _ in range(3)]
+        for tab in tabs:
+            await tab.join()
+        await cache.adelete(presence.presence_key(1, 7, window))  # evicted
+
+        # The next window counts every socket still open, whatever happened to the last one
+        with mock.patch.object(presence, 'current_window', return_value=window + 1):
+            for tab in tabs:
+                await tab.heartbeat()
+            self.assertEqual(await cache.aget(presence.presence_key(1, 7, window + 1)), 3)
+            self.assertFalse(await tabs[0].leave())
+            self.assertFalse(await tabs[1].leave())
+            self.assertEqual(await presence.online_user_ids(1, [7]), {7})
+            self.assertTrue(await tabs[2].leave())
+
+    async def test_sockets_of_a_crashed_process_stop_counting(self):
+        window = presence.current_window()
+        await presence.SocketPresence(1, 7).join()  # never beats or leaves again
+        live = presence.SocketPresence(1, 8)
+        await live.join()
+        with mock.patch.object(presence, 'current_window', return_value=window + 2):
+            await live.heartbeat()
+            self.assertEqual(await presence.online_user_ids(1, [7, 8]), {8})
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class FlowTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(CHAT_USER_RATE=0.001, CHAT_USER_BURST=3)
+    async def test_user_bucket_is_shared_and_exact_under_concurrency(self):
+        taken = await asyncio.gather(*(flow.take_user_token(7) for _ in range(10)))
+        self.assertEqual(taken.count(True), 3)
+        self.assertFalse(await flow.take_user_token(7))
+        self.assertTrue(await flow.take_user_token(8))  # someone else's bucket
+
+    async def test_outbox_drops_oldest_and_coalesces(self):
+        sent, release = [], asyncio.Event()
+
+        async def send(text_data):
+            await release.wait()  # a client that is not reading
+            sent.append(text_data)
+
+        outbox = flow.Outbox(send, size=2)
+        outbox.put('m0')
+        await asyncio.sleep(0)  # the sender takes m0 and is stuck on it
+        self.assertIsNone(outbox.put('count 1', coalesce='online_count'))
+        self.assertIsNone(outbox.put('m1'))
+        self.assertEqual(outbox.put('count 2', coalesce='online_count'), 'coalesced')
+        self.assertEqual(outbox.put('m2'), 'dropped')
+        release.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(sent, ['m0', 'm1', 'm2'])  # the queued count went with the oldest frame
+
+        outbox.put('count 3', coalesce='online_count')
+        await asyncio.sleep(0.01)
+        self.assertEqual(sent[-1], 'count 3')
+        outbox.close()
+
+    async def test_outbox_send_failure_is_logged_and_closes_the_socket(self):
+        closed = asyncio.Event()
+
+        async def send(text_data):
+            raise RuntimeError('socket gone')
+
+        async def close():
+            closed.set()
+
+        outbox = flow.Outbox(send, size=5, on_error=close)
+        with self.assertLogs('chat.flow', 'ERROR'):
+            outbox.put('m0')
+            outbox.put('m1')
+            await asyncio.wait_for(closed.wait(), 1)
+        self.assertEqual(len(outbox.frames), 0)
+        self.assertTrue(outbox.sender.done())
+
+
+class RedisChannelLayerTests(SimpleTestCase):
+    """Broadcasts over the Redis layer, with one layer instance per simulated Daphne worker."""
+    BROADCASTS = 300
+
+    def setUp(self):
+        self.channel_layers = redis_channel_layers()
+
+    def worker(self):
+        return RedisChannelLayer(**self.channel_layers['default']['CONFIG'])
+
+    async def test_group_send_reaches_sockets_on_every_worker(self):
+        workers = [self.worker() for _ in range(3)]
+        channels = []
+        for worker in workers:
+            channel = await worker.new_channel()
+            await worker.group_add('room', channel)
+            channels.append(channel)
+
+        started = time.perf_counter()
+        for n in range(self.BROADCASTS):
+            await workers[0].group_send('room', {'type': 'message_handler', 'n': n})
+        for worker, channel in zip(workers, channels):
+            received = [(await worker.receive(channel))['n'] for _ in range(self.BROADCASTS)]
+            self.assertEqual(received, list(range(self.BROADCASTS)))
+        elapsed = time.perf_counter() - started
+        # Generous on purpose: catches a layer that degrades to per-message round trips per socket, not jitter
+        self.assertLess(elapsed, 10, f'{self.BROADCASTS} broadcasts to {len(workers)} workers took {elapsed:.2f}s')
+
+        await workers[0].flush()
+        for worker in workers:
+            await worker.close_pools()
+
+    async def test_notification_pushed_from_another_worker(self):
+        with override_settings(CHANNEL_LAYERS=self.channel_layers):
+            communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications')
+            communicator.scope['user'] = User(id=4242, username='fan')  # the consumer never reads it from the database
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            other_worker = self.worker()
+            await other_worker.group_send(notification_group(communicator.scope['user'].id), {
+                'type': 'notification.count', 'unread_delta': 1,
+            })
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'unread_count', 'unread_delta': 1})
+            await communicator.disconnect()
+            await other_worker.flush()
+            await other_worker.close_pools()
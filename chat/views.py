@@ -2,14 +2,18 @@ from django.shortcuts import redirect, render, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.http import Http404
 from django.contrib import messages
+from django.db.models import Prefetch
+from users.middleware import query_budget
 from .models import *
+from .context_processors import invalidate_chat_nav
 from .forms import * 
 
 @login_required
+@query_budget(12)
 def chat_view(request, chatroom_name='public-chat'):
-    chat_group = get_object_or_404(ChatGroup, group_name=chatroom_name)
-    chat_group.chat_messages.filter(is_read=False).exclude(author=request.user).update(is_read=True)
-    chat_messages = chat_group.chat_messages.all()[:30]
+    # Members and message authors are shown with their profile pictures, so load the profiles with them
+    members = Prefetch('members', queryset=User.objects.select_related('profile'))
+    chat_group = get_object_or_404(ChatGroup.objects.prefetch_related(members), group_name=chatroom_name)
     form = ChatmessageCreateForm()
   
     other_user = None
@@ -25,6 +29,11 @@ def chat_view(request, chatroom_name='public-chat'):
         if request.user not in chat_group.members.all():
             chat_group.members.add(request.user) #add
 
+    # Opening the room reads everything in it; only this user's unread dot can change
+    if chat_group.latest_message_id and ChatReadCursor.advance(request.user.id, chat_group.id, chat_group.latest_message_id):
+        invalidate_chat_nav([request.user.id])
+    chat_messages = GroupMessage.history(chat_group)
+
     if request.htmx:
         form = ChatmessageCreateForm(request.POST)
         if form.is_valid:
@@ -40,6 +49,7 @@ def chat_view(request, chatroom_name='public-chat'):
 
     context = {
         'chat_messages': chat_messages, 
+        'older_messages_cursor': chat_messages.next_token,
         'form': form,
         'other_user': other_user,
         'chatroom_name': chatroom_name, #to establish websocket connection 
@@ -49,17 +59,24 @@ def chat_view(request, chatroom_name='public-chat'):
     return render(request, 'chat/chat.html', context)
 
 @login_required
-def get_or_create_chatroom(request, username):
-    other_user = User.objects.get(username = username)
-    my_private_chatrooms = request.user.chat_groups.filter(is_private=True)
-
-    if my_private_chatrooms.exists():
-        for chatroom in my_private_chatrooms:
-            if other_user in chatroom.members.all(): #check if user is member of chatrooom
-                return redirect('chatroom', chatroom.group_name)
+@query_budget(6)
+def chat_history_view(request, chatroom_name):
+    # Scroll-back: the page of messages before `cursor`, rendered above the ones already shown
+    chat_group = get_object_or_404(ChatGroup, group_name=chatroom_name)
+    if chat_group.is_private and not chat_group.members.filter(pk=request.user.pk).exists():
+        raise Http404()
+    chat_messages = GroupMessage.history(chat_group, request.GET.get('cursor'))
+    context = {
+        'chat_messages': chat_messages,
+        'older_messages_cursor': chat_messages.next_token,
+        'chat_group': chat_group,
+    }
+    return render(request, 'chat/partials/chat_history.html', context)
 
-    chatroom = ChatGroup.objects.create( is_private = True )
-    chatroom.members.add(other_user, request.user)   
+@login_required
+def get_or_create_chatroom(request, username):
+    other_user = get_object_or_404(User, username=username)
+    chatroom = ChatGroup.private_chat(request.user, other_user)
     return redirect('chatroom', chatroom.group_name)
 
 @login_required
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Sport, Event, Wallet, File, Team, TeamParticipant, TeamEvent, Match, Subscription, TeamRegistrationFee, SportsEvent, TeamMatch, UserMatch, VolleyballStats, SportProfile, UserRegistrationFee, Payment, Transaction, JoinRequest, Activity, Notification, Invitation, TeamCategory, SportDetails, PlayerRecruitment, Invoice, WalletTransaction, BracketData, BasketballStats, PlayerStats
+from .models import Sport, Event, Wallet, File, Team, TeamParticipant, TeamEvent, Match, Subscription, TeamRegistrationFee, SportsEvent, TeamMatch, UserMatch, VolleyballStats, SportProfile, UserRegistrationFee, Payment, Transaction, JoinRequest, Activity, Notification, Invitation, TeamCategory, SportDetails, PlayerRecruitment, Invoice, WalletTransaction, BracketData, BasketballStats, PlayerStats, OrganizerPayout, ArchivedNotification
 
 class JoinRequestAdmin(admin.ModelAdmin):
     list_display = ('USER_ID', 'TEAM_ID', 'STATUS', 'REQUEST_DATE')
@@ -35,6 +35,7 @@ admin.site.register(Transaction)
 admin.site.register(JoinRequest)
 admin.site.register(Activity)
 admin.site.register(Notification)
+admin.site.register(ArchivedNotification)
 admin.site.register(Invitation)
 admin.site.register(TeamCategory)
 admin.site.register(SportDetails)
@@ -44,6 +45,7 @@ admin.site.register(WalletTransaction)
 admin.site.register(BracketData)
 admin.site.register(BasketballStats)
 admin.site.register(PlayerStats)
+admin.site.register(OrganizerPayout)
 
  
 
@@ -0,0 +1,68 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db.models import Count, Exists, OuterRef, Prefetch
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from .models import Event, SportDetails, TeamCategory
+from .pagination import CursorPaginator
+
+HOME_FEED_PAGE_SIZE = 6
+HOME_FEED_TIMEOUT = 300  # seconds; invalidation normally happens long before this
+HOME_FEED_VERSION_KEY = 'ligameet:home_feed:version'
+
+
+def home_feed_events(sport_ids=None):
+    """Posted, non-cancelled events, newest first, limited to `sport_ids` when given.
+
+    The sport filter is an EXISTS instead of a join, so no DISTINCT is needed, and
+    pages are keyset-paginated on (EVENT_DATE_START, id). Sports and category
+    summaries (with each SportDetails' registered team count) are prefetched, so a
+    page costs the same fixed number of queries whatever its size.
+    """
+    events = Event.objects.filter(IS_POSTED=True).exclude(EVENT_STATUS='cancelled')
+    if sport_ids is not None:
+        events = events.filter(Exists(
+            Event.SPORT.through.objects.filter(event=OuterRef('pk'), sport_id__in=sport_ids)
+        ))
+
+    return with_category_summaries(events)
+
+
+def with_category_summaries(events):
+    """Prefetches what an event card shows: sports, categories and each SportDetails' registered team count."""
+    return events.prefetch_related(
+        'SPORT',
+        Prefetch('team_categories', queryset=TeamCategory.objects.select_related('sport').prefetch_related(
+            Prefetch('sport_details', queryset=SportDetails.objects.annotate(teams_registered=Count('teams')))
+        )),
+    )
+
+
+def render_home_feed(sport_ids, cursor):
+    """Returns the rendered event grid and pagination for one page, cached per sport set and cursor."""
+    version = cache.get_or_set(HOME_FEED_VERSION_KEY, int(time.time() * 1000), None)
+    sport_key = 'all' if sport_ids is None else '-'.join(str(sport_id) for sport_id in sorted(sport_ids)) or 'none'
+    page_key = hashlib.md5(cursor.encode()).hexdigest() if cursor else 'first'
+    cache_key = f'ligameet:home_feed:{version}:{sport_key}:{page_key}'
+
+    html = cache.get(cache_key)
+    if html is None:
+        paginator = CursorPaginator(home_feed_events(sport_ids), ('-EVENT_DATE_START', '-id'), HOME_FEED_PAGE_SIZE)
+        page_obj = paginator.page(cursor)
+        html = render_to_string('ligameet/partials/home_feed.html', {
+            'page_obj': page_obj,
+            'user_sports': sport_ids,
+        })
+        cache.set(cache_key, html, HOME_FEED_TIMEOUT)
+    return mark_safe(html)
+
+
+def invalidate_home_feed():
+    """Drops every cached feed page by moving to a new version number."""
+    try:
+        cache.incr(HOME_FEED_VERSION_KEY)
+    except ValueError:
+        # The version was evicted; a timestamp cannot collide with versions still cached
+        cache.set(HOME_FEED_VERSION_KEY, int(time.time() * 1000), None)
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ligameet.models import ArchivedNotification
+
+
+class Command(BaseCommand):
+    help = 'Move read notifications older than --days into the archive table, in batches; run it periodically'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Archive read notifications created more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Notifications moved per transaction')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days and --batch-size must be positive')
+        before = timezone.now() - timedelta(days=options['days'])
+        moved = ArchivedNotification.archive(before, batch_size=options['batch_size'])
+        self.stdout.write(f"Archived {moved} read notifications created before {before:%Y-%m-%d %H:%M}")
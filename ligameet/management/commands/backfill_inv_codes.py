@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from users.models import Profile, inv_code_for
+
+
+class Command(BaseCommand):
+    help = 'Give every profile without an invitation code the one derived from its user id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reissue', action='store_true', help='Also replace the old random codes (invalidates codes already shared)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.all() if options['reissue'] else Profile.objects.filter(Q(INV_CODE__isnull=True) | Q(INV_CODE=''))
+        profiles = profiles.order_by('id').only('id', 'user_id', 'INV_CODE')
+
+        updated = 0
+        last_id = 0
+        while True:
+            # Keyset batches, so rows that get a code never shift the next batch
+            batch = [profile for profile in profiles.filter(id__gt=last_id)[:options['batch_size']]]
+            if not batch:
+                break
+            last_id = batch[-1].id
+            changed = [profile for profile in batch if profile.INV_CODE != inv_code_for(profile.user_id)]
+            for profile in changed:
+                profile.INV_CODE = inv_code_for(profile.user_id)
+            with transaction.atomic():
+                Profile.objects.bulk_update(changed, ['INV_CODE'])
+            updated += len(changed)
+
+        self.stdout.write(f"Assigned invitation codes to {updated} profiles")
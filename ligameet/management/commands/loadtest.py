@@ -0,0 +1,369 @@
+import asyncio
+import contextvars
+import json
+import random
+import subprocess
+import time
+from urllib.parse import urlencode
+
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from chat.flow import flow_metrics
+from chat.ingest import message_buffer
+from chat.models import ChatGroup
+from ligameet.models import Event, Team, TeamParticipant, BasketballStats, VolleyballStats
+
+# Which user each scenario logs in as, and the weighted pages or messages it loops over
+SCENARIOS = {
+    'player': [(6, 'home'), (4, 'event_details')],
+    'coach': [(3, 'coach_dashboard'), (1, 'event_details')],
+    'scorekeeper': [(3, 'scoreboard'), (1, 'edit_player_stats')],
+    'chat': [(1, 'chat_message')],
+}
+DEFAULT_MIX = 'player=10,coach=3,scorekeeper=2,chat=5'
+CHAT_ROOM_SIZE = 5  # chat users per room, so every message fans out to other open sockets
+
+# The tally of the request or socket a query runs for; set per ASGI scope and copied into sync_to_async threads
+current_tally = contextvars.ContextVar('loadtest_tally', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    tally = current_tally.get()
+    if tally is not None:
+        tally['queries'] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def tallied(application):
+    """Wraps the ASGI app so every query run on behalf of a scope lands in scope['loadtest.tally']."""
+    async def app(scope, receive, send):
+        current_tally.set(scope.get('loadtest.tally'))
+        return await application(scope, receive, send)
+    return app
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class Command(BaseCommand):
+    help = 'Drive cap2.asgi.application in-process with a mix of browsing, dashboard, scorekeeping and chat users and report latency percentiles, throughput and queries per request as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Virtual users per scenario ({", ".join(SCENARIOS)}), e.g. "{DEFAULT_MIX}"')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run for')
+        parser.add_argument('--seed', type=int, default=1, help='Seed for picking users, pages and actions')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for one response before counting it as an error')
+        parser.add_argument('--output', default='loadtest.json', help='Where to write the JSON report')
+        parser.add_argument('--compare', help='A previous JSON report to print p95 and query-count changes against')
+        parser.add_argument('--write-behind', action='store_true', help='Run chat with CHAT_WRITE_BEHIND on, whatever the settings say')
+        parser.add_argument(
+            '--allow-writes', action='store_true',
+            help='Run even with DEBUG off; the run logs users in, posts chat messages and edits player stats in the database',
+        )
+        parser.add_argument(
+            '--chat-rate-limits', action='store_true',
+            help="Keep the chat rate limits on; by default they are lifted, since chat users send as fast as their messages come back",
+        )
+
+    def handle(self, *args, **options):
+        if not (options['allow_writes'] or settings.DEBUG):
+            database = connections['default'].settings_dict
+            raise CommandError(
+                f"DEBUG is off, so this may be a live database ({database['ENGINE']} {database['NAME']}). "
+                "The load test writes sessions, chat messages and player stats to it; pass --allow-writes to run anyway"
+            )
+        try:
+            mix = {name: int(count) for name, count in (part.split('=') for part in options['mix'].split(',') if part)}
+        except ValueError:
+            raise CommandError(f"--mix must look like {DEFAULT_MIX}")
+        unknown = set(mix) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        self.rng = random.Random(options['seed'])
+        self.timeout = options['timeout']
+        self.host = next((host for host in settings.ALLOWED_HOSTS if host not in ('*', '') and not host.startswith('.')), 'localhost')
+        self.samples = {}  # action -> [(seconds, queries, status), ...]
+        self.chat_tallies = []
+
+        # The ORM cannot be used from the event loop, so users, sessions and targets are prepared up front
+        self.targets = self.load_targets()
+        users = self.virtual_users(mix)
+
+        from cap2.asgi import application  # Import here so the settings are loaded before the ASGI app is built
+        self.application = tallied(application)
+
+        connection_created.connect(install_query_counter)
+        for connection in connections.all():
+            install_query_counter(connection)
+        try:
+            overrides = {}
+            if options['write_behind']:
+                overrides['CHAT_WRITE_BEHIND'] = True
+            if not options['chat_rate_limits']:
+                overrides.update(CHAT_SOCKET_RATE=None, CHAT_USER_RATE=None)
+            with override_settings(**overrides):
+                self.write_behind = settings.CHAT_WRITE_BEHIND
+                self.rate_limited = settings.CHAT_SOCKET_RATE is not None
+                flow_before = flow_metrics()
+                started = time.perf_counter()
+                asyncio.run(self.run(users, options['duration']))
+                elapsed = time.perf_counter() - started
+                flow_after = flow_metrics()
+            self.chat_flow = {metric: flow_after[metric] - flow_before[metric] for metric in flow_after}
+        finally:
+            connection_created.disconnect(install_query_counter)
+            for connection in connections.all():
+                if count_query in connection.execute_wrappers:
+                    connection.execute_wrappers.remove(count_query)
+
+        report = self.report(mix, options, elapsed)
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.print_report(report)
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.print_comparison(json.load(f), report)
+        self.stdout.write(f"Report written to {options['output']}")
+
+    def load_targets(self):
+        targets = {
+            'events': list(Event.objects.filter(IS_POSTED=True).order_by('id').values_list('id', flat=True)[:500]),
+            'players': list(TeamParticipant.objects.order_by('id').values_list('USER_ID', flat=True)[:500]),
+            'coaches': list(Team.objects.order_by('id').values_list('COACH_ID', flat=True).distinct()[:500]),
+            'stats': [
+                (stats.player_stats.match_id, sport, stats.id, stats.player_stats.match.sport_details.team_category.event.EVENT_ORGANIZER_id)
+                for sport, model in (('basketball', BasketballStats), ('volleyball', VolleyballStats))
+                for stats in model.objects.select_related('player_stats__match__sport_details__team_category__event').order_by('id')[:250]
+            ],
+            'rooms': list(ChatGroup.objects.filter(team__isnull=False).order_by('id')[:100]),
+        }
+        missing = [name for name, found in targets.items() if not found]
+        if missing:
+            raise CommandError(f"Nothing to load test with (no {', '.join(missing)}); run manage.py seed_league first")
+        return targets
+
+    def virtual_users(self, mix):
+        """Picks a user and a logged-in session for every virtual user, deterministically from --seed."""
+        users = []
+        rooms = iter(())
+        for scenario, count in mix.items():
+            for n in range(count):
+                user = {'scenario': scenario, 'name': f'{scenario}-{n}'}
+                if scenario == 'player':
+                    user['user_id'] = self.rng.choice(self.targets['players'])
+                elif scenario == 'coach':
+                    user['user_id'] = self.rng.choice(self.targets['coaches'])
+                elif scenario == 'scorekeeper':
+                    # A scorekeeper is an organizer keeping score for the matches of their own events
+                    user['user_id'] = self.rng.choice(self.targets['stats'])[3]
+                    user['stats'] = [stats for stats in self.targets['stats'] if stats[3] == user['user_id']]
+                elif scenario == 'chat':
+                    if n % CHAT_ROOM_SIZE == 0:
+                        room = self.rng.choice(self.targets['rooms'])
+                        rooms = iter(list(room.members.order_by('id').values_list('id', flat=True)))
+                    user['room'] = room.group_name
+                    user['user_id'] = next(rooms, room.admin_id)
+                users.append(user)
+
+        sessions = {}
+        for user in users:
+            if user['user_id'] not in sessions:
+                client = Client()
+                client.force_login(User.objects.get(pk=user['user_id']))
+                sessions[user['user_id']] = client.cookies[settings.SESSION_COOKIE_NAME].value
+            csrf_token = get_random_string(32)
+            user['csrf_token'] = csrf_token
+            user['cookie'] = f"{settings.SESSION_COOKIE_NAME}={sessions[user['user_id']]}; {settings.CSRF_COOKIE_NAME}={csrf_token}"
+        return users
+
+    async def run(self, users, duration):
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            self.chat_user(user, deadline) if user['scenario'] == 'chat' else self.http_user(user, deadline)
+            for user in users
+        ))
+        await message_buffer.flush()  # so a write-behind run ends with everything it sent saved
+
+    def record(self, action, seconds, queries, status):
+        self.samples.setdefault(action, []).append((seconds, queries, status))
+
+    async def http_user(self, user, deadline):
+        rng = random.Random(f"{self.rng.random()}-{user['name']}")
+        actions = SCENARIOS[user['scenario']]
+        while time.perf_counter() < deadline:
+            action = rng.choices([name for weight, name in actions], weights=[weight for weight, name in actions])[0]
+            method, path, body = self.http_request(action, user, rng)
+            headers = [
+                (b'host', self.host.encode()), (b'cookie', user['cookie'].encode()),
+                (b'x-csrftoken', user['csrf_token'].encode()),
+            ]
+            if body:
+                headers.append((b'content-type', b'application/x-www-form-urlencoded'))
+            tally = {'queries': 0}
+            started = time.perf_counter()
+            communicator = HttpCommunicator(self.application, method, path, body, headers)
+            communicator.scope['loadtest.tally'] = tally
+            try:
+                response = await communicator.get_response(timeout=self.timeout)
+                status = response['status']
+            except Exception:
+                status = 'error'
+            elapsed = time.perf_counter() - started
+            await communicator.wait(self.timeout)
+            self.record(action, elapsed, tally['queries'], status)
+
+    def http_request(self, action, user, rng):
+        if action == 'home':
+            return 'GET', reverse('home'), b''
+        if action == 'event_details':
+            return 'GET', reverse('event-details', args=[rng.choice(self.targets['events'])]), b''
+        if action == 'coach_dashboard':
+            return 'GET', reverse('coach-dashboard'), b''
+        match_id, sport, stats_id, organizer_id = rng.choice(user['stats'])
+        if action == 'scoreboard':
+            return 'GET', reverse('scoreboard', args=[match_id]), b''
+        fields = ('points', 'rebounds', 'assists', 'blocks', 'steals', 'turnovers', 'three_pointers_made', 'free_throws_made') \
+            if sport == 'basketball' else ('kills', 'blocks', 'blocks_score', 'digs', 'service_aces', 'attack_errors', 'reception_errors', 'assists')
+        body = urlencode({field: rng.randint(0, 20) for field in fields}).encode()
+        return 'POST', reverse('edit_player_stats', args=[match_id, sport, stats_id]), body
+
+    async def chat_user(self, user, deadline):
+        """Sends a message and waits for its own broadcast to come back, over and over.
+
+        Queries are counted per socket, so a message's cost includes rendering it for every
+        other socket in the room; the report divides the room's total by messages sent.
+        """
+        tally = {'queries': 0}
+        self.chat_tallies.append(tally)
+        communicator = WebsocketCommunicator(self.application, f"/ws/chatroom/{user['room']}", headers=[
+            (b'host', self.host.encode()), (b'origin', f'http://{self.host}'.encode()), (b'cookie', user['cookie'].encode()),
+        ])
+        communicator.scope['loadtest.tally'] = tally
+        started = time.perf_counter()
+        connected, code = await communicator.connect(timeout=self.timeout)
+        self.record('chat_connect', time.perf_counter() - started, tally['queries'], 101 if connected else code or 'error')
+        if not connected:
+            return
+        tally['connect_queries'] = tally['queries']
+
+        sent = 0
+        try:
+            while time.perf_counter() < deadline:
+                marker = f"{user['name']}:{sent}"
+                started = time.perf_counter()
+                await communicator.send_json_to({'body': marker})
+                status = 'error'
+                try:
+                    while True:
+                        frame = await communicator.receive_from(timeout=self.timeout)
+                        if marker in frame:
+                            status = 200
+                            break
+                        if 'id="chat_notice"' in frame:  # throttled, with --chat-rate-limits
+                            status = 429
+                            break
+                except Exception:
+                    pass
+                self.record('chat_message', time.perf_counter() - started, None, status)
+                sent += 1
+                if status == 'error':
+                    break
+                if status == 429:
+                    await asyncio.sleep(1)  # only the first refusal of a streak is answered, so wait for tokens
+        finally:
+            tally['messages'] = sent
+            await communicator.disconnect(timeout=self.timeout)
+
+    def report(self, mix, options, elapsed):
+        actions = {}
+        for action, samples in sorted(self.samples.items()):
+            latencies = sorted(seconds * 1000 for seconds, queries, status in samples)
+            statuses = {}
+            for seconds, queries, status in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            queries = [queries for seconds, queries, status in samples if queries is not None]
+            if action == 'chat_message':
+                messages = sum(tally.get('messages', 0) for tally in self.chat_tallies)
+                room_queries = sum(tally['queries'] - tally.get('connect_queries', tally['queries']) for tally in self.chat_tallies)
+                queries_per_request = round(room_queries / messages, 2) if messages else None
+            else:
+                queries_per_request = round(sum(queries) / len(queries), 2) if queries else None
+            actions[action] = {
+                'requests': len(samples),
+                'errors': sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 400),
+                'statuses': statuses,
+                'throughput_rps': round(len(samples) / elapsed, 2),
+                'p50_ms': round(percentile(latencies, 50), 2),
+                'p95_ms': round(percentile(latencies, 95), 2),
+                'p99_ms': round(percentile(latencies, 99), 2),
+                'max_ms': round(latencies[-1], 2),
+                'queries_per_request': queries_per_request,
+                'max_queries': max(queries) if queries else None,
+            }
+
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        latencies = sorted(seconds * 1000 for samples in self.samples.values() for seconds, queries, status in samples)
+        return {
+            'commit': commit,
+            'started_at': timezone.now().isoformat(),
+            'database': connections['default'].vendor,
+            'channel_layer': settings.CHANNEL_LAYERS['default']['BACKEND'],
+            'chat_write_behind': self.write_behind,
+            'chat_rate_limited': self.rate_limited,
+            'chat_flow': self.chat_flow,  # frames throttled, dropped, coalesced or refused during the run
+            'mix': mix,
+            'seed': options['seed'],
+            'duration_s': round(elapsed, 2),
+            'total': {
+                'requests': len(latencies),
+                'errors': sum(action['errors'] for action in actions.values()),
+                'throughput_rps': round(len(latencies) / elapsed, 2),
+                'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+                'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+                'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+            },
+            'actions': actions,
+        }
+
+    def print_report(self, report):
+        self.stdout.write(f"{'action':<20}{'requests':>10}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}")
+        for name, action in list(report['actions'].items()) + [('total', report['total'])]:
+            queries = action.get('queries_per_request')
+            self.stdout.write(
+                f"{name:<20}{action['requests']:>10}{action['errors']:>8}{action['throughput_rps']:>9}"
+                f"{action['p50_ms'] or 0:>10}{action['p95_ms'] or 0:>10}{action['p99_ms'] or 0:>10}{'' if queries is None else queries:>9}"
+            )
+
+    def print_comparison(self, baseline, report):
+        self.stdout.write(f"Compared with {baseline.get('commit') or 'baseline'}:")
+        for name, action in report['actions'].items():
+            before = baseline.get('actions', {}).get(name)
+            if not before:
+                continue
+            change = (action['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+            self.stdout.write(
+                f"{name:<20}p95 {before['p95_ms']} -> {action['p95_ms']} ms ({change:+.0f}%), "
+                f"queries {before['queries_per_request']} -> {action['queries_per_request']}"
+            )
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from ligameet.models import OrganizerPayout
+
+
+class Command(BaseCommand):
+    help = 'Pay organizers 80% of the fees collected for every finished event that has not been paid yet'
+
+    def handle(self, *args, **kwargs):
+        settled = OrganizerPayout.pay_out_finished_events()
+        self.stdout.write(f"Settled {settled} finished events")
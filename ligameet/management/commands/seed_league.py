@@ -0,0 +1,312 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from chat.models import ChatGroup, ChatReadCursor, GroupMessage
+from ligameet.feed import invalidate_home_feed
+from ligameet.models import (
+    Sport, SportProfile, Team, TeamParticipant, Event, TeamCategory, SportDetails, Match, PlayerStats,
+    BasketballStats, VolleyballStats, Notification, NotificationCounter, Wallet,
+)
+from users.models import Profile, inv_code_for
+
+FIRST_NAMES = ['Juan', 'Maria', 'Jose', 'Ana', 'Paolo', 'Grace', 'Mark', 'Joy', 'Carlo', 'Bea', 'Miguel', 'Kim']
+LAST_NAMES = ['Santos', 'Reyes', 'Cruz', 'Bautista', 'Garcia', 'Mendoza', 'Torres', 'Flores', 'Ramos', 'Villanueva']
+LOCATIONS = ['Cebu City', 'Mandaue City', 'Lapu-Lapu City', 'Talisay City', 'Danao City', 'Toledo City']
+CATEGORIES = ['Junior', 'Senior', 'Midget']
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Lets bulk_create keep the created_at values we set instead of stamping every row with now."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a large synthetic league (users, teams, events, matches, stats, notifications, chats) for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of users to create')
+        parser.add_argument('--events', type=int, default=50, help='Number of events to create')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed; the same seed and sizes give the same league')
+        parser.add_argument('--players-per-team', type=int, default=12)
+        parser.add_argument('--notifications', type=int, default=10, help='Notifications per user')
+        parser.add_argument('--messages', type=int, default=20, help='Chat messages per team')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT')
+        parser.add_argument('--prefix', default='seed', help='Username prefix, so several leagues can live in one database')
+
+    def handle(self, *args, **options):
+        if options['users'] < 10:
+            raise CommandError('--users must be at least 10')
+        if User.objects.filter(username__startswith=f"{options['prefix']}_").exists():
+            raise CommandError(f"Users prefixed '{options['prefix']}_' already exist; pick another --prefix")
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.options = options
+        self.rows = 0
+        # Dates are laid out around today's midnight, so a seed gives the same league all day
+        self.anchor = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+        started = time.monotonic()
+
+        with transaction.atomic(), explicit_timestamps(
+            Notification._meta.get_field('created_at'), GroupMessage._meta.get_field('created'),
+        ):
+            sports = [
+                Sport.objects.get_or_create(SPORT_NAME=name, defaults={'SPORT_RULES_AND_REGULATIONS': rules})[0]
+                for name, rules in (('Basketball', 'FIBA'), ('Volleyball', 'FIVB'))
+            ]
+            users = self.seed_users(sports)
+            teams = self.seed_teams(users)
+            events = self.seed_events(users['Event Organizer'], sports, teams)
+            self.seed_notifications(users)
+
+        # bulk_create sends no post_save/m2m_changed signals, so the cached feed is dropped here once
+        # (the unread counters and chat read cursors are written by the steps above)
+        invalidate_home_feed()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Seeded {len(events)} events and {sum(len(group) for group in users.values())} users: "
+            f"{self.rows} rows in {elapsed:.1f}s ({self.rows / max(elapsed, 0.001):.0f} rows/s)"
+        )
+
+    def insert(self, model, objs):
+        objs = list(objs)
+        model.objects.bulk_create(objs, batch_size=self.batch_size)
+        self.rows += len(objs)
+        if self.options['verbosity'] > 1:
+            self.stdout.write(f"  {model.__name__}: {len(objs)}")
+        return objs
+
+    def seed_users(self, sports):
+        """Users with the Profile, Wallet and SportProfile rows the post_save signals and sign-up would create."""
+        total = self.options['users']
+        prefix = self.options['prefix']
+        counts = {
+            'Event Organizer': max(1, total // 200),
+            'Scout': max(1, total // 500),
+            'Coach': max(2, total // (self.options['players_per_team'] + 1)),
+        }
+        counts['Player'] = total - sum(counts.values())
+
+        password = make_password('ligameet')  # hashing once, not per user
+        roles = [role for role, count in counts.items() for _ in range(count)]
+        user_objs = self.insert(User, (
+            User(
+                username=f'{prefix}_{n}', email=f'{prefix}_{n}@example.com', password=password,
+                first_name=self.rng.choice(FIRST_NAMES), last_name=self.rng.choice(LAST_NAMES),
+                date_joined=self.anchor - timedelta(days=self.rng.randint(0, 730)),
+            )
+            for n in range(total)
+        ))
+
+        # What users.signals.create_profile and ligameet.signals.create_wallet do for a single save()
+        profiles = self.insert(Profile, (
+            Profile(
+                user=user, role=role, FIRST_NAME=user.first_name, LAST_NAME=user.last_name, first_login=False,
+                GENDER=self.rng.choice('MF'), INV_CODE=inv_code_for(user.id), is_scout=role == 'Scout',
+            )
+            for user, role in zip(user_objs, roles)
+        ))
+        self.insert(Wallet, (
+            Wallet(user=user, WALLET_BALANCE=Decimal(self.rng.randint(0, 5000))) for user in user_objs
+        ))
+
+        # Coaches and players play one sport each
+        sport_profiles = self.insert(SportProfile, (
+            SportProfile(USER_ID=user, SPORT_ID=self.rng.choice(sports))
+            for user, role in zip(user_objs, roles) if role in ('Coach', 'Player')
+        ))
+        profile_by_user = {profile.user_id: profile for profile in profiles}
+        self.insert(Profile.sports.through, (
+            Profile.sports.through(profile_id=profile_by_user[sport_profile.USER_ID_id].id, sportprofile_id=sport_profile.id)
+            for sport_profile in sport_profiles
+        ))
+        sport_by_user = {sport_profile.USER_ID_id: sport_profile.SPORT_ID for sport_profile in sport_profiles}
+
+        users = {role: [] for role in counts}
+        for user, role in zip(user_objs, roles):
+            user.seeded_sport = sport_by_user.get(user.id)
+            users[role].append(user)
+        return users
+
+    def seed_teams(self, users):
+        """A team per coach, filled with players of its sport, plus its chat group and messages.
+
+        Returns {sport: [(team, [player, ...]), ...]}.
+        """
+        per_team = self.options['players_per_team']
+        team_objs = self.insert(Team, (
+            Team(TEAM_NAME=f'{coach.last_name} {coach.seeded_sport.SPORT_NAME} {n}', TEAM_TYPE=self.rng.choice(CATEGORIES),
+                 SPORT_ID=coach.seeded_sport, COACH_ID=coach)
+            for n, coach in enumerate(users['Coach'])
+        ))
+
+        teams = {}
+        for sport in sorted({team.SPORT_ID for team in team_objs}, key=lambda sport: sport.id):
+            sport_teams = [team for team in team_objs if team.SPORT_ID == sport]
+            players = [player for player in users['Player'] if player.seeded_sport == sport]
+            self.rng.shuffle(players)
+            teams[sport] = [(team, players[i * per_team:(i + 1) * per_team]) for i, team in enumerate(sport_teams)]
+        rosters = [roster for sport_rosters in teams.values() for roster in sport_rosters]
+
+        self.insert(TeamParticipant, (
+            TeamParticipant(USER_ID=player, TEAM_ID=team, IS_CAPTAIN=n == 0)
+            for team, players in rosters for n, player in enumerate(players)
+        ))
+
+        groups = self.insert(ChatGroup, (
+            ChatGroup(group_name=f"{self.options['prefix']}-team-{team.id}", groupchat_name=team.TEAM_NAME, admin=team.COACH_ID, team=team)
+            for team, players in rosters
+        ))
+        self.insert(ChatGroup.members.through, (
+            ChatGroup.members.through(chatgroup_id=group.id, user_id=member.id)
+            for group, (team, players) in zip(groups, rosters) for member in [team.COACH_ID] + players
+        ))
+
+        def messages():
+            for group, (team, players) in zip(groups, rosters):
+                members = [team.COACH_ID] + players
+                sent = self.anchor - timedelta(days=30)
+                for n in range(self.options['messages']):
+                    sent += timedelta(minutes=self.rng.randint(1, 600))
+                    yield GroupMessage(group=group, author=self.rng.choice(members), body=f'Message {n} for {team.TEAM_NAME}',
+                                       created=sent)
+        self.insert_chunked(GroupMessage, messages())
+        self.seed_read_cursors(groups, rosters)
+        return teams
+
+    def seed_read_cursors(self, groups, rosters):
+        """What the GroupMessage signal keeps up to date: each room's newest message, and how far each member has read."""
+        message_ids = {group.id: [] for group in groups}
+        for group_id, message_id in GroupMessage.objects.filter(group__in=groups).values_list('group', 'id').order_by('id'):
+            message_ids[group_id].append(message_id)
+        for group in groups:
+            group.latest_message_id = message_ids[group.id][-1] if message_ids[group.id] else 0
+        ChatGroup.objects.bulk_update(groups, ['latest_message_id'], batch_size=self.batch_size)
+
+        def cursors():
+            for group, (team, players) in zip(groups, rosters):
+                ids = message_ids[group.id]
+                for member in [team.COACH_ID] + players:
+                    if ids:
+                        # Most members are caught up; the rest stopped somewhere in the history
+                        last_read = ids[-1] if self.rng.random() < 0.7 else self.rng.choice(ids) - 1
+                        yield ChatReadCursor(user=member, group=group, last_read_message_id=last_read)
+        self.insert_chunked(ChatReadCursor, cursors())
+
+    def seed_events(self, organizers, sports, teams):
+        """Events a year either side of today, with categories, registered teams, and first-round matches with stats."""
+        event_objs = []
+        for n in range(self.options['events']):
+            start = self.anchor + timedelta(days=self.rng.randint(-365, 365), hours=self.rng.choice((8, 9, 13)))
+            end = start + timedelta(days=self.rng.randint(1, 4))
+            status = 'finished' if end < self.anchor else 'ongoing' if start < self.anchor else 'open'
+            event_objs.append(Event(
+                EVENT_NAME=f'{self.rng.choice(LOCATIONS)} League {n}', EVENT_DATE_START=start, EVENT_DATE_END=end,
+                EVENT_LOCATION=self.rng.choice(LOCATIONS), EVENT_STATUS=status, EVENT_ORGANIZER=self.rng.choice(organizers),
+                IS_POSTED=self.rng.random() < 0.9, REGISTRATION_DEADLINE=start - timedelta(days=7),
+            ))
+        events = self.insert(Event, event_objs)
+
+        event_sports = {event: self.rng.sample(sports, self.rng.randint(1, len(sports))) for event in events}
+        self.insert(Event.SPORT.through, (
+            Event.SPORT.through(event_id=event.id, sport_id=sport.id)
+            for event, sports_played in event_sports.items() for sport in sports_played
+        ))
+        categories = self.insert(TeamCategory, (
+            TeamCategory(event=event, sport=sport, name=name)
+            for event, sports_played in event_sports.items() for sport in sports_played
+            for name in self.rng.sample(CATEGORIES, self.rng.randint(1, 2))
+        ))
+        details = self.insert(SportDetails, (
+            SportDetails(team_category=category, number_of_teams=self.rng.choice((4, 8)),
+                         players_per_team=self.options['players_per_team'], entrance_fee=Decimal(self.rng.choice((0, 500, 1000))),
+                         elimination_type=self.rng.choice(('single', 'double')))
+            for category in categories
+        ))
+
+        # Each category gets its full bracket of teams, or as many as the sport has
+        registered = {
+            detail: self.rng.sample(teams.get(detail.team_category.sport, []), min(detail.number_of_teams, len(teams.get(detail.team_category.sport, []))))
+            for detail in details
+        }
+        self.insert(SportDetails.teams.through, (
+            SportDetails.teams.through(sportdetails_id=detail.id, team_id=team.id)
+            for detail, rosters in registered.items() for team, players in rosters
+        ))
+
+        # Events that have started play their first round: winner decided, a stats line for everyone on court
+        match_rosters = []
+        for detail, rosters in registered.items():
+            event = detail.team_category.event
+            if event.EVENT_STATUS == 'open':
+                continue
+            for (team_a, players_a), (team_b, players_b) in zip(rosters[0::2], rosters[1::2]):
+                score_a, score_b = self.rng.randint(40, 110), self.rng.randint(40, 110)
+                match = Match(sport_details=detail, team_a=team_a, team_b=team_b, round='First Round', bracket='Upper Bracket',
+                              schedule=event.EVENT_DATE_START, score_team_a=score_a, score_team_b=score_b,
+                              winner=team_a if score_a >= score_b else team_b)
+                match_rosters.append((match, [(team_a, players_a), (team_b, players_b)]))
+        self.insert(Match, (match for match, rosters in match_rosters))
+
+        stats = self.insert(PlayerStats, (
+            PlayerStats(match=match, player=player, team=team, sport=team.SPORT_ID)
+            for match, rosters in match_rosters for team, players in rosters for player in players
+        ))
+        self.insert(BasketballStats, (
+            BasketballStats(player_stats=line, points=self.rng.randint(0, 30), rebounds=self.rng.randint(0, 12),
+                            assists=self.rng.randint(0, 10), steals=self.rng.randint(0, 4))
+            for line in stats if line.sport.SPORT_NAME == 'Basketball'
+        ))
+        self.insert(VolleyballStats, (
+            VolleyballStats(player_stats=line, kills=self.rng.randint(0, 20), digs=self.rng.randint(0, 15),
+                            blocks=self.rng.randint(0, 6), service_aces=self.rng.randint(0, 5))
+            for line in stats if line.sport.SPORT_NAME == 'Volleyball'
+        ))
+        return events
+
+    def seed_notifications(self, users):
+        organizers = users['Event Organizer']
+
+        def notifications():
+            for group in users.values():
+                for user in group:
+                    for n in range(self.options['notifications']):
+                        yield Notification(
+                            user=user, sender=self.rng.choice(organizers), message=f'League update {n}',
+                            created_at=self.anchor - timedelta(minutes=self.rng.randint(0, 60 * 24 * 90)),
+                            is_read=self.rng.random() < 0.6,
+                        )
+        self.insert_chunked(Notification, notifications())
+        NotificationCounter.recount(User.objects.filter(username__startswith=f"{self.options['prefix']}_"))
+
+    def insert_chunked(self, model, objs):
+        """bulk_create for rows nothing else refers to, without holding them all in memory."""
+        chunk = []
+        count = 0
+        for obj in objs:
+            chunk.append(obj)
+            if len(chunk) == self.batch_size:
+                model.objects.bulk_create(chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            model.objects.bulk_create(chunk)
+            count += len(chunk)
+        self.rows += count
+        if self.options['verbosity'] > 1:
+            self.stdout.write(f"  {model.__name__}: {count}")
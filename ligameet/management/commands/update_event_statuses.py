@@ -0,0 +1,46 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from ligameet.models import Event
+
+LAST_TICK_CACHE_KEY = 'ligameet:event_status:last_tick'
+
+
+class Command(BaseCommand):
+    help = 'Advance event statuses whose registration deadline, start or end date has passed since the last tick'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running and tick every --interval seconds')
+        parser.add_argument('--interval', type=int, default=60, help='Seconds between ticks when looping')
+        parser.add_argument('--full', action='store_true', help='Ignore the last tick and check every event')
+        parser.add_argument('--all', action='store_true', help='Recompute every event, boundary crossed or not, then exit')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            with transaction.atomic():
+                changed = Event.objects.recompute_statuses()
+            self.stdout.write(f"Recomputed all event statuses: {changed} changed")
+            return
+
+        full = options['full']
+        while True:
+            self.tick(full=full)
+            full = False  # only the first tick of a loop is forced to be a full sweep
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def tick(self, full=False):
+        now = timezone.now()
+        since = None if full else cache.get(LAST_TICK_CACHE_KEY)
+
+        with transaction.atomic():
+            changed = Event.objects.recompute_statuses(Event.objects.crossed_status_boundary(since, now), now)
+
+        cache.set(LAST_TICK_CACHE_KEY, now, None)
+
+        self.stdout.write(f"[{now:%Y-%m-%d %H:%M:%S}] Event statuses since {since or 'the beginning'}: {changed} changed")
+        return changed
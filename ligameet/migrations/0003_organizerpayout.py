@@ -0,0 +1,58 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:16
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def settle_already_finished_events(apps, schema_editor):
+    """Events finished before this migration were paid when their page was loaded; record them as settled."""
+    Event = apps.get_model('ligameet', 'Event')
+    SportDetails = apps.get_model('ligameet', 'SportDetails')
+    OrganizerPayout = apps.get_model('ligameet', 'OrganizerPayout')
+
+    finished = list(Event.objects.filter(EVENT_STATUS='finished').values_list('id', 'EVENT_ORGANIZER_id'))
+    collected = dict(
+        SportDetails.teams.through.objects.filter(sportdetails__team_category__event__in=[event_id for event_id, _ in finished])
+        .values_list('sportdetails__team_category__event')
+        .annotate(total=Sum('sportdetails__entrance_fee'))
+    )
+    OrganizerPayout.objects.bulk_create([
+        OrganizerPayout(
+            event_id=event_id,
+            organizer_id=organizer_id,
+            collected_fees=collected.get(event_id) or Decimal('0.00'),
+            amount=((collected.get(event_id) or Decimal('0.00')) * Decimal('0.8')).quantize(Decimal('0.01')),
+        )
+        for event_id, organizer_id in finished
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ligameet', '0002_alter_event_event_image_alter_sport_image_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='wallettransaction',
+            name='transaction_type',
+            field=models.CharField(choices=[('refund', 'Refund'), ('deposit', 'Deposit'), ('withdrawal', 'Withdrawal'), ('payout', 'Payout')], max_length=10),
+        ),
+        migrations.CreateModel(
+            name='OrganizerPayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('collected_fees', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payout', to='ligameet.event')),
+                ('organizer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payouts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(settle_already_finished_events, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,4 @@
+import logging
 from decimal import Decimal
 from django.db import models
 from django.utils import timezone
@@ -5,9 +6,15 @@ from django.contrib.auth.models import User
 from PIL import Image
 from django.core.validators import MinValueValidator 
 from django.db.models import Q
-from datetime import date
-from django.db.models import Sum
+from django.db import transaction, IntegrityError
+from datetime import date, datetime, time, timedelta
+from django.db.models import Sum, Count, F, Case, When, Value, Exists, OuterRef, Window, DecimalField
+from django.db.models.expressions import RowRange
+from django.db.models.functions import Greatest
 from cloudinary.models import CloudinaryField
+from .notifications import notification_created, notifications_changed, per_notification_signals
+
+logger = logging.getLogger(__name__)
 
 
 class Sport(models.Model):
@@ -48,6 +55,73 @@ class Team(models.Model):
 
 
 
+def next_local_midnight(moment):
+    """Returns the local midnight that ends the day `moment` falls on."""
+    next_day = timezone.localtime(moment).date() + timedelta(days=1)
+    return timezone.make_aware(datetime.combine(next_day, time.min))
+
+
+class EventQuerySet(models.QuerySet):
+    def crossed_status_boundary(self, since, until):
+        """Events whose registration deadline, start day or end passed in (since, until].
+
+        An event goes 'ongoing' on its local start date, so the start boundary is the
+        midnight that begins that day. With no `since`, every boundary up to `until` counts.
+        """
+        until_day_end = next_local_midnight(until)
+        if since is None:
+            crossed = (
+                Q(REGISTRATION_DEADLINE__lte=until)
+                | Q(EVENT_DATE_START__lt=until_day_end)
+                | Q(EVENT_DATE_END__lt=until)
+            )
+        else:
+            crossed = (
+                Q(REGISTRATION_DEADLINE__gt=since, REGISTRATION_DEADLINE__lte=until)
+                | Q(EVENT_DATE_START__gte=next_local_midnight(since), EVENT_DATE_START__lt=until_day_end)
+                | Q(EVENT_DATE_END__gte=since, EVENT_DATE_END__lt=until)
+            )
+        return self.filter(crossed).exclude(EVENT_STATUS__in=Event.FROZEN_STATUSES + ('finished',))
+
+    def recompute_statuses(self, queryset=None, now=None, batch_size=10000):
+        """Sets every event in `queryset` (default: this queryset) to the status it should have at `now`.
+
+        "All sports ready" is a correlated EXISTS over SportDetails team counts and the new
+        status is a CASE expression, so each batch of `batch_size` ids is one UPDATE and no
+        event is loaded into Python. Organizers of events that just finished are then paid out.
+        Returns the number of events whose status changed.
+        """
+        now = now or timezone.now()
+        queryset = (self if queryset is None else queryset).exclude(EVENT_STATUS__in=Event.FROZEN_STATUSES)
+        new_status = Event.status_expression(now)
+
+        bounds = queryset.aggregate(first=models.Min('id'), last=models.Max('id'))
+        if bounds['first'] is None:
+            return 0
+
+        changed = 0
+        finishing_ids = []
+        for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+            batch = queryset.filter(id__gte=start, id__lt=start + batch_size)
+            # Taken before the UPDATE: afterwards these no longer match filters such as
+            # crossed_status_boundary(), which leave finished events out
+            finishing_ids += batch.filter(EVENT_DATE_END__lt=now).exclude(EVENT_STATUS='finished').values_list('id', flat=True)
+            changed += (
+                Event.objects.filter(id__in=batch.values('id'))
+                .alias(new_status=new_status)
+                .exclude(EVENT_STATUS=F('new_status'))
+                .update(EVENT_STATUS=new_status)
+            )
+
+        if changed:
+            from .feed import invalidate_home_feed  # Import here to avoid circular import
+            invalidate_home_feed()  # UPDATE skips post_save, so drop the cached feed pages here
+
+        if finishing_ids:
+            OrganizerPayout.pay_out_finished_events(Event.objects.filter(id__in=finishing_ids))
+        return changed
+
+
 class Event(models.Model):
     STATUS_CHOICES = (
         ('Draft', 'Draft'),
@@ -56,6 +130,7 @@ class Event(models.Model):
         ('finished', 'Finished'),  
         ('cancelled', 'Cancelled'), #TODO cancel event
     )
+    FROZEN_STATUSES = ('draft', 'cancelled')  # statuses the status engine never touches; the default 'Draft' is not one
     EVENT_NAME = models.CharField(max_length=100)
     EVENT_DATE_START = models.DateTimeField()
     EVENT_DATE_END = models.DateTimeField() 
@@ -72,6 +147,7 @@ class Event(models.Model):
     REGISTRATION_DEADLINE = models.DateTimeField(null=True, blank=True) #TODO remove NULL/BLANK
     teams = models.ManyToManyField(Team, through='TeamEvent', related_name='events')
 
+    objects = EventQuerySet.as_manager()
 
     def __str__(self):
         sports_names = ', '.join(sport.SPORT_NAME for sport in self.SPORT.all())
@@ -83,119 +159,46 @@ class Event(models.Model):
 
 
     def transfer_money_to_organizer(self):
-        """Transfers 80% of the total registration fees collected (based on SportDetails.entrance_fee) to the organizer's wallet."""
-        if self.EVENT_STATUS == 'finished':
-            print(f"Transfer method triggered for event: {self.EVENT_NAME}")
-
-            # Initialize total collected fees
-            total_collected_fees = Decimal('0.0')
-
-            # Iterate through all team categories linked to the event
-            for team_category in self.team_categories.all():
-                # Access the SportDetails for the team category
-                sport_details = team_category.sport_details.first()
-
-                if sport_details:
-                    # Calculate the total collected fees for this team category
-                    entrance_fee = sport_details.entrance_fee
-                    teams_registered = sport_details.teams.count()  # Number of teams registered for this sport
-                    total_collected_fees += entrance_fee * Decimal(teams_registered)
-
-                    print(
-                        f"Team Category: {team_category.name}, Sport: {team_category.sport.SPORT_NAME}, "
-                        f"Entrance Fee: {entrance_fee}, Teams Registered: {teams_registered}"
-                    )
-
-            if total_collected_fees <= 0:
-                print(f"No money to transfer for event: {self.EVENT_NAME}")
-                return
-
-            # Calculate 80% of the total collected fees
-            amount_to_transfer = total_collected_fees * Decimal('0.8')
-            print(f"Amount to Transfer: {amount_to_transfer}")
-
-            try:
-                # Access the wallet of the event organizer
-                organizer_wallet = Wallet.objects.get(user=self.EVENT_ORGANIZER)
-                print(f"Current Wallet Balance: {organizer_wallet.WALLET_BALANCE}")
-
-                # Update the wallet balance
-                organizer_wallet.WALLET_BALANCE += amount_to_transfer
-                organizer_wallet.save()
-
-                print(f"New Wallet Balance: {organizer_wallet.WALLET_BALANCE}")
-            except Wallet.DoesNotExist:
-                print(f"Error: Wallet for {self.EVENT_ORGANIZER.username} does not exist.")
-
-
+        """Pays the organizer 80% of the registration fees collected, once the event is finished."""
+        return OrganizerPayout.pay_out_finished_events(Event.objects.filter(pk=self.pk))
+
+    @staticmethod
+    def status_expression(now):
+        """SQL expression for the status an event should have at `now`.
+
+        Finished once its end has passed; otherwise, only when every category has its
+        required number of teams, open/upcoming before its local start date (depending
+        on the registration deadline) and ongoing from that date on.
+        """
+        unready_sports = (
+            SportDetails.objects.filter(team_category__event=OuterRef('pk'))
+            .annotate(team_count=Count('teams'))
+            .filter(team_count__lt=F('number_of_teams'))
+        )
+        all_sports_ready = ~Exists(unready_sports)
+        starts_later = Q(EVENT_DATE_START__gte=next_local_midnight(now))
+        deadline_open = Q(REGISTRATION_DEADLINE__isnull=True) | Q(REGISTRATION_DEADLINE__gt=now)
+
+        return Case(
+            When(EVENT_STATUS__in=Event.FROZEN_STATUSES, then=F('EVENT_STATUS')),
+            When(EVENT_DATE_END__lt=now, then=Value('finished')),
+            When(Q(all_sports_ready, starts_later, deadline_open), then=Value('open')),
+            When(Q(all_sports_ready, starts_later), then=Value('upcoming')),
+            When(all_sports_ready, then=Value('ongoing')),
+            default=F('EVENT_STATUS'),
+            output_field=models.CharField(),
+        )
 
     def update_status(self):
-        now = timezone.now()
-        today = now.date()
-        print(f"Current DateTime: {now}, Event Start: {self.EVENT_DATE_START}, Event End: {self.EVENT_DATE_END}, Registration Deadline: {self.REGISTRATION_DEADLINE}, Status: {self.EVENT_STATUS}")
+        """Recomputes and saves the status of this event only.
 
-        # Ensure self.EVENT_DATE_START is timezone-aware
-        if timezone.is_naive(self.EVENT_DATE_START):
-            self.EVENT_DATE_START = timezone.make_aware(self.EVENT_DATE_START, timezone.get_current_timezone())
+        Meant for write paths (e.g. a team registering); pages never call this, the
+        update_event_statuses command advances statuses as their dates pass.
+        """
+        Event.objects.recompute_statuses(Event.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=['EVENT_STATUS'])
 
-        event_start_local = timezone.localtime(self.EVENT_DATE_START)
-        
 
-        # Do nothing if the event status is 'Draft' or 'cancelled'
-        if self.EVENT_STATUS in ['draft', 'cancelled']:
-            
-            return
-
-        # If the event has ended
-        if self.EVENT_DATE_END < now:
-            if self.EVENT_STATUS != 'finished':
-                self.EVENT_STATUS = 'finished'
-                self.save()  # Save status change
-                self.transfer_money_to_organizer()  # Transfer money only when status changes
-                print(f"Event has ended. Updating status to 'finished' and transferring money.")
-            return
-
-        # Check if all sports in the event meet the required number of teams
-        all_sports_ready = True
-        for sport_detail in SportDetails.objects.filter(team_category__event=self):
-            teams_registered = sport_detail.teams.count()
-            
-            if teams_registered < sport_detail.number_of_teams:
-                all_sports_ready = False
-                
-                break
-
-        # New conditions for registration deadline and status
-        if all_sports_ready and event_start_local.date() > today:
-            if self.REGISTRATION_DEADLINE > now:
-                self.EVENT_STATUS = 'open'
-                
-            elif self.REGISTRATION_DEADLINE <= now:
-                self.EVENT_STATUS = 'upcoming'
-                
-
-        # If all sports are ready and the event's start date has passed or is today, set status to 'ongoing'
-        elif all_sports_ready and event_start_local.date() <= today:
-            self.EVENT_STATUS = 'ongoing'
-            
-
-
-        self.save()
-        
-
-
-
-
-
-
-
-
-
-
-
-
-
-        
 class TeamEvent(models.Model):
     TEAM_ID = models.ForeignKey(Team, on_delete=models.CASCADE)
     EVENT_ID = models.ForeignKey(Event, on_delete=models.CASCADE)
@@ -249,6 +252,11 @@ class Invoice(models.Model):
             models.UniqueConstraint(fields=['team', 'event', 'team_category'], name='unique_team_event_registration'),
             models.UniqueConstraint(fields=['user', 'event', 'team_category'], name='unique_user_event_registration'),
         ]
+        indexes = [
+            # The wallet page lists a user's invoices newest first, once as registrant and once as coach
+            models.Index(fields=['user', 'created_at'], name='invoice_user_created_idx'),
+            models.Index(fields=['coach', 'created_at'], name='invoice_coach_created_idx'),
+        ]
 
     def __str__(self):
         if self.team:
@@ -265,24 +273,161 @@ class Wallet(models.Model):
     def __str__(self):
         return f"{self.user} - {self.WALLET_BALANCE}"
 
+    @classmethod
+    def create_missing(cls, users=None, batch_size=1000):
+        """Bulk-creates an empty wallet for every user in `users` (default: all) that has none. Returns how many."""
+        users = User.objects.all() if users is None else users
+        user_ids = list(users.filter(wallet__isnull=True).values_list('id', flat=True))
+        cls.objects.bulk_create([cls(user_id=user_id) for user_id in user_ids], batch_size=batch_size)
+        return len(user_ids)
+
+    def ledger_page(self, cursor=None, per_page=10):
+        """One page of this wallet's transactions, newest first, each with a `balance_after`.
+
+        A row's balance is the current balance minus every newer row. The newer rows
+        on the page's side of the cursor come from a window sum in the page query,
+        the rest from one aggregate, both served by the (wallet, created_at) index.
+        """
+        # Import here to avoid circular import
+        from .pagination import CursorPaginator
+
+        page = CursorPaginator(self.transactions.with_newer_total(), per_page=per_page).page(cursor)
+        if page.object_list:
+            newest = page.object_list[0]
+            above_page = self.transactions.filter(
+                Q(created_at__gt=newest.created_at) | Q(created_at=newest.created_at, id__gt=newest.id)
+            ).with_signed_amount().aggregate(total=Sum('signed_amount'))['total'] or Decimal('0.00')
+            for row in page:
+                between = (row.newer_total or 0) - (newest.newer_total or 0)
+                row.balance_after = self.WALLET_BALANCE - above_page - between
+        return page
+
+
+class WalletTransactionQuerySet(models.QuerySet):
+    def with_signed_amount(self):
+        """Annotates signed_amount: negative for money leaving the wallet."""
+        return self.annotate(signed_amount=Case(
+            When(transaction_type__in=WalletTransaction.DEBIT_TYPES, then=-F('amount')),
+            default=F('amount'),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ))
+
+    def with_newer_total(self):
+        """Annotates newer_total: the sum of signed amounts of the rows in this queryset newer than each row."""
+        return self.with_signed_amount().annotate(newer_total=Window(
+            Sum('signed_amount'),
+            partition_by=[F('wallet')],
+            order_by=[F('created_at').desc(), F('id').desc()],
+            frame=RowRange(start=None, end=-1),
+        ))
+
+
 class WalletTransaction(models.Model):
     TRANSACTION_TYPES = (
         ('refund', 'Refund'),
         ('deposit', 'Deposit'),
         ('withdrawal', 'Withdrawal'),
+        ('payout', 'Payout'),
         # Add other types as needed
     )
+    DEBIT_TYPES = ('withdrawal',)  # every other type adds to the balance
     
     wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name="transactions")
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_type = models.CharField(max_length=10, choices=TRANSACTION_TYPES)
     created_at = models.DateTimeField(auto_now_add=True)
     description = models.CharField(max_length=255, blank=True, null=True)
-    
+
+    objects = WalletTransactionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet', 'created_at'], name='wallettx_wallet_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.transaction_type} of {self.amount} to {self.wallet.user} on {self.created_at} - {self.description}"
 
 
+class OrganizerPayout(models.Model):
+    PAYOUT_RATE = Decimal('0.8')  # organizers receive 80% of the entrance fees collected
+
+    event = models.OneToOneField(Event, on_delete=models.CASCADE, related_name='payout')  # one payout per event, ever
+    organizer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payouts')
+    collected_fees = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Payout of {self.amount} to {self.organizer} for {self.event.EVENT_NAME}"
+
+    @classmethod
+    def pay_out_finished_events(cls, events=None):
+        """Credits organizers for every finished event in `events` that has not been paid yet.
+
+        Fees for all the events come from one aggregate over the SportDetails/Team
+        registrations, wallets are locked with select_for_update and credited with F()
+        expressions, and each payout writes a WalletTransaction. A payout row is stored
+        per event in the same transaction, so re-running the job never pays twice.
+        Returns the number of events settled.
+        """
+        events = Event.objects.all() if events is None else events
+        with transaction.atomic():
+            due = list(
+                events.filter(EVENT_STATUS='finished')
+                .exclude(Exists(cls.objects.filter(event=OuterRef('pk'))))
+                .select_for_update(skip_locked=True)
+                .values_list('id', 'EVENT_NAME', 'EVENT_ORGANIZER_id')
+            )
+            if not due:
+                return 0
+
+            # One row per team registered in a category, so summing fees gives fee x teams
+            registrations = SportDetails.teams.through.objects.filter(
+                sportdetails__team_category__event__in=[event_id for event_id, _, _ in due]
+            )
+            collected = dict(
+                registrations.values_list('sportdetails__team_category__event')
+                .annotate(total=Sum('sportdetails__entrance_fee'))
+            )
+
+            payouts = []
+            for event_id, event_name, organizer_id in due:
+                fees = collected.get(event_id) or Decimal('0.00')
+                amount = (fees * cls.PAYOUT_RATE).quantize(Decimal('0.01'))
+                payouts.append((event_name, cls(event_id=event_id, organizer_id=organizer_id, collected_fees=fees, amount=amount)))
+            cls.objects.bulk_create([payout for _, payout in payouts])
+
+            paid = [(event_name, payout) for event_name, payout in payouts if payout.amount > 0]
+            if paid:
+                organizer_ids = {payout.organizer_id for _, payout in paid}
+                wallets = {wallet.user_id: wallet for wallet in Wallet.objects.select_for_update().filter(user_id__in=organizer_ids)}
+                missing = [Wallet(user_id=user_id) for user_id in organizer_ids - wallets.keys()]
+                for wallet in Wallet.objects.bulk_create(missing):
+                    wallets[wallet.user_id] = wallet
+
+                credits = {}
+                for _, payout in paid:
+                    credits[payout.organizer_id] = credits.get(payout.organizer_id, Decimal('0.00')) + payout.amount
+                Wallet.objects.filter(user_id__in=credits).update(WALLET_BALANCE=F('WALLET_BALANCE') + Case(
+                    *[When(user_id=user_id, then=Value(credit)) for user_id, credit in credits.items()],
+                    output_field=models.DecimalField(max_digits=10, decimal_places=2),
+                ))
+
+                WalletTransaction.objects.bulk_create([
+                    WalletTransaction(
+                        wallet=wallets[payout.organizer_id],
+                        amount=payout.amount,
+                        transaction_type='payout',
+                        description=f"Payout for Event:{event_name} - {int(cls.PAYOUT_RATE * 100)}% of {payout.collected_fees} collected",
+                    )
+                    for event_name, payout in paid
+                ])
+
+        logger.info("Paid out %d of %d finished events", len(paid), len(due))
+        return len(due)
+
+
 class SportProfile(models.Model):  #TODO make a view to edit the sports he played
     USER_ID = models.ForeignKey(User, on_delete=models.CASCADE)
     SPORT_ID = models.ForeignKey(Sport, on_delete=models.CASCADE)
@@ -574,12 +719,159 @@ class Notification(models.Model):
     message = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'is_read', 'created_at'], name='notification_inbox_idx'),  # unread, mark all read, recount
+            models.Index(fields=['user', 'created_at'], name='notification_user_created_idx'),  # the inbox and its older pages
+        ]
     
     def __str__(self):
         user_username = self.user.username if self.user else 'Unknown'
         sender_username = self.sender.username if self.sender else 'Unknown'
         return f'Notification for {user_username} from {sender_username}: {self.message}'
 
+    def save(self, *args, **kwargs):
+        # A notification and the change it makes to the counters commit together: +1 for a new unread
+        # one, and on an update (e.g. is_read edited in the admin) whatever its read state or recipient moved
+        creating = self._state.adding
+        with transaction.atomic():
+            stored = None
+            if not creating:
+                stored = Notification.objects.select_for_update().filter(pk=self.pk).values_list('user_id', 'is_read').first()
+            super().save(*args, **kwargs)
+            if creating or stored is None:
+                if not self.is_read:
+                    NotificationCounter.add(self.user_id, 1)
+                notification_created(self)
+                return
+
+            deltas = {stored[0]: 0 if stored[1] else -1}
+            deltas[self.user_id] = deltas.get(self.user_id, 0) + (0 if self.is_read else 1)
+            for user_id, delta in deltas.items():
+                if delta:
+                    NotificationCounter.add(user_id, delta)
+                notifications_changed(user_id, delta)
+
+    def mark_read(self):
+        """Marks this notification read, taking it off the counter unless it already was."""
+        with transaction.atomic():
+            changed = Notification.objects.filter(pk=self.pk, is_read=False).update(is_read=True)
+            if changed:
+                NotificationCounter.add(self.user_id, -changed)
+                notifications_changed(self.user_id, -changed)
+        self.is_read = True
+        return bool(changed)
+
+    @classmethod
+    def mark_all_read(cls, user):
+        """Marks every notification of `user` read. Returns how many were unread."""
+        with transaction.atomic():
+            # Subtracting what was actually flipped (not resetting to 0) stays right if one arrives meanwhile
+            changed = cls.objects.filter(user=user, is_read=False).update(is_read=True)
+            if changed:
+                NotificationCounter.add(user.pk, -changed)
+                notifications_changed(user.pk, -changed)
+        return changed
+
+
+class NotificationCounter(models.Model):
+    """Unread notifications per user, so badges are a primary-key lookup instead of a COUNT.
+
+    Notification.save (inserts and updates), mark_read, mark_all_read and deletes keep it in step; code that
+    bulk-creates or bulk-updates notifications calls recount() afterwards.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.unread} unread"
+
+    @classmethod
+    def add(cls, user_id, delta):
+        """Moves a user's count by `delta` in one UPDATE, creating the row on the first notification."""
+        if cls.objects.filter(user_id=user_id).update(unread=Greatest(F('unread') + delta, 0)):
+            return
+        if delta > 0:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(user_id=user_id, unread=delta)
+            except IntegrityError:  # created by a concurrent request in between
+                cls.objects.filter(user_id=user_id).update(unread=F('unread') + delta)
+
+    @classmethod
+    def unread_for(cls, user):
+        return cls.objects.filter(user=user).values_list('unread', flat=True).first() or 0
+
+    @classmethod
+    def recount(cls, users=None):
+        """Rebuilds the counters of `users` (default: everyone) from the notifications table."""
+        users = User.objects.all() if users is None else users
+        counts = dict(
+            Notification.objects.filter(user__in=users, is_read=False)
+            .values_list('user').annotate(unread=Count('id')).order_by()
+        )
+        with transaction.atomic():
+            cls.objects.filter(user__in=users).update(unread=0)
+            cls.objects.bulk_create(
+                [cls(user_id=user_id, unread=unread) for user_id, unread in counts.items()],
+                update_conflicts=True, unique_fields=['user'], update_fields=['unread'], batch_size=1000,
+            )
+
+
+
+class ArchivedNotification(models.Model):
+    """Cold storage for read notifications past the archive cutoff, so the live table stays small.
+
+    Rows keep the id they had in Notification. Nothing in the app reads them; they are
+    kept for support and audits.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, related_name='archived_notifications', on_delete=models.CASCADE)
+    sender = models.ForeignKey(User, related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    message = models.CharField(max_length=255)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='archived_notif_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'Archived notification {self.id} for {self.user_id}: {self.message}'
+
+    @classmethod
+    def archive(cls, before, batch_size=1000):
+        """Moves read notifications created before `before` here, one transaction per batch. Returns how many moved.
+
+        Batches walk the primary key, so each one is an index range scan and an
+        interrupted run just leaves the rest for the next one.
+        """
+        moved, last_id = 0, 0
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    Notification.objects.filter(pk__gt=last_id, is_read=True, created_at__lt=before)
+                    .order_by('pk').only('id', 'user', 'sender', 'message', 'created_at')[:batch_size]
+                )
+                if not batch:
+                    return moved
+                cls.objects.bulk_create([
+                    cls(id=n.id, user_id=n.user_id, sender_id=n.sender_id, message=n.message, created_at=n.created_at)
+                    for n in batch
+                ])
+                # Read rows leave the unread counters alone; only the cached inboxes change, once per user
+                token = per_notification_signals.set(False)
+                try:
+                    Notification.objects.filter(pk__in=[n.pk for n in batch], is_read=True).delete()
+                finally:
+                    per_notification_signals.reset(token)
+                for user_id in {n.user_id for n in batch}:
+                    notifications_changed(user_id)
+            moved += len(batch)
+            last_id = batch[-1].pk
+
     
 class Invitation(models.Model):
     team = models.ForeignKey(Team, on_delete=models.CASCADE)
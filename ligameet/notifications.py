@@ -0,0 +1,97 @@
+import contextvars
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .pagination import CursorPaginator
+
+logger = logging.getLogger(__name__)
+
+RECENT_NOTIFICATIONS = 10  # what a dashboard's bell dropdown renders; older pages load on demand
+NOTIFICATION_INBOX_TIMEOUT = 60 * 30  # seconds; new, read and archived notifications invalidate it first
+
+# Off while ArchivedNotification.archive() moves rows, which invalidates once per user instead of per row
+per_notification_signals = contextvars.ContextVar('per_notification_signals', default=True)
+
+
+def notification_group(user_id):
+    """The channel layer group the user's NotificationConsumer connections listen on."""
+    return f'notifications_{user_id}'
+
+
+def notification_inbox_cache_key(user_id):
+    return f'ligameet:notifications:{user_id}'
+
+
+def notification_inbox(user):
+    """The user's latest RECENT_NOTIFICATIONS notifications, newest first, and the cursor of the page after them.
+
+    Cached until a notification arrives, is read or is archived. Older pages are
+    fetched on demand with older_notifications(), starting from `older_cursor`.
+    """
+    cache_key = notification_inbox_cache_key(user.pk)
+    inbox = cache.get(cache_key)
+    if inbox is None:
+        page = older_notifications(user, None, per_page=RECENT_NOTIFICATIONS)
+        inbox = {
+            'notifications': [
+                {'id': n.id, 'message': n.message, 'is_read': n.is_read, 'created_at': n.created_at} for n in page
+            ],
+            'older_cursor': page.next_token,
+        }
+        cache.set(cache_key, inbox, NOTIFICATION_INBOX_TIMEOUT)
+    return inbox
+
+
+def older_notifications(user, cursor, per_page=20):
+    """One keyset page of the user's notifications, newest first; a page costs one query however deep it is."""
+    from .models import Notification  # Import here to avoid circular import
+    notifications = Notification.objects.filter(user=user).only('id', 'message', 'is_read', 'created_at')
+    return CursorPaginator(notifications, ('-created_at', '-id'), per_page).page(cursor)
+
+
+def notification_payload(notification):
+    """What the browser needs to add a notification to the bell dropdown."""
+    return {
+        'id': notification.id,
+        'message': notification.message,
+        'is_read': notification.is_read,
+        'created_at': timezone.localtime(notification.created_at).strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def push(user_id, event):
+    """Sends `event` to the user's open pages. Best effort: runs after the commit, so a layer outage is only logged."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(notification_group(user_id), event)
+    except Exception:
+        logger.exception('Could not push %s to user %s', event['type'], user_id)
+
+
+def notification_created(notification):
+    """Sends a new notification to the recipient's open pages once it is committed."""
+    event = {
+        'type': 'notification.new',
+        'notification': notification_payload(notification),
+        'unread_delta': 0 if notification.is_read else 1,
+    }
+
+    def send():
+        cache.delete(notification_inbox_cache_key(notification.user_id))
+        push(notification.user_id, event)
+    transaction.on_commit(send)
+
+
+def notifications_changed(user_id, unread_delta=0):
+    """Drops the cached dropdown and sends the unread-count change, once the change is committed."""
+    def send():
+        cache.delete(notification_inbox_cache_key(user_id))
+        if unread_delta:
+            push(user_id, {'type': 'notification.count', 'unread_delta': unread_delta})
+    transaction.on_commit(send)
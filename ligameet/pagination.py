@@ -0,0 +1,105 @@
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+CURSOR_SALT = 'ligameet.pagination.cursor'
+
+
+class CursorPage:
+    def __init__(self, object_list, has_next, has_previous, next_token, previous_token):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_token = next_token
+        self.previous_token = previous_token
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __reversed__(self):
+        return reversed(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class CursorPaginator:
+    """Keyset pagination over a queryset ordered on a unique key such as (created_at, id).
+
+    A page is fetched with WHERE (created_at, id) < (last row seen) instead of OFFSET
+    and nothing is counted, so page N costs the same single query as page 1. Tokens
+    are signed, so they are opaque to clients and cannot be forged. Every field in
+    `ordering` must sort in the same direction and the last one must be unique.
+
+    `queryset` may also be a list of querysets over the same model, for lists that
+    would otherwise need an OR across two indexes: each branch is scanned on its own
+    index and the branches are merged, dropping rows found by more than one.
+    """
+
+    def __init__(self, queryset, ordering=('-created_at', '-id'), per_page=10):
+        self.branches = list(queryset) if isinstance(queryset, (list, tuple)) else [queryset]
+        self.queryset = self.branches[0]
+        self.per_page = per_page
+        self.descending = ordering[0].startswith('-')
+        self.fields = [name.lstrip('-') for name in ordering]
+
+    def page(self, token=None):
+        position, backwards = self._decode(token)
+
+        # Walking backwards from a position flips the scan order; rows are put back afterwards
+        scan_descending = self.descending != backwards
+        rows = {}
+        for branch in self.branches:
+            branch = branch.order_by(*[('-' if scan_descending else '') + name for name in self.fields])
+            if position is not None:
+                branch = branch.filter(self._beyond(position, scan_descending))
+            rows.update((row.pk, row) for row in branch[:self.per_page + 1])
+
+        rows = sorted(rows.values(), key=self._key, reverse=scan_descending)[:self.per_page + 1]
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        has_next = position is not None if backwards else has_more
+        has_previous = has_more if backwards else position is not None
+        return CursorPage(
+            rows,
+            has_next=has_next,
+            has_previous=has_previous,
+            next_token=self._encode(rows[-1], backwards=False) if has_next and rows else None,
+            previous_token=self._encode(rows[0], backwards=True) if has_previous and rows else None,
+        )
+
+    def _key(self, row):
+        return tuple(getattr(row, name) for name in self.fields)
+
+    def _beyond(self, position, descending):
+        """(f1, f2, ...) < (v1, v2, ...) written out as ORs, which every backend can use an index for."""
+        lookup = 'lt' if descending else 'gt'
+        condition = Q()
+        for i, name in enumerate(self.fields):
+            step = Q(**{f'{name}__{lookup}': position[i]})
+            for previous_name, value in zip(self.fields[:i], position[:i]):
+                step &= Q(**{previous_name: value})
+            condition |= step
+        return condition
+
+    def _encode(self, row, backwards):
+        values = []
+        for name in self.fields:
+            value = getattr(row, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        return signing.dumps({'v': values, 'b': backwards}, salt=CURSOR_SALT, compress=True)
+
+    def _decode(self, token):
+        """Returns (position, backwards); a missing or tampered token means the first page."""
+        if not token:
+            return None, False
+        try:
+            data = signing.loads(token, salt=CURSOR_SALT)
+            model = self.queryset.model
+            position = [model._meta.get_field(name).to_python(value) for name, value in zip(self.fields, data['v'])]
+        except (signing.BadSignature, ValidationError, KeyError, TypeError, ValueError):
+            return None, False
+        return position, bool(data.get('b'))
@@ -1,21 +1,47 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Wallet, JoinRequest, TeamParticipant
+from .models import Wallet, JoinRequest, TeamParticipant, Event, TeamCategory, SportDetails, Notification, NotificationCounter
+from .feed import invalidate_home_feed
+from .notifications import notifications_changed, per_notification_signals
+from users.signals import per_user_signals
 
 
 @receiver(post_save, sender=User)  #creates a wallet every time a user is created
-def create_wallet(sender, instance, created, **kwargs):
-    if created:
+def create_wallet(sender, instance, created, raw=False, **kwargs):
+    # Only on create: re-saving the wallet on every User save (each login) was two wasted queries
+    if created and not raw and per_user_signals.get():
         Wallet.objects.create(user=instance)
 
 
-@receiver(post_save, sender=User)  #function to save the profile
-def save_wallet(sender, instance, **kwargs):
-    instance.wallet.save()
-    
 @receiver(post_save, sender=JoinRequest)
 def create_team_participant(sender, instance, created, **kwargs):
     if instance.STATUS == 'approved':
         # Create TeamParticipant if it doesn't already exist
-        TeamParticipant.objects.get_or_create(USER_ID=instance.USER_ID, TEAM_ID=instance.TEAM_ID)
\ No newline at end of file
+        TeamParticipant.objects.get_or_create(USER_ID=instance.USER_ID, TEAM_ID=instance.TEAM_ID)
+
+
+@receiver(post_save, sender=Event)  #saving or posting an event changes the home feed
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=TeamCategory)
+@receiver(post_delete, sender=TeamCategory)
+@receiver(post_save, sender=SportDetails)
+@receiver(post_delete, sender=SportDetails)
+def invalidate_home_feed_on_save(sender, **kwargs):
+    invalidate_home_feed()
+
+
+@receiver(m2m_changed, sender=Event.SPORT.through)
+@receiver(m2m_changed, sender=SportDetails.teams.through)  #teams registered per category
+def invalidate_home_feed_on_m2m(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_home_feed()
+
+
+@receiver(post_delete, sender=Notification)  #a deleted unread notification leaves the badge and the dropdown
+def uncount_deleted_notification(sender, instance, **kwargs):
+    if not per_notification_signals.get():
+        return
+    if not instance.is_read:
+        NotificationCounter.add(instance.user_id, -1)
+    notifications_changed(instance.user_id, 0 if instance.is_read else -1)
@@ -1,3 +1,585 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+from chat.models import ChatGroup, GroupMessage
+from users.middleware import QueryRecorder
+from .feed import HOME_FEED_VERSION_KEY, render_home_feed
+from .notifications import RECENT_NOTIFICATIONS, notification_inbox
+from .pagination import CursorPaginator
+from .models import (
+    Sport, SportProfile, Event, TeamCategory, SportDetails, Team, TeamParticipant, Match, PlayerStats,
+    BasketballStats, VolleyballStats, Invoice, Notification, Invitation, JoinRequest,
+    PlayerRecruitment, Activity, NotificationCounter, ArchivedNotification, OrganizerPayout, WalletTransaction,
+)
+from .management.commands.loadtest import SCENARIOS
+from .management.commands.update_event_statuses import LAST_TICK_CACHE_KEY, Command as UpdateEventStatuses
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def build_league(events=3, teams_per_category=4, players_per_team=5, notifications=12):
+    """Creates a small league: an organizer, a scout, coaches with teams and players, events with
+    basketball and volleyball categories, matches with stats, invoices, notifications and chats.
+
+    Big enough that a view running a query per row blows its budget. Returns the main actors.
+    """
+    now = timezone.now()
+    basketball = Sport.objects.create(SPORT_NAME='Basketball', SPORT_RULES_AND_REGULATIONS='FIBA')
+    volleyball = Sport.objects.create(SPORT_NAME='Volleyball', SPORT_RULES_AND_REGULATIONS='FIVB')
+
+    def make_user(username, role, sport=None):
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password='x')
+        user.profile.role = role
+        user.profile.first_login = False
+        user.profile.save()
+        if sport:
+            sport_profile = SportProfile.objects.create(USER_ID=user, SPORT_ID=sport)
+            user.profile.sports.add(sport_profile)
+        return user
+
+    organizer = make_user('organizer', 'Event Organizer')
+    scout = make_user('scout', 'Scout')
+
+    teams = {basketball: [], volleyball: []}
+    coaches, players = [], []
+    for sport in (basketball, volleyball):
+        for t in range(teams_per_category):
+            coach = make_user(f'coach_{sport.SPORT_NAME.lower()}_{t}', 'Coach', sport)
+            coaches.append(coach)
+            team = Team.objects.create(TEAM_NAME=f'{sport.SPORT_NAME} Team {t}', TEAM_TYPE='Senior', SPORT_ID=sport, COACH_ID=coach)
+            teams[sport].append(team)
+            chat = ChatGroup.objects.create(groupchat_name=team.TEAM_NAME, admin=coach, team=team)
+            chat.members.add(coach)
+            for p in range(players_per_team):
+                player = make_user(f'player_{sport.SPORT_NAME.lower()}_{t}_{p}', 'Player', sport)
+                players.append(player)
+                TeamParticipant.objects.create(USER_ID=player, TEAM_ID=team, IS_CAPTAIN=p == 0)
+                chat.members.add(player)
+                GroupMessage.objects.create(group=chat, author=player, body=f'Hello from {player.username}')
+            JoinRequest.objects.create(USER_ID=players[0], TEAM_ID=team) if sport == volleyball else None
+
+    sport_details = []
+    for e in range(events):
+        event = Event.objects.create(
+            EVENT_NAME=f'League Event {e}', EVENT_DATE_START=now + timedelta(days=10 + e), EVENT_DATE_END=now + timedelta(days=12 + e),
+            EVENT_LOCATION='Cebu City', EVENT_STATUS='open', EVENT_ORGANIZER=organizer, IS_POSTED=True,
+            REGISTRATION_DEADLINE=now + timedelta(days=5),
+        )
+        event.SPORT.add(basketball, volleyball)
+        for sport in (basketball, volleyball):
+            for name in ('Junior', 'Senior'):
+                category = TeamCategory.objects.create(sport=sport, event=event, name=name)
+                details = SportDetails.objects.create(
+                    team_category=category, number_of_teams=teams_per_category + 2, players_per_team=players_per_team,
+                    entrance_fee=Decimal('500.00'), elimination_type='single',
+                )
+                details.teams.add(*teams[sport])
+                sport_details.append(details)
+                for team in teams[sport]:
+                    Invoice.objects.create(coach=team.COACH_ID, team=team, event=event, team_category=category, is_paid=True, amount=details.entrance_fee)
+
+    matches = []
+    for details in sport_details[:2]:
+        sport = details.team_category.sport
+        team_a, team_b = teams[sport][:2]
+        match = Match.objects.create(sport_details=details, team_a=team_a, team_b=team_b, round='First Round', schedule=now, winner=team_a)
+        matches.append(match)
+        for team in (team_a, team_b):
+            for participant in team.teamparticipant_set.all():
+                stats = PlayerStats.objects.create(match=match, player=participant.USER_ID, team=team, sport=sport)
+                if sport == basketball:
+                    BasketballStats.objects.create(player_stats=stats, points=10, rebounds=5)
+                else:
+                    VolleyballStats.objects.create(player_stats=stats, kills=7, digs=3)
+
+    for user in [organizer, scout] + coaches + players[:players_per_team]:
+        for n in range(notifications):
+            Notification.objects.create(user=user, sender=organizer, message=f'Notification {n}', is_read=n % 2 == 0)
+        Activity.objects.create(user=user, description='Joined the league')
+        user.wallet.transactions.create(amount=Decimal('100.00'), transaction_type='deposit')
+    for player in players[:players_per_team]:
+        Invitation.objects.create(team=teams[volleyball][-1], user=player)
+        PlayerRecruitment.objects.create(scout=scout, player=player, is_recruited=True)
+
+    return {
+        'organizer': organizer, 'scout': scout, 'coach': coaches[0], 'player': players[0],
+        'basketball': basketball, 'volleyball': volleyball, 'sport_details': sport_details[0], 'match': matches[0],
+        'team': teams[basketball][0],
+    }
+
+
+class QueryBudgetTestCase(TestCase):
+    """Requests a view and fails when it runs more SQL queries than its @query_budget allows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.league = build_league()
+
+    def get_within_budget(self, url, user=None, method='get', **kwargs):
+        budget = getattr(resolve(url.split('?')[0]).func, 'query_budget', None)
+        self.assertIsNotNone(budget, f"{url} has no @query_budget")
+        if user:
+            self.client.force_login(user)
+        with QueryRecorder() as queries:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLessEqual(
+            queries.count, budget,
+            f"{url} ran {queries.count} queries, over its budget of {budget}:\n" + '\n'.join(queries.statements),
+        )
+        return response
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ViewQueryBudgetTests(QueryBudgetTestCase):
+    def test_home(self):
+        response = self.get_within_budget(reverse('home'), self.league['coach'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'League Event')
+
+    def test_home_cached(self):
+        self.client.force_login(self.league['coach'])
+        self.client.get(reverse('home'))
+        response = self.get_within_budget(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_event_details(self):
+        event = Event.objects.first()
+        response = self.get_within_budget(reverse('event-details', args=[event.id]), self.league['coach'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_event_details_as_organizer(self):
+        event = Event.objects.first()
+        response = self.get_within_budget(reverse('event-details', args=[event.id]), self.league['organizer'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_player_dashboard(self):
+        response = self.get_within_budget(reverse('player-dashboard'), self.league['player'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_coach_dashboard(self):
+        response = self.get_within_budget(reverse('coach-dashboard'), self.league['coach'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_scout_dashboard(self):
+        response = self.get_within_budget(reverse('scout-dashboard'), self.league['scout'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_event_dashboard(self):
+        response = self.get_within_budget(reverse('event-dashboard'), self.league['organizer'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_wallet_dashboard(self):
+        response = self.get_within_budget(reverse('wallet-dashboard'), self.league['coach'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_scoreboard(self):
+        response = self.get_within_budget(reverse('scoreboard', args=[self.league['match'].id]), self.league['organizer'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<td>10</td>', count=10)  # every player of both teams scored 10
+
+    def test_bracket(self):
+        sport_details = self.league['sport_details']
+        response = self.get_within_budget(reverse('get_bracket_data', args=[sport_details.id]), self.league['organizer'])
+        self.assertEqual(response.status_code, 200)
+        # The second visit reads the bracket saved by the first
+        response = self.get_within_budget(reverse('get_bracket_data', args=[sport_details.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_save_bracket(self):
+        sport_details = self.league['sport_details']
+        response = self.get_within_budget(
+            reverse('save_bracket', args=[sport_details.id]), method='post', data={'teams': [], 'results': []},
+            content_type='application/json',
+        )
+        self.assertEqual(response.json(), {'success': True})
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class NotificationCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('fan')
+
+    def notify(self, **kwargs):
+        return Notification.objects.create(user=self.user, message='Game on', **kwargs)
+
+    def test_kept_in_step_with_the_notifications(self):
+        first, second, third = self.notify(), self.notify(), self.notify()
+        self.notify(is_read=True)
+        self.assertEqual(NotificationCounter.unread_for(self.user), 3)
+
+        self.assertTrue(first.mark_read())
+        self.assertFalse(first.mark_read())  # already read: not taken off twice
+        self.assertEqual(NotificationCounter.unread_for(self.user), 2)
+
+        second.delete()
+        self.assertEqual(NotificationCounter.unread_for(self.user), 1)
+
+        self.notify()
+        self.assertEqual(Notification.mark_all_read(self.user), 2)
+        self.assertEqual(NotificationCounter.unread_for(self.user), 0)
+        third.refresh_from_db()
+        self.assertTrue(third.is_read)
+
+    def test_saving_a_changed_read_state_moves_the_counter(self):
+        notification = self.notify()
+        notification.is_read = True
+        notification.save()
+        self.assertEqual(NotificationCounter.unread_for(self.user), 0)
+        notification.save()  # unchanged: not taken off twice
+        self.assertEqual(NotificationCounter.unread_for(self.user), 0)
+        notification.is_read = False
+        notification.save()
+        self.assertEqual(NotificationCounter.unread_for(self.user), 1)
+
+        other = User.objects.create_user('rival')
+        notification.user = other
+        notification.save()
+        self.assertEqual((NotificationCounter.unread_for(self.user), NotificationCounter.unread_for(other)), (0, 1))
+
+    def test_recount_repairs_bulk_writes(self):
+        self.notify()
+        Notification.objects.bulk_create([Notification(user=self.user, message='Bulk') for _ in range(4)])
+        self.assertEqual(NotificationCounter.unread_for(self.user), 1)
+        NotificationCounter.recount()
+        self.assertEqual(NotificationCounter.unread_for(self.user), 5)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class NotificationInboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('fan', password='x')
+        for n in range(RECENT_NOTIFICATIONS + 5):
+            Notification.objects.create(user=self.user, message=f'Update {n}')
+
+    def messages(self, inbox):
+        return [notification['message'] for notification in inbox['notifications']]
+
+    def test_latest_slice_cached_until_a_change_commits(self):
+        inbox = notification_inbox(self.user)
+        self.assertEqual(len(inbox['notifications']), RECENT_NOTIFICATIONS)
+        self.assertEqual(inbox['notifications'][0]['message'], f'Update {RECENT_NOTIFICATIONS + 4}')
+        with self.assertNumQueries(0):
+            notification_inbox(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(user=self.user, message='Final whistle')
+        self.assertEqual(notification_inbox(self.user)['notifications'][0]['message'], 'Final whistle')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.mark_all_read(self.user)
+        self.assertTrue(all(notification['is_read'] for notification in notification_inbox(self.user)['notifications']))
+
+    def test_channel_layer_outage_does_not_fail_the_write(self):
+        class DownLayer:
+            async def group_send(self, group, message):
+                raise ConnectionError('Redis is down')
+
+        with mock.patch('ligameet.notifications.get_channel_layer', return_value=DownLayer()):
+            with self.assertLogs('ligameet.notifications', 'ERROR'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    Notification.objects.create(user=self.user, message='Final whistle')
+        self.assertEqual(notification_inbox(self.user)['notifications'][0]['message'], 'Final whistle')
+
+    def test_older_pages_continue_after_the_inbox(self):
+        self.user.profile.role = 'Event Organizer'
+        self.user.profile.save()
+        self.client.force_login(self.user)
+        url, cursor = reverse('event_notifications_view'), notification_inbox(self.user)['older_cursor']
+        with QueryRecorder() as queries:
+            older = self.client.get(url, {'cursor': cursor}).json()
+        self.assertLessEqual(queries.count, resolve(url).func.query_budget)
+        self.assertEqual([n['message'] for n in older['notifications']], [f'Update {n}' for n in range(4, -1, -1)])
+        self.assertIsNone(older['next_cursor'])
+
+    def test_archive_moves_old_read_notifications_in_batches(self):
+        old = timezone.now() - timedelta(days=120)
+        Notification.objects.filter(message__in=['Update 0', 'Update 1', 'Update 2']).update(created_at=old, is_read=True)
+        Notification.objects.filter(message='Update 3').update(created_at=old)  # unread: stays
+        NotificationCounter.recount()
+        notification_inbox(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_notifications', days=90, batch_size=2, stdout=StringIO())
+        self.assertEqual(
+            sorted(ArchivedNotification.objects.values_list('message', flat=True)), ['Update 0', 'Update 1', 'Update 2'],
+        )
+        self.assertFalse(Notification.objects.filter(message__in=['Update 0', 'Update 1', 'Update 2']).exists())
+        self.assertTrue(Notification.objects.filter(message='Update 3').exists())
+        self.assertEqual(NotificationCounter.unread_for(self.user), RECENT_NOTIFICATIONS + 2)
+        self.assertEqual(len(self.messages(notification_inbox(self.user))), RECENT_NOTIFICATIONS)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SeedLeagueTests(TestCase):
+    def test_seeded_users_have_what_the_signals_would_create(self):
+        call_command('seed_league', users=120, events=6, notifications=2, messages=3, stdout=StringIO())
+        users = User.objects.filter(username__startswith='seed_')
+        self.assertEqual(users.count(), 120)
+        self.assertFalse(users.filter(profile__isnull=True).exists())
+        self.assertFalse(users.filter(wallet__isnull=True).exists())
+        self.assertEqual(Notification.objects.count(), 240)
+        self.assertEqual(
+            sum(NotificationCounter.objects.values_list('unread', flat=True)),
+            Notification.objects.filter(is_read=False).count(),
+        )
+        self.assertFalse(ChatGroup.objects.filter(latest_message_id=0, chat_messages__isnull=False).exists())
+        self.assertTrue(PlayerStats.objects.exists())
+
+    def test_same_seed_same_league(self):
+        def league(prefix):
+            call_command('seed_league', users=60, events=4, seed=3, prefix=prefix, stdout=StringIO())
+            return list(User.objects.filter(username__startswith=f'{prefix}_').order_by('id').values_list('first_name', 'profile__role'))
+
+        self.assertEqual(league('a'), league('b'))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class LoadTestCommandTests(TransactionTestCase):
+    # The load test serves its requests from other threads, which a TestCase transaction would hide the league from
+    def test_refuses_to_write_with_debug_off(self):
+        with self.assertRaisesMessage(CommandError, '--allow-writes'):
+            call_command('loadtest', stdout=StringIO())
+
+    def test_short_run_of_every_scenario(self):
+        call_command('seed_league', users=60, events=4, notifications=1, messages=2, stdout=StringIO())
+        # One virtual user at a time: every request gets a thread of its own, and the SQLite test database locks on concurrent writes
+        for scenario in SCENARIOS:
+            with self.subTest(scenario), tempfile.TemporaryDirectory() as directory:
+                output = os.path.join(directory, 'loadtest.json')
+                call_command(
+                    'loadtest', mix=f'{scenario}=1', duration=0.3, output=output, allow_writes=True, stdout=StringIO(),
+                )
+                with open(output) as f:
+                    report = json.load(f)
+                self.assertGreater(report['total']['requests'], 0)
+                self.assertEqual(report['total']['errors'], 0, report['actions'])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class EventStatusTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        self.organizer = User.objects.create_user('organizer')
+        self.sport = Sport.objects.create(SPORT_NAME='Basketball', SPORT_RULES_AND_REGULATIONS='FIBA')
+        self.team = Team.objects.create(TEAM_NAME='Sharks', TEAM_TYPE='Senior', SPORT_ID=self.sport, COACH_ID=User.objects.create_user('coach'))
+
+    def make_event(self, start, end, status='open', deadline=None, teams_needed=1):
+        event = Event.objects.create(
+            EVENT_NAME='Cup', EVENT_DATE_START=self.now + start, EVENT_DATE_END=self.now + end, EVENT_LOCATION='Cebu City',
+            EVENT_STATUS=status, EVENT_ORGANIZER=self.organizer,
+            REGISTRATION_DEADLINE=None if deadline is None else self.now + deadline,
+        )
+        category = TeamCategory.objects.create(sport=self.sport, event=event, name='Senior')
+        details = SportDetails.objects.create(team_category=category, number_of_teams=teams_needed, entrance_fee=Decimal('500.00'))
+        details.teams.add(self.team)
+        return event
+
+    def tick(self):
+        return UpdateEventStatuses(stdout=StringIO()).tick()
+
+    def statuses(self, *events):
+        return [Event.objects.get(pk=event.pk).EVENT_STATUS for event in events]
+
+    def test_status_follows_dates_and_team_readiness(self):
+        day = timedelta(days=1)
+        registering = self.make_event(3 * day, 4 * day, status='Draft')
+        Event.objects.filter(pk=registering.pk).update(EVENT_STATUS='ongoing')  # wrongly ahead; goes back to open
+        closed = self.make_event(3 * day, 4 * day, deadline=-day)
+        started = self.make_event(-day, day)
+        ended = self.make_event(-3 * day, -day)
+        short_of_teams = self.make_event(-day, day, teams_needed=2)
+        defaulted = self.make_event(-3 * day, -day, status='Draft')  # the model default moves on like any other
+        draft = self.make_event(-3 * day, -day, status='draft')  # what create_event saves; held back
+        cancelled = self.make_event(-day, day, status='cancelled')
+
+        self.assertEqual(Event.objects.recompute_statuses(now=self.now), 5)
+        self.assertEqual(
+            self.statuses(registering, closed, started, ended, short_of_teams, defaulted, draft, cancelled),
+            ['open', 'upcoming', 'ongoing', 'finished', 'open', 'finished', 'draft', 'cancelled'],
+        )
+        self.assertEqual(Event.objects.recompute_statuses(now=self.now), 0)
+
+    def test_every_batch_is_one_update(self):
+        events = [self.make_event(-timedelta(days=1), timedelta(days=1)) for _ in range(5)]
+        with self.assertNumQueries(7):  # the id bounds, then per batch the finishing ids and one UPDATE
+            self.assertEqual(Event.objects.recompute_statuses(now=self.now, batch_size=2), 5)
+        self.assertEqual(self.statuses(*events), ['ongoing'] * 5)
+
+    def test_crossed_status_boundary(self):
+        hour = timedelta(hours=1)
+        deadline_passed = self.make_event(timedelta(days=3), timedelta(days=4), deadline=-hour)
+        ended = self.make_event(-timedelta(days=2), -hour, status='ongoing')
+        quiet = self.make_event(timedelta(days=3), timedelta(days=4), deadline=timedelta(days=2))
+        long_ago = self.make_event(-timedelta(days=9), -timedelta(days=8), status='ongoing')
+        self.make_event(-timedelta(days=2), -hour, status='finished')
+        self.make_event(-timedelta(days=2), -hour, status='cancelled')
+
+        crossed = Event.objects.crossed_status_boundary(self.now - 2 * hour, self.now)
+        self.assertEqual(set(crossed), {deadline_passed, ended})
+        self.assertEqual(set(Event.objects.crossed_status_boundary(None, self.now)), {deadline_passed, ended, long_ago})
+        self.assertNotIn(quiet, Event.objects.crossed_status_boundary(None, self.now))
+
+    def test_first_tick_sweeps_later_ticks_only_see_new_boundaries(self):
+        started = self.make_event(-timedelta(days=1), timedelta(days=1))
+        self.assertEqual(self.tick(), 1)
+        self.assertEqual(self.statuses(started), ['ongoing'])
+
+        Event.objects.filter(pk=started.pk).update(EVENT_STATUS='open')  # no boundary since the last tick
+        self.assertEqual(self.tick(), 0)
+        self.assertEqual(self.statuses(started), ['open'])
+
+    def test_tick_across_the_end_date_pays_the_organizer_once(self):
+        event = self.make_event(timedelta(days=-2), timedelta(hours=-1), status='ongoing')
+        cache.set(LAST_TICK_CACHE_KEY, self.now - timedelta(hours=2), None)
+
+        self.assertEqual(self.tick(), 1)
+        event.refresh_from_db()
+        self.assertEqual(event.EVENT_STATUS, 'finished')
+        self.assertEqual(OrganizerPayout.objects.filter(event=event).count(), 1)
+        self.organizer.wallet.refresh_from_db()
+        self.assertEqual(self.organizer.wallet.WALLET_BALANCE, Decimal('400.00'))
+
+        self.assertEqual(self.tick(), 0)
+        UpdateEventStatuses(stdout=StringIO()).tick(full=True)
+        self.assertEqual(OrganizerPayout.objects.count(), 1)
+        self.organizer.wallet.refresh_from_db()
+        self.assertEqual(self.organizer.wallet.WALLET_BALANCE, Decimal('400.00'))
+        self.assertEqual(self.organizer.wallet.transactions.filter(transaction_type='payout').count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class HomeFeedCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        organizer = User.objects.create_user('organizer')
+        self.sport = Sport.objects.create(SPORT_NAME='Basketball', SPORT_RULES_AND_REGULATIONS='FIBA')
+        self.event = Event.objects.create(
+            EVENT_NAME='Summer Cup', EVENT_DATE_START=timezone.now() + timedelta(days=3),
+            EVENT_DATE_END=timezone.now() + timedelta(days=4), EVENT_LOCATION='Cebu City', EVENT_STATUS='open',
+            EVENT_ORGANIZER=organizer, IS_POSTED=True,
+        )
+        self.category = TeamCategory.objects.create(sport=self.sport, event=self.event, name='Senior')
+        self.details = SportDetails.objects.create(team_category=self.category, number_of_teams=4)
+        self.team = Team.objects.create(TEAM_NAME='Sharks', TEAM_TYPE='Senior', SPORT_ID=self.sport, COACH_ID=organizer)
+
+    def assertInvalidates(self, change):
+        render_home_feed(None, None)
+        with self.assertNumQueries(0):
+            render_home_feed(None, None)
+        version = cache.get(HOME_FEED_VERSION_KEY)
+        change()
+        self.assertNotEqual(cache.get(HOME_FEED_VERSION_KEY), version)
+
+    def test_cached_page_shows_the_event_until_it_changes(self):
+        self.assertIn('Summer Cup', render_home_feed(None, None))
+        self.event.EVENT_NAME = 'Winter Cup'
+        self.event.save()
+        html = render_home_feed(None, None)
+        self.assertIn('Winter Cup', html)
+        self.assertNotIn('Summer Cup', html)
+
+    def test_event_category_and_details_changes_invalidate(self):
+        self.assertInvalidates(lambda: self.event.save())
+        self.assertInvalidates(lambda: TeamCategory.objects.create(sport=self.sport, event=self.event, name='Junior'))
+        self.assertInvalidates(lambda: self.details.save())
+        self.assertInvalidates(lambda: self.category.delete())
+
+    def test_m2m_changes_invalidate(self):
+        self.assertInvalidates(lambda: self.event.SPORT.add(self.sport))
+        self.assertInvalidates(lambda: self.details.teams.add(self.team))
+        self.assertInvalidates(lambda: self.details.teams.remove(self.team))
+        self.assertInvalidates(lambda: self.event.SPORT.clear())
+
+    def test_status_recompute_invalidates(self):
+        Event.objects.filter(pk=self.event.pk).update(EVENT_DATE_END=timezone.now() - timedelta(hours=1))
+        self.assertInvalidates(lambda: Event.objects.recompute_statuses())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CursorPaginatorTests(TestCase):
+    def setUp(self):
+        self.wallet = User.objects.create_user('fan').wallet
+        WalletTransaction.objects.bulk_create(
+            WalletTransaction(wallet=self.wallet, amount=Decimal(n), transaction_type='deposit') for n in range(1, 26)
+        )
+        # Every row on the same instant: only the id breaks the tie
+        WalletTransaction.objects.update(created_at=timezone.now())
+        self.paginator = CursorPaginator(WalletTransaction.objects.all(), ('-created_at', '-id'), per_page=10)
+        self.newest_first = list(WalletTransaction.objects.order_by('-id').values_list('id', flat=True))
+
+    def ids(self, page):
+        return [row.id for row in page]
+
+    def test_forward_and_back_through_ties(self):
+        first = self.paginator.page()
+        second = self.paginator.page(first.next_token)
+        third = self.paginator.page(second.next_token)
+        self.assertEqual(self.ids(first) + self.ids(second) + self.ids(third), self.newest_first)
+        self.assertEqual((first.has_previous, first.has_next), (False, True))
+        self.assertEqual((third.has_previous, third.has_next), (True, False))
+        self.assertIsNone(third.next_token)
+
+        back = self.paginator.page(third.previous_token)
+        self.assertEqual(self.ids(back), self.ids(second))
+        self.assertEqual((back.has_previous, back.has_next), (True, True))
+        self.assertEqual(self.ids(self.paginator.page(back.previous_token)), self.ids(first))
+        self.assertFalse(self.paginator.page(back.previous_token).has_previous)
+
+    def test_each_page_is_one_query(self):
+        token = self.paginator.page().next_token
+        with self.assertNumQueries(1):
+            self.paginator.page(token)
+
+    def test_tampered_or_foreign_tokens_give_the_first_page(self):
+        token = self.paginator.page().next_token
+        foreign = signing.dumps({'v': [timezone.now().isoformat(), '5'], 'b': False}, salt='somewhere.else')
+        for bad in (token[:-2] + 'xx', foreign, 'garbage'):
+            page = self.paginator.page(bad)
+            self.assertEqual(self.ids(page), self.newest_first[:10])
+            self.assertFalse(page.has_previous)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class WalletLedgerTests(TestCase):
+    def test_running_balances_across_pages(self):
+        wallet = User.objects.create_user('fan').wallet
+        start = timezone.now() - timedelta(days=1)
+        amounts = [('deposit', '500.00'), ('withdrawal', '120.00'), ('payout', '80.00'), ('refund', '15.50')] * 4
+        balance = Decimal('0.00')
+        expected = []
+        for n, (transaction_type, amount) in enumerate(amounts):
+            row = wallet.transactions.create(amount=Decimal(amount), transaction_type=transaction_type)
+            # Pairs of rows share an instant, so the ledger has to order ties by id
+            WalletTransaction.objects.filter(pk=row.pk).update(created_at=start + timedelta(minutes=n // 2))
+            balance += -Decimal(amount) if transaction_type == 'withdrawal' else Decimal(amount)
+            expected.append((row.id, balance))
+        wallet.WALLET_BALANCE = balance
+        wallet.save()
+        expected.reverse()
+
+        shown, cursor = [], None
+        while True:
+            page = wallet.ledger_page(cursor, per_page=5)
+            shown += [(row.id, row.balance_after) for row in page]
+            if not page.has_next:
+                break
+            cursor = page.next_token
+        self.assertEqual(shown, expected)
+
+        last = wallet.ledger_page(cursor, per_page=5)
+        back = wallet.ledger_page(last.previous_token, per_page=5)
+        self.assertEqual([(row.id, row.balance_after) for row in back], expected[10:15])
@@ -1,7 +1,6 @@
 import base64
 from decimal import Decimal
 from django.utils.timezone import now
-from django.core.paginator import Paginator
 import uuid
 import traceback
 import json
@@ -24,51 +23,36 @@ from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.models import User
 from django.db import IntegrityError
 from chat.models import *
-from django.db.models import Sum, Q
+from django.db.models import Sum, Q, Min, Count
 from .forms import *
 from django.forms import modelformset_factory
 from django.conf import settings
 from paypal.standard.forms import PayPalPaymentsForm
 from django.urls import reverse
+from .feed import render_home_feed, with_category_summaries
+from .notifications import notification_inbox, older_notifications
+from .pagination import CursorPaginator
+from users.middleware import query_budget
 
 @login_required
+@query_budget(14)
 def home(request):
     # Determine user's role and sports
     user_role = request.user.profile.role
-    user_sports = None
 
     if user_role in ['Event Organizer', 'Scout']:
         # Show all events for Event Organizer and Scout
-        events = Event.objects.filter(IS_POSTED=True).exclude(EVENT_STATUS='cancelled').order_by('-EVENT_DATE_START')
+        user_sports = None
     else:
         # Filter events by user's sports for Coach and Player
-        user_sports = SportProfile.objects.filter(USER_ID=request.user).values_list('SPORT_ID', flat=True)
-        events = Event.objects.filter(
-            SPORT__id__in=user_sports,
-            IS_POSTED=True
-        ).exclude(EVENT_STATUS='cancelled').order_by('-EVENT_DATE_START')
+        user_sports = list(SportProfile.objects.filter(USER_ID=request.user).values_list('SPORT_ID', flat=True))
 
-    for event in events:
-        event.update_status()
-
-    events = events.distinct() # Ensure events are unique
-
-    # Check for unread messages
-    has_unread_messages = GroupMessage.objects.filter(
-        group__members=request.user,
-        is_read=False
-    ).exists()
-
-    # Implement pagination
-    paginator = Paginator(events, 6)  # Show 6 events per page
-    page_number = request.GET.get('page')  # Get the current page number
-    page_obj = paginator.get_page(page_number)  # Get paginated events
+    # Statuses are advanced by the update_event_statuses command, not on page load
+    feed_html = render_home_feed(user_sports, request.GET.get('cursor'))
 
     # Prepare context for the template
     context = {
-        'page_obj': page_obj,  # Use the paginated events in the template
-        'has_unread_messages': has_unread_messages,
-        'user_sports': None if user_role in ['Event Organizer', 'Scout'] else list(user_sports),
+        'feed_html': feed_html,  # Cached, paginated event cards
     }
     return render(request, 'ligameet/home.html', context)
 
@@ -148,30 +132,25 @@ def create_event(request):
 
 
 @login_required
+@query_budget(16)
 def event_dashboard(request): 
     try:
         profile = request.user.profile
         if profile.role == 'Event Organizer':
-            # Fetch all events created by the logged-in user (event organizer)
-            organizer_events = Event.objects.filter(EVENT_ORGANIZER=request.user).order_by('-EVENT_DATE_START')
-            
-            for event in organizer_events: #update status
-                event.update_status()
+            # Fetch all events created by the logged-in user (event organizer), with their category summaries
+            organizer_events = with_category_summaries(Event.objects.filter(EVENT_ORGANIZER=request.user).order_by('-EVENT_DATE_START'))
 
             # Fetch sports for the filtering dropdown
             sports = Sport.objects.all()
 
-            has_unread_messages = GroupMessage.objects.filter(
-                group__members=request.user,
-                is_read=False
-            ).exists()
-            notifications = Notification.objects.filter(user=request.user).order_by('-created_at')
+            inbox = notification_inbox(request.user)
 
             context = {
                 'organizer_events': organizer_events,
                 'sports': sports,
-                'has_unread_messages': has_unread_messages,
-                'notifications': notifications,
+                'notifications': inbox['notifications'],
+                'older_notifications_cursor': inbox['older_cursor'],
+                'unread_notifications_count': NotificationCounter.unread_for(request.user),
             }
             return render(request, 'ligameet/events_dashboard.html', context)
         else:
@@ -182,11 +161,24 @@ def event_dashboard(request):
     
     
     
+@login_required
+@query_budget(5)
 def event_notifications_view(request):
-    notifications = Notification.objects.filter(user=request.user).order_by('-created_at')
-    unread_notifications_count = notifications.filter(is_read=False).count()
-    return render(request, 'ligameet/event_dashboard.html', {
-        'notifications': notifications,
+    # One page of notifications at a time; the dashboards' bell follows `next_cursor` to load older ones
+    page = older_notifications(request.user, request.GET.get('cursor'))
+    unread_notifications_count = NotificationCounter.unread_for(request.user)
+    return JsonResponse({
+        'notifications': [
+            {
+                'id': notification.id,
+                'message': notification.message,
+                'is_read': notification.is_read,
+                'created_at': notification.created_at.isoformat(),
+            }
+            for notification in page
+        ],
+        'next_cursor': page.next_token,
+        'previous_cursor': page.previous_token,
         'unread_notifications_count': unread_notifications_count,
     })
 
@@ -202,11 +194,10 @@ def event_mark_notification_read(request):
         notification = Notification.objects.get(id=notification_id, user=request.user)
 
         # Mark the notification as read
-        notification.is_read = True
-        notification.save()
+        notification.mark_read()
 
         # Get updated unread notifications count for the user
-        unread_notifications_count = Notification.objects.filter(user=request.user, is_read=False).count()
+        unread_notifications_count = NotificationCounter.unread_for(request.user)
 
         # Send response with the updated unread count
         return JsonResponse({
@@ -227,50 +218,55 @@ def event_mark_notification_read(request):
 
 
 @login_required
+@query_budget(18)
 def event_details(request, event_id):
-    event = get_object_or_404(Event, id=event_id)
-    event.update_status()  # Ensure the event's status is updated
+    # Categories, their SportDetails (with the registered team count) and the registered teams (with coach
+    # profile and player count) are prefetched once for both the registration and participants tabs
+    event = get_object_or_404(Event.objects.prefetch_related(
+        'SPORT',
+        Prefetch('team_categories', queryset=TeamCategory.objects.select_related('sport').prefetch_related(
+            Prefetch('sport_details', queryset=SportDetails.objects.annotate(teams_registered=Count('teams')).prefetch_related(
+                Prefetch('teams', queryset=Team.objects.select_related('COACH_ID__profile').annotate(player_count=Count('teamparticipant')))
+            ))
+        )),
+    ), id=event_id)
     sports_with_details = []
 
     user_role = request.user.profile.role  # Assuming `profile.role` stores the user's role
 
-    has_unread_messages = GroupMessage.objects.filter(
-        group__members=request.user,
-        is_read=False
-    ).exists()
-
     # Determine which sports to show based on user role
     if user_role in ['Event Organizer', 'Scout']:
         # Show all sports for Event Organizer and Scout
         event_sports = event.SPORT.all()
     else:
         # Filter sports for Coaches and Players based on their associated sports
-        user_sports = request.user.sportprofile_set.values_list('SPORT_ID', flat=True)
-        event_sports = event.SPORT.filter(id__in=user_sports)
+        user_sports = set(request.user.sportprofile_set.values_list('SPORT_ID', flat=True))
+        event_sports = [sport for sport in event.SPORT.all() if sport.id in user_sports]
+
+    # Categories of this event the coach already has a paid invoice for
+    registered_category_ids = set(Invoice.objects.filter(
+        team_category__event=event,
+        coach=request.user,
+        is_paid=True
+    ).values_list('team_category_id', flat=True))
 
     # Loop through each sport associated with the event
     for sport in event_sports:
         # Filter categories linked to the current event
-        sport_categories = TeamCategory.objects.filter(sport=sport, event=event).prefetch_related('sport_details')
+        sport_categories = [category for category in event.team_categories.all() if category.sport_id == sport.id]
 
         categories_with_forms = []
         for category in sport_categories:
-            sport_details = category.sport_details.first()  # Assuming one-to-one relationship with SportDetails
+            sport_details = next(iter(category.sport_details.all()), None)  # Assuming one-to-one relationship with SportDetails
             
             # Calculate remaining slots
             if sport_details:
-                remaining_slots = max(0, sport_details.number_of_teams - sport_details.teams.count())
+                remaining_slots = max(0, sport_details.number_of_teams - sport_details.teams_registered)
             else:
                 remaining_slots = 0
             
             # Check if the coach has already registered for this category (paid invoice)
-            invoice = Invoice.objects.filter(
-                team_category=category,
-                coach=request.user,
-                is_paid=True
-            ).first()  # Get the first paid invoice for this category and coach
-            
-            if invoice:
+            if category.id in registered_category_ids:
                 # If there's a paid invoice, mark as registered
                 categories_with_forms.append({
                     'category': category,
@@ -320,7 +316,6 @@ def event_details(request, event_id):
     context = {
         'event': event,
         'sports_with_details': sports_with_details,
-        'has_unread_messages': has_unread_messages,
     }
 
     return render(request, 'ligameet/event_details.html', context)
@@ -552,6 +547,14 @@ def pay_with_wallet(request):
         wallet.WALLET_BALANCE -= sport_detail.entrance_fee
         wallet.save()
 
+        # Log the payment so the wallet ledger accounts for every change to the balance
+        WalletTransaction.objects.create(
+            wallet=wallet,
+            transaction_type='withdrawal',
+            amount=sport_detail.entrance_fee,
+            description=f"Entrance fee for {sport.SPORT_NAME} ({category.name}) in the event '{category.event.EVENT_NAME}'.",
+        )
+
         # Success message and redirect URL
         success_message = "Registration successful. Please select your team for the event."
 
@@ -738,27 +741,20 @@ def leave_game(request, sport_id, team_category_id):
 
 from django.db.models import Q
 @login_required
+@query_budget(14)
 def wallet_dashboard(request):
     # Fetch the user's wallet
     wallet = get_object_or_404(Wallet, user=request.user)
 
-    # Get invoices associated with the logged-in user (filtering invoices for the user or the coach)
-    invoices = Invoice.objects.filter(
-        models.Q(user=request.user) | models.Q(coach=request.user)
-    ).select_related('event', 'team_category', 'team').order_by('-created_at')
-
-    # Fetch wallet transactions for the logged-in user's wallet
-    transactions = WalletTransaction.objects.filter(wallet=wallet).order_by('-created_at')
+    # Invoices where the user registered themselves or a team they coach; each side is read off its own
+    # (user, created_at) / (coach, created_at) index and merged, instead of one OR that can use neither
+    invoices = Invoice.objects.select_related('event', 'team_category', 'team')
+    page_obj_invoices = CursorPaginator(
+        [invoices.filter(user=request.user), invoices.filter(coach=request.user)], per_page=10
+    ).page(request.GET.get('invoices_cursor'))
 
-    # Paginate the invoices (limit to 10 per page)
-    paginator_invoices = Paginator(invoices, 10)  # Show 10 invoices per page
-    page_number_invoices = request.GET.get('page')  # Get current page number from the request
-    page_obj_invoices = paginator_invoices.get_page(page_number_invoices)  # Get the page object for the current page
-
-    # Paginate the wallet transactions (limit to 10 per page)
-    paginator_transactions = Paginator(transactions, 10)  # Show 10 transactions per page
-    page_number_transactions = request.GET.get('page')  # Get current page number for transactions
-    page_obj_transactions = paginator_transactions.get_page(page_number_transactions)  # Get the page object for the current page
+    # Wallet transactions with the balance left after each one, paged separately from the invoices
+    page_obj_transactions = wallet.ledger_page(request.GET.get('transactions_cursor'), per_page=10)
 
     context = {
         'wallet': wallet,
@@ -903,37 +899,37 @@ from .models import BasketballStats, VolleyballStats, PlayerStats
 
 
 @login_required
+@query_budget(24)
 def player_dashboard(request):
     try:
         profile = request.user.profile
         if profile.role == 'Player':
-            chat_groups = ChatGroup.objects.all()
-            
             sport_profiles = SportProfile.objects.filter(USER_ID=request.user)
-            selected_sports = [sp.SPORT_ID.id for sp in sport_profiles]
+            selected_sports = [sp.SPORT_ID_id for sp in sport_profiles]
 
             query = request.GET.get('q', '')
-            invitations = Invitation.objects.filter(user=request.user, status='Pending')
+            invitations = Invitation.objects.filter(user=request.user, status='Pending').select_related('team')
             participant = User.objects.filter(id=request.user.id).first()
             recent_activities = Activity.objects.filter(user=request.user).order_by('-timestamp')[:5]
-            notifications = Notification.objects.filter(user=request.user).order_by('-created_at')
-            unread_notifications_count = notifications.filter(is_read=False).count()
+            inbox = notification_inbox(request.user)
+            unread_notifications_count = NotificationCounter.unread_for(request.user)
 
-            my_teams = Team.objects.filter(teamparticipant__USER_ID=request.user).prefetch_related(
-                Prefetch('teamparticipant_set', queryset=TeamParticipant.objects.select_related('USER_ID'))
-            )
+            # Teams are listed with their coach and every participant's profile, fetched up front
+            participants = Prefetch('teamparticipant_set', queryset=TeamParticipant.objects.select_related('USER_ID__profile'))
+            my_teams = Team.objects.filter(teamparticipant__USER_ID=request.user).select_related('COACH_ID__profile').prefetch_related(participants)
             
             my_teams_and_participants = [
                 {
                     'team': team,
-                    'participants': TeamParticipant.objects.filter(TEAM_ID=team).select_related('USER_ID')
+                    'participants': team.teamparticipant_set.all()
                 }
                 for team in my_teams
             ]
 
-            teams = Team.objects.filter(SPORT_ID__in=selected_sports).prefetch_related(
-                Prefetch('teamparticipant_set', queryset=TeamParticipant.objects.select_related('USER_ID'))
-            )
+            # Only the chatrooms of the player's own teams are linked from the page
+            chat_groups = ChatGroup.objects.filter(team__in=[item['team'] for item in my_teams_and_participants])
+
+            teams = Team.objects.filter(SPORT_ID__in=selected_sports).select_related('COACH_ID__profile').prefetch_related(participants)
             basketball_teams = teams.filter(SPORT_ID__SPORT_NAME__iexact='Basketball')
             volleyball_teams = teams.filter(SPORT_ID__SPORT_NAME__iexact='Volleyball')
 
@@ -975,7 +971,8 @@ def player_dashboard(request):
                 'volleyball_teams': volleyball_teams,
                 'my_teams_and_participants': my_teams_and_participants,
                 'recent_activities': recent_activities,
-                'notifications': notifications,
+                'notifications': inbox['notifications'],
+                'older_notifications_cursor': inbox['older_cursor'],
                 'unread_notifications_count': unread_notifications_count,
                 'invitations': invitations,
                 'chat_groups': chat_groups,
@@ -1042,8 +1039,7 @@ def mark_notification_read(request, notification_id):
     if request.method == 'POST':
         try:
             notification = Notification.objects.get(id=notification_id, user=request.user)
-            notification.is_read = True
-            notification.save()
+            notification.mark_read()
             return JsonResponse({'message': 'Notification marked as read!'})
         except Notification.DoesNotExist:
             return JsonResponse({'message': 'Notification not found!'}, status=404)
@@ -1053,8 +1049,7 @@ def mark_notification_read(request, notification_id):
 @login_required
 def mark_all_notifications_as_read(request):
     if request.method == 'POST':
-        notifications = Notification.objects.filter(user=request.user, is_read=False)
-        notifications.update(is_read=True)
+        Notification.mark_all_read(request.user)
         return JsonResponse({'message': 'All notifications marked as read!'})
     return JsonResponse({'message': 'Invalid request!'}, status=400)
 
@@ -1169,13 +1164,14 @@ def leave_team(request, team_id):
 
 
 @login_required
+@query_budget(15)
 def scout_dashboard(request):
     try:
         profile = request.user.profile
         if profile.role != 'Scout':
             return redirect('home')
 
-        players = User.objects.filter(profile__role='Player')
+        players = User.objects.filter(profile__role='Player').select_related('profile')
         filter_form = ScoutPlayerFilterForm(request.GET)
         search_query = request.GET.get('search', '').strip()
         position_filters = request.GET.getlist('position')
@@ -1202,11 +1198,11 @@ def scout_dashboard(request):
                 **{f"profile__{position_field}__in": position_filters}
             )
 
-        notifications = Notification.objects.filter(user=request.user).order_by('-created_at')
-        unread_notifications_count = notifications.filter(is_read=False).count()
+        inbox = notification_inbox(request.user)
+        unread_notifications_count = NotificationCounter.unread_for(request.user)
 
-        recruited_players = User.objects.filter(recruited_by__scout=request.user, recruited_by__is_recruited=True)
-        recruited_player_ids = recruited_players.values_list('id', flat=True)
+        recruited_players = User.objects.filter(recruited_by__scout=request.user, recruited_by__is_recruited=True).select_related('profile')
+        recruited_player_ids = set(recruited_players.values_list('id', flat=True))
 
         sports = Sport.objects.all()
 
@@ -1236,7 +1232,8 @@ def scout_dashboard(request):
             'sport_positions': json.dumps(sport_positions),
             'selected_sport_id': selected_sport_id,
             'selected_positions': json.dumps(position_filters),
-            'notifications': notifications,
+            'notifications': inbox['notifications'],
+            'older_notifications_cursor': inbox['older_cursor'],
             'unread_notifications_count': unread_notifications_count,
             'recruited_players': recruited_players,
             'recruited_player_ids': recruited_player_ids,
@@ -1312,6 +1309,7 @@ def poke(request, player_id):
 
 
 @login_required
+@query_budget(24)
 def coach_dashboard(request):
     try:
         profile = request.user.profile
@@ -1333,17 +1331,19 @@ def coach_dashboard(request):
             # Get the sport associated with the coach's profile
             sport = sport_profile.SPORT_ID
 
-            # Filter TeamCategory by the coach's sport and ensure no duplicates by name
-            team_categories = TeamCategory.objects.filter(sport=sport).distinct('name')
+            # Filter TeamCategory by the coach's sport and ensure no duplicates by name (the first category of
+            # each name, so it works on every database rather than only with Postgres' DISTINCT ON)
+            first_of_each_name = TeamCategory.objects.filter(sport=sport).values('name').annotate(first_id=Min('id')).values('first_id')
+            team_categories = TeamCategory.objects.filter(id__in=first_of_each_name).order_by('name')
 
             # Initialize the filter form
             filter_form = PlayerFilterForm(request.GET or None, coach=request.user)
             search_query = request.GET.get('search_query')
             position_filters = request.GET.getlist('position')
             
-            # Get all notifications for the current user
-            notifications = Notification.objects.filter(user=request.user).order_by('-created_at')
-            unread_notifications_count = notifications.filter(is_read=False).count()
+            # The latest notifications for the bell dropdown; new ones arrive over ws/notifications
+            inbox = notification_inbox(request.user)
+            unread_notifications_count = NotificationCounter.unread_for(request.user)
 
             # Build the player query based on search and position filters
             players = User.objects.filter(profile__role='Player')
@@ -1375,7 +1375,8 @@ def coach_dashboard(request):
                 'join_requests': join_requests,
                 'chat_groups': chat_groups,
                 'filter_form': filter_form,
-                'notifications': notifications,
+                'notifications': inbox['notifications'],
+                'older_notifications_cursor': inbox['older_cursor'],
                 'unread_notifications_count': unread_notifications_count,
                 'team_categories': team_categories,
                 'coach_sport': sport_profile.SPORT_ID.SPORT_NAME  # Add the coach's sport dynamically to the context
@@ -1643,8 +1644,7 @@ def coach_mark_notification_read(request):
             notification = Notification.objects.get(id=notification_id, user=request.user)
 
             # Mark the notification as read
-            notification.is_read = True
-            notification.save()
+            notification.mark_read()
 
             # Return success message
             return JsonResponse({'message': 'Notification marked as read'})
@@ -1832,12 +1832,13 @@ def get_teams(request):
 
 
 
+@query_budget(16)
 def get_bracket_data(request, sport_details_id):
     from math import ceil, log2
 
 
     # Get the sport details and event
-    sport_details = get_object_or_404(SportDetails, id=sport_details_id)
+    sport_details = get_object_or_404(SportDetails.objects.select_related('team_category__event__EVENT_ORGANIZER'), id=sport_details_id)
     event = sport_details.team_category.event  
     event_organizer = event.EVENT_ORGANIZER
 
@@ -1913,7 +1914,7 @@ def get_bracket_data(request, sport_details_id):
             )
 
     # Get all matches related to this sport
-    matches = Match.objects.filter(sport_details=sport_details)
+    matches = Match.objects.filter(sport_details=sport_details).select_related('team_a', 'team_b', 'winner')
 
     # Calculate wins and losses for each team
     wins = {}
@@ -1951,6 +1952,7 @@ def get_bracket_data(request, sport_details_id):
 
 
 
+@query_budget(9)
 def save_bracket(request, sport_details_id):
     if request.method == 'POST':
         try:
@@ -1977,69 +1979,53 @@ def save_bracket(request, sport_details_id):
     return JsonResponse({'success': False, 'message': 'Invalid request method.'}, status=405)
 
 
+@query_budget(10)
 def scoreboard_view(request, match_id):
     try:
-        # Get the match using the provided match_id
-        match = Match.objects.get(id=match_id)
+        # Get the match using the provided match_id, with the teams and the event it belongs to
+        match = Match.objects.select_related(
+            'team_a', 'team_b', 'sport_details__team_category__sport', 'sport_details__team_category__event',
+        ).get(id=match_id)
     except Match.DoesNotExist:
         raise Http404("Match not found")
 
     # Get the sport details for the match (to distinguish between basketball and volleyball)
     sport_details = match.sport_details
+    sport_name = sport_details.team_category.sport.SPORT_NAME.lower()
 
     # Teams in the match
     Team_A = match.team_a
     Team_B = match.team_b
 
     # Get the players for each team
-    team_a_players = Team_A.teamparticipant_set.all()
-    team_b_players = Team_B.teamparticipant_set.all()
-
-    # Fetch player stats for each player in the match
-    team_a_stats = []
-    team_b_stats = []
-    for player in team_a_players:
-        try:
-            # Get PlayerStats for the player and match
-            player_stats = PlayerStats.objects.get(player=player.USER_ID, match=match)
-        except PlayerStats.DoesNotExist:
-            player_stats = None
-        except PlayerStats.MultipleObjectsReturned:
-            # Handle the case of multiple PlayerStats being returned
-            player_stats = PlayerStats.objects.filter(player=player.USER_ID, match=match).first()
-
-        if player_stats:
-            if sport_details.team_category.sport.SPORT_NAME.lower() == 'basketball':
-                basketball_stats = BasketballStats.objects.filter(player_stats=player_stats).first()
-                team_a_stats.append(basketball_stats)
-            elif sport_details.team_category.sport.SPORT_NAME.lower() == 'volleyball':
-                volleyball_stats = VolleyballStats.objects.filter(player_stats=player_stats).first()
-                team_a_stats.append(volleyball_stats)
-    
-    for player in team_b_players:
-        try:
-            # Get PlayerStats for the player and match
-            player_stats = PlayerStats.objects.get(player=player.USER_ID, match=match)
-        except PlayerStats.DoesNotExist:
-            player_stats = None
-        except PlayerStats.MultipleObjectsReturned:
-            # Handle the case of multiple PlayerStats being returned
-            player_stats = PlayerStats.objects.filter(player=player.USER_ID, match=match).first()
-
-        if player_stats:
-            if sport_details.team_category.sport.SPORT_NAME.lower() == 'basketball':
-                basketball_stats = BasketballStats.objects.filter(player_stats=player_stats).first()
-                team_b_stats.append(basketball_stats)
-            elif sport_details.team_category.sport.SPORT_NAME.lower() == 'volleyball':
-                volleyball_stats = VolleyballStats.objects.filter(player_stats=player_stats).first()
-                team_b_stats.append(volleyball_stats)
+    team_a_players = Team_A.teamparticipant_set.select_related('USER_ID__profile')
+    team_b_players = Team_B.teamparticipant_set.select_related('USER_ID__profile')
+
+    # Fetch every player's stats for the match in one query; if a player somehow has several rows, the first one is used
+    stats_by_player = {}
+    for player_stats in PlayerStats.objects.filter(match=match).select_related('basketball_stats', 'volleyball_stats').order_by('id'):
+        stats_by_player.setdefault(player_stats.player_id, player_stats)
+
+    def sport_stats(players):
+        stats = []
+        for player in players:
+            player_stats = stats_by_player.get(player.USER_ID_id)
+            if player_stats:
+                if sport_name == 'basketball':
+                    stats.append(getattr(player_stats, 'basketball_stats', None))
+                elif sport_name == 'volleyball':
+                    stats.append(getattr(player_stats, 'volleyball_stats', None))
+        return stats
+
+    team_a_stats = sport_stats(team_a_players)
+    team_b_stats = sport_stats(team_b_players)
 
     # Zip the lists together for easy rendering in the template
     zipped_team_a = zip(team_a_players, team_a_stats)
     zipped_team_b = zip(team_b_players, team_b_stats)
 
     # Determine the sport for conditional rendering in the template
-    sport = sport_details.team_category.sport.SPORT_NAME.lower()
+    sport = sport_name
 
      
     # Context data for the template
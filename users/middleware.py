@@ -1,8 +1,48 @@
 # users/middleware.py
 
+import cProfile
+import hmac
+import io
+import logging
+import marshal
+import pstats
+import random
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
 from django.shortcuts import redirect
+from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin
 from .models import Profile
+from .profiling import StackSampler, instrument_templates, save_capture, template_log
+
+budget_logger = logging.getLogger('users.querybudget')
+
+ROLE_STATE_TIMEOUT = 60 * 60 * 24  # seconds; profile saves invalidate it long before this
+
+
+def role_state_cache_key(user_id):
+    return f'users:role_state:{user_id}'
+
+
+def invalidate_role_state(user_id):
+    """Drops the cached role/first-login state, so the next request re-reads the profile."""
+    cache.delete(role_state_cache_key(user_id))
+
+
+def needs_role(user):
+    """Whether the user still has to pick a role, cached per user so steady-state requests run no query."""
+    key = role_state_cache_key(user.pk)
+    state = cache.get(key)
+    if state is None:
+        profile, created = Profile.objects.get_or_create(user=user)
+        state = not profile.role and not profile.is_scout and profile.first_login
+        cache.set(key, state, ROLE_STATE_TIMEOUT)
+    return state
+
 
 class RolePickerMiddleware(MiddlewareMixin):
     def process_request(self, request):
@@ -13,14 +53,191 @@ class RolePickerMiddleware(MiddlewareMixin):
         ]
 
         if request.user.is_authenticated:
-            profile, created = Profile.objects.get_or_create(user=request.user)
-
             # Exclude paths that match the excluded_paths list
             if any(request.path.startswith(path) for path in excluded_paths):
                 return None
 
             # Redirect if role, is_scout, or first_login conditions are not met
-            if not profile.role and not profile.is_scout and profile.first_login:
+            if needs_role(request.user):
                 return redirect('choose_role')
 
         return None
+
+
+class QueryRecorder:
+    """Counts the SQL queries run inside a `with` block, and the time spent running them.
+
+    Hooks every database connection with execute_wrapper, so it works with DEBUG off
+    and costs one perf_counter pair per query. With `statements=False` only the count
+    and the total time are kept, so recording a long request holds no SQL in memory.
+    """
+
+    def __init__(self, statements=True):
+        self.count = 0
+        self.duration = 0.0  # seconds
+        self.statements = []
+        self.timings = []  # seconds, one per statement
+        self.keep_statements = statements
+        self._hooks = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if self.keep_statements:
+                self.statements.append(sql)
+                self.timings.append(elapsed)
+
+    def __enter__(self):
+        self._hooks = ExitStack()
+        for connection in connections.all():
+            self._hooks.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._hooks.close()
+
+
+def query_budget(max_queries):
+    """Declares the most SQL queries a view may run per request, middleware included.
+
+    QueryBudgetMiddleware logs requests that go over it and the test suite fails
+    when a view does, so an N+1 shows up as a broken build instead of a slow page.
+    """
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+class QueryBudgetMiddleware:
+    """Records the SQL query count and time of every request, per view.
+
+    Each request is logged on the `users.querybudget` logger at DEBUG, or WARNING
+    when the view declared a @query_budget and went over it. With DEBUG on, the
+    numbers are also sent back in X-Query-Count and X-Query-Time headers.
+    Only loaded when QUERY_BUDGET_ENABLED is set, and never keeps the SQL itself.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', settings.DEBUG):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder(statements=False) as queries:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else request.path
+        budget = getattr(match.func, 'query_budget', None) if match else None
+        level = logging.WARNING if budget is not None and queries.count > budget else logging.DEBUG
+        budget_logger.log(
+            level, "%s %s: %d queries in %.1fms (budget %s)",
+            request.method, view_name, queries.count, queries.duration * 1000, budget if budget is not None else '-',
+        )
+
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(queries.count)
+            response['X-Query-Time'] = f"{queries.duration * 1000:.1f}ms"
+        return response
+
+
+class ProfilingMiddleware:
+    """Profiles a sample of requests, plus any request a staff user asks for, into an on-disk ring buffer.
+
+    A request is profiled when it carries the PROFILING_HEADER (from a staff user, or
+    with PROFILING_TOKEN as its value) or falls in the PROFILING_SAMPLE_PERCENT sample.
+    The header value may pick the profiler: "cprofile" or "sample" (a stack sampler
+    whose folded output feeds flamegraph.pl or speedscope); otherwise PROFILING_MODE.
+    Each capture keeps the profile, the SQL queries with timings and the template
+    render times, and is listed at /admin/profiles/.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        trigger = self.trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+
+        mode = request.headers.get(self.header_name(), '').lower()
+        if mode not in ('cprofile', 'sample'):
+            mode = getattr(settings, 'PROFILING_MODE', 'cprofile')
+        profiler = cProfile.Profile() if mode == 'cprofile' else StackSampler()
+        templates = []
+        token = template_log.set(templates)
+        started = time.perf_counter()
+        try:
+            with QueryRecorder() as queries:
+                if mode == 'cprofile':
+                    try:
+                        profiler.enable()
+                    except ValueError:  # another profiler is already running in this process
+                        return self.get_response(request)
+                    try:
+                        response = self.get_response(request)
+                    finally:
+                        profiler.disable()
+                else:
+                    profiler.start()
+                    try:
+                        response = self.get_response(request)
+                    finally:
+                        profiler.stop()
+        finally:
+            template_log.reset(token)
+        duration = time.perf_counter() - started
+
+        if mode == 'cprofile':
+            profiler.create_stats()
+            payload = marshal.dumps(profiler.stats)  # what pstats.Stats / snakeviz load
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(25)
+            summary = summary.getvalue()
+        else:
+            payload = profiler.folded()
+            summary = ''.join(f'{count:>6}  {stack.rsplit(";", 1)[-1]}\n' for stack, count in profiler.stacks.most_common(25))
+
+        match = getattr(request, 'resolver_match', None)
+        capture_id = save_capture({
+            'created_at': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': match.view_name if match else None,
+            'user': request.user.get_username() if getattr(request, 'user', None) and request.user.is_authenticated else None,
+            'status': response.status_code,
+            'trigger': trigger,
+            'mode': mode,
+            'duration_ms': round(duration * 1000, 2),
+            'query_count': queries.count,
+            'query_ms': round(queries.duration * 1000, 2),
+            'queries': [{'sql': sql, 'ms': round(elapsed * 1000, 2)} for sql, elapsed in zip(queries.statements, queries.timings)],
+            'template_ms': round(sum(template['ms'] for template in templates if template['depth'] == 0), 2),
+            'templates': templates,
+            'summary': summary,
+        }, payload)
+        if trigger == 'header':
+            response['X-Profile-Id'] = capture_id
+        return response
+
+    def header_name(self):
+        return getattr(settings, 'PROFILING_HEADER', 'X-Profile')
+
+    def trigger(self, request):
+        """'header', 'sample', or None when this request is not profiled."""
+        value = request.headers.get(self.header_name())
+        if value is not None:
+            token = getattr(settings, 'PROFILING_TOKEN', None)
+            user = getattr(request, 'user', None)
+            if (user is not None and user.is_staff) or (token and hmac.compare_digest(value.encode(), token.encode())):
+                return 'header'
+        if random.random() * 100 < getattr(settings, 'PROFILING_SAMPLE_PERCENT', 0):
+            return 'sample'
+        return None
@@ -2,10 +2,31 @@
 
 from django.db import models
 from django.contrib.auth.models import User
-import random, string
+import string
 from ligameet.models import SportProfile
 from cloudinary.models import CloudinaryField
 
+INV_CODE_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+INV_CODE_LENGTH = 9  # random codes handed out before were 8 long, so the two kinds never collide
+INV_CODE_SPACE = len(INV_CODE_ALPHABET) ** INV_CODE_LENGTH
+INV_CODE_MULTIPLIER = 3602879701896397  # coprime with INV_CODE_SPACE, which makes the mapping one-to-one
+INV_CODE_OFFSET = 4852604211837269
+
+
+def inv_code_for(user_id):
+    """Invitation code for a user id: a base62 encoding of an affine permutation of the id.
+
+    Distinct ids always give distinct codes, so nothing has to be checked or retried and
+    bulk_create can assign codes up front, while consecutive users get unrelated codes.
+    """
+    n = (user_id * INV_CODE_MULTIPLIER + INV_CODE_OFFSET) % INV_CODE_SPACE
+    code = []
+    for _ in range(INV_CODE_LENGTH):
+        n, digit = divmod(n, len(INV_CODE_ALPHABET))
+        code.append(INV_CODE_ALPHABET[digit])
+    return ''.join(reversed(code))
+
+
 class Profile(models.Model):
     ROLE_CHOICES = [
         ('Player', 'Player'),
@@ -98,13 +119,19 @@ class Profile(models.Model):
         super().save(*args, **kwargs)
 
 
+    @classmethod
+    def create_missing(cls, users=None, batch_size=1000):
+        """Bulk-creates a profile for every user in `users` (default: all) that has none. Returns how many."""
+        users = User.objects.all() if users is None else users
+        user_ids = list(users.filter(profile__isnull=True).values_list('id', flat=True))
+        cls.objects.bulk_create(
+            [cls(user_id=user_id, INV_CODE=inv_code_for(user_id)) for user_id in user_ids], batch_size=batch_size,
+        )
+        return len(user_ids)
+
     def generate_inv_code(self):
-        """Generates a unique invitation code."""
-        characters = string.ascii_letters + string.digits
-        while True:
-            code = ''.join(random.choice(characters) for _ in range(8))
-            if not Profile.objects.filter(INV_CODE=code).exists():
-                return code
+        """The invitation code of this profile's user; unique without asking the database."""
+        return inv_code_for(self.user_id)
     
     def get_position_choices(self):
         """Returns position choices based on the primary sport associated with the user."""
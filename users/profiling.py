@@ -0,0 +1,138 @@
+import contextvars
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.template import base as template_base
+
+CAPTURE_ID = re.compile(r'^\d+-[0-9a-f]{8}$')
+PAYLOAD_EXTENSIONS = {'cprofile': 'prof', 'sample': 'folded'}
+
+# The template renders of the request being profiled; None when nothing is profiling
+template_log = contextvars.ContextVar('profiling_template_log', default=None)
+template_depth = contextvars.ContextVar('profiling_template_depth', default=0)
+
+
+def profiles_dir():
+    return str(getattr(settings, 'PROFILING_DIR', None) or os.path.join(tempfile.gettempdir(), 'ligameet-profiles'))
+
+
+def instrument_templates():
+    """Times Template.render, for the requests being profiled only. Safe to call more than once."""
+    render = template_base.Template.render
+    if getattr(render, 'profiling', False):
+        return
+
+    @wraps(render)
+    def timed_render(self, context):
+        log = template_log.get()
+        if log is None:
+            return render(self, context)
+        depth = template_depth.get()
+        token = template_depth.set(depth + 1)
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            template_depth.reset(token)
+            log.append({'name': self.origin.template_name or self.origin.name, 'ms': round((time.perf_counter() - start) * 1000, 2), 'depth': depth})
+
+    timed_render.profiling = True
+    template_base.Template.render = timed_render
+
+
+class StackSampler:
+    """Samples the stack of one thread every `interval` seconds from a background thread.
+
+    Output is in the collapsed "frame;frame;frame count" format that flamegraph.pl and
+    speedscope read. Cheaper than cProfile on deep call trees and does not skew them.
+    """
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common()).encode()
+
+
+def save_capture(meta, payload):
+    """Writes one capture to the ring buffer, dropping the oldest ones beyond PROFILING_MAX_CAPTURES."""
+    directory = profiles_dir()
+    os.makedirs(directory, exist_ok=True)
+    capture_id = f'{time.time_ns()}-{uuid.uuid4().hex[:8]}'
+    meta = dict(meta, id=capture_id)
+
+    for name, content in ((f"{capture_id}.{PAYLOAD_EXTENSIONS[meta['mode']]}", payload),
+                          (f'{capture_id}.json', json.dumps(meta).encode())):
+        partial = os.path.join(directory, f'.{name}.tmp')
+        with open(partial, 'wb') as f:
+            f.write(content)
+        os.replace(partial, os.path.join(directory, name))  # the .json lands last, so listed captures are complete
+
+    captures = sorted(name[:-5] for name in os.listdir(directory) if name.endswith('.json'))
+    for old_id in captures[:max(0, len(captures) - getattr(settings, 'PROFILING_MAX_CAPTURES', 50))]:
+        for extension in ['json'] + list(PAYLOAD_EXTENSIONS.values()):
+            try:
+                os.remove(os.path.join(directory, f'{old_id}.{extension}'))
+            except FileNotFoundError:
+                pass
+    return capture_id
+
+
+def list_captures():
+    """Metadata of every capture in the ring buffer, newest first."""
+    directory = profiles_dir()
+    if not os.path.isdir(directory):
+        return []
+    captures = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    captures.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # pruned or half-written while listing
+    return captures
+
+
+def capture_file(capture_id, kind):
+    """Path of a capture's 'meta' (JSON) or 'profile' file, or None if there is no such capture."""
+    if not CAPTURE_ID.match(capture_id) or kind not in ('meta', 'profile'):
+        return None
+    directory = profiles_dir()
+    extensions = ['json'] if kind == 'meta' else list(PAYLOAD_EXTENSIONS.values())
+    for extension in extensions:
+        path = os.path.join(directory, f'{capture_id}.{extension}')
+        if os.path.exists(path):
+            return path
+    return None
@@ -1,15 +1,42 @@
-from django.db.models.signals import post_save
+import contextvars
+from contextlib import contextmanager
+from django.db.models.signals import post_save, post_delete
 from django.contrib.auth.models import User
 from django.dispatch import receiver
 from .models import Profile
-  
-  
+from .middleware import invalidate_role_state
+
+# Off inside bulk_user_import(), which creates the missing rows in bulk instead
+per_user_signals = contextvars.ContextVar('per_user_signals', default=True)
+
+
+@contextmanager
+def bulk_user_import():
+    """Skips the per-user Profile and Wallet creation while importing users, then creates them in bulk.
+
+    Use around bulk_create or loops of User.save(); every user left without a profile
+    or wallet gets one on the way out (nothing is created if the block raised).
+    """
+    # Import here to avoid circular import
+    from ligameet.models import Wallet
+
+    token = per_user_signals.set(False)
+    try:
+        yield
+    finally:
+        per_user_signals.reset(token)
+    Profile.create_missing()
+    Wallet.create_missing()
+
+
 @receiver(post_save, sender=User)  #creates a profile every time a user is created
-def create_profile(sender, instance, created, **kwargs):
-    if created:
+def create_profile(sender, instance, created, raw=False, **kwargs):
+    # Nothing on Profile depends on User fields, so later saves (e.g. last_login) leave it alone
+    if created and not raw and per_user_signals.get():
         Profile.objects.create(user=instance)
 
 
-@receiver(post_save, sender=User)  #function to save the profile
-def save_profile(sender, instance, **kwargs):
-    instance.profile.save()
+@receiver(post_save, sender=Profile)  #role, is_scout or first_login may have changed
+@receiver(post_delete, sender=Profile)
+def invalidate_cached_role_state(sender, instance, **kwargs):
+    invalidate_role_state(instance.user_id)
@@ -1,3 +1,257 @@
-from django.test import TestCase
+import json
+import marshal
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from ligameet.models import Team, Invitation
+from ligameet.tests import LOCMEM_CACHE, QueryBudgetTestCase
+from .middleware import QueryRecorder, query_budget
+from .models import Profile, inv_code_for
+from .profiling import list_captures
+from .signals import bulk_user_import
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ApiQueryBudgetTests(QueryBudgetTestCase):
+    """The mobile api/ endpoints, each against its @query_budget."""
+
+    def test_sports(self):
+        response = self.get_within_budget(reverse('get_sports'))
+        self.assertEqual(len(response.json()), 2)
+
+    def test_events(self):
+        response = self.get_within_budget(reverse('get-events') + '?limit=2')
+        self.assertEqual(len(response.json()), 2)
+        self.assertIn('X-Next-Cursor', response)
+        response = self.get_within_budget(reverse('get-events') + '?limit=2&cursor=' + response['X-Next-Cursor'])
+        self.assertEqual(len(response.json()), 1)
+
+    def test_events_unpaged_without_limit(self):
+        response = self.get_within_budget(reverse('get-events'))
+        self.assertEqual([event['name'] for event in response.json()], [f'League Event {e}' for e in (2, 1, 0)])
+        self.assertNotIn('X-Next-Cursor', response)
+        self.assertNotIn('Link', response)
+
+    def test_invitations(self):
+        player = self.league['player']
+        response = self.get_within_budget(reverse('get-invitations', args=[player.id]))
+        self.assertEqual(len(response.json()), 1)
+
+    def test_fetch_account(self):
+        player = self.league['player']
+        response = self.get_within_budget(reverse('fetch_account') + f'?user_id={player.id}')
+        self.assertEqual(response.json()['account_details']['sports'], ['Basketball'])
+
+    def test_fetch_teams(self):
+        player = self.league['player']
+        response = self.get_within_budget(reverse('fetch_teams') + f'?user_id={player.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['teams']), 4)
+
+    def test_login(self):
+        response = self.get_within_budget(
+            reverse('loginAPI'), method='post', data={'email': 'player_basketball_0_0@example.com', 'password': 'x'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_register(self):
+        response = self.get_within_budget(
+            reverse('registerAPI'), method='post', data={'email': 'new@example.com', 'username': 'new', 'password': 'x'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_invitation(self):
+        invitation = Invitation.objects.filter(user=self.league['player']).first()
+        response = self.get_within_budget(
+            reverse('update_invitation_status'), method='post', data={'invitation_id': invitation.id, 'status': 'Accepted'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_account(self):
+        response = self.get_within_budget(
+            reverse('update_account'), method='put', data={'user_id': self.league['player'].id, 'first_name': 'Ana'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_join_team(self):
+        team = Team.objects.filter(SPORT_ID=self.league['basketball']).last()
+        response = self.get_within_budget(
+            reverse('join_team'), method='post', data={'user_id': self.league['player'].id, 'team_id': team.id},
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_team_leave(self):
+        response = self.get_within_budget(
+            reverse('team_leave'), method='post', data={'user_id': self.league['player'].id, 'team_id': self.league['team'].id},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_sport(self):
+        response = self.get_within_budget(
+            reverse('update_sport'), method='post', data={'user_id': self.league['player'].id, 'sport_name': 'Volleyball'},
+            content_type='application/json',
+        )
+        self.assertIn(response.status_code, (200, 400))
+
+
+@override_settings(CACHES=LOCMEM_CACHE, QUERY_BUDGET_ENABLED=True)
+class QueryBudgetMiddlewareTests(QueryBudgetTestCase):
+    def test_request_over_budget_is_logged(self):
+        get_sports = reverse('get_sports')
+        view = self.client.get(get_sports).resolver_match.func
+        original = view.query_budget
+        query_budget(0)(view)
+        try:
+            with self.assertLogs('users.querybudget', 'WARNING') as logs:
+                self.client.get(get_sports)
+        finally:
+            view.query_budget = original
+        self.assertIn('get_sports', logs.output[0])
+
+    @override_settings(DEBUG=True)
+    def test_debug_responses_carry_query_headers(self):
+        response = self.client.get(reverse('get_sports'))
+        self.assertEqual(response['X-Query-Count'], '1')
+        self.assertTrue(response['X-Query-Time'].endswith('ms'))
+
+    @override_settings(DEBUG=True, QUERY_BUDGET_ENABLED=False)
+    def test_not_loaded_when_disabled(self):
+        with self.assertNoLogs('users.querybudget', 'DEBUG'):
+            response = self.client.get(reverse('get_sports'))
+        self.assertNotIn('X-Query-Count', response)
+
+    def test_counts_without_keeping_statements(self):
+        with QueryRecorder(statements=False) as queries:
+            list(User.objects.all())
+        self.assertEqual(queries.count, 1)
+        self.assertEqual(queries.statements, [])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, PROFILING_MAX_CAPTURES=2)
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profiling_dir = override_settings(PROFILING_DIR=directory.name)
+        profiling_dir.enable()
+        self.addCleanup(profiling_dir.disable)
+        self.staff = User.objects.create_user('staff', password='x', is_staff=True)
+        self.staff.profile.role = 'Event Organizer'
+        self.staff.profile.save()
+        self.client.force_login(self.staff)
+
+    def test_header_from_staff_captures_queries_and_templates(self):
+        response = self.client.get(reverse('home'), HTTP_X_PROFILE='cprofile')
+        [capture] = list_captures()
+        self.assertEqual(response['X-Profile-Id'], capture['id'])
+        self.assertEqual(capture['view'], 'home')
+        self.assertGreater(capture['query_count'], 0)
+        self.assertEqual(len(capture['queries']), capture['query_count'])
+        self.assertIn('ligameet/home.html', [template['name'] for template in capture['templates']])
+
+        download = self.client.get(reverse('profiling-capture-download', args=[capture['id'], 'profile']))
+        self.assertTrue(marshal.loads(b''.join(download.streaming_content)))
+        download = self.client.get(reverse('profiling-capture-download', args=[capture['id'], 'meta']))
+        self.assertEqual(json.loads(b''.join(download.streaming_content))['id'], capture['id'])
+
+    def test_ring_buffer_keeps_the_newest(self):
+        for mode in ('cprofile', 'sample', 'sample'):
+            self.client.get(reverse('ligameet-about'), HTTP_X_PROFILE=mode)
+        captures = list_captures()
+        self.assertEqual([capture['mode'] for capture in captures], ['sample', 'sample'])
+        response = self.client.get(reverse('profiling-captures'))
+        self.assertContains(response, captures[0]['id'])
+
+    def test_header_ignored_for_other_users(self):
+        self.client.force_login(User.objects.create_user('player', password='x'))
+        response = self.client.get(reverse('ligameet-about'), HTTP_X_PROFILE='cprofile')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list_captures(), [])
+        self.assertEqual(self.client.get(reverse('profiling-captures')).status_code, 302)
+
+    @override_settings(PROFILING_TOKEN='s3cret')
+    def test_header_with_the_token(self):
+        self.client.logout()
+        for value in ('wrong', 's3cret-but-longer', 'sécret', 's3cret'):
+            self.client.get(reverse('ligameet-about'), HTTP_X_PROFILE=value)
+        self.assertEqual([capture['trigger'] for capture in list_captures()], ['header'])
+
+    @override_settings(PROFILING_SAMPLE_PERCENT=100)
+    def test_sampled_requests(self):
+        self.client.logout()
+        self.client.get(reverse('ligameet-about'))
+        self.assertEqual([capture['trigger'] for capture in list_captures()], ['sample'])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RolePickerMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('newcomer', password='x')
+        self.client.force_login(self.user)
+
+    def test_role_state_is_cached_until_the_profile_changes(self):
+        self.assertRedirects(self.client.get(reverse('ligameet-about')), reverse('choose_role'), fetch_redirect_response=False)
+        with QueryRecorder() as queries:
+            self.client.get(reverse('ligameet-about'))
+        self.assertFalse([sql for sql in queries.statements if 'users_profile' in sql])
+
+        self.user.profile.role = 'Player'
+        self.user.profile.save()
+        self.assertEqual(self.client.get(reverse('ligameet-about')).status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class UserSignalTests(TestCase):
+    def test_saving_a_user_leaves_profile_and_wallet_alone(self):
+        user = User.objects.create_user('member', password='x')
+        self.assertIsNotNone(user.profile.INV_CODE)
+        self.assertIsNotNone(user.wallet.pk)
+        user = User.objects.get(pk=user.pk)
+        with QueryRecorder() as queries:
+            user.save(update_fields=['last_login'])
+        self.assertEqual(queries.count, 1)
+
+    def test_bulk_user_import_creates_profiles_and_wallets_in_bulk(self):
+        with bulk_user_import():
+            User.objects.bulk_create([User(username=f'imported_{n}') for n in range(20)])
+            User.objects.create_user('saved_one_by_one')
+        users = User.objects.filter(username__in=[f'imported_{n}' for n in range(20)] + ['saved_one_by_one'])
+        self.assertEqual(users.filter(profile__isnull=False, wallet__isnull=False).count(), 21)
+        codes = set(users.values_list('profile__INV_CODE', flat=True))
+        self.assertEqual(len(codes), 21)
+        self.assertNotIn(None, codes)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class InvitationCodeTests(TestCase):
+    def test_codes_are_unique_per_user_id(self):
+        codes = {inv_code_for(user_id) for user_id in range(1, 20001)}
+        self.assertEqual(len(codes), 20000)
+        self.assertEqual({len(code) for code in codes}, {9})
+
+    def test_new_profile_gets_its_code_without_a_lookup(self):
+        with QueryRecorder() as queries:
+            user = User.objects.create_user('member', password='x')
+        self.assertEqual(user.profile.INV_CODE, inv_code_for(user.id))
+        self.assertFalse([sql for sql in queries.statements if 'INV_CODE' in sql and sql.lstrip().startswith('SELECT')])
+
+    def test_backfill(self):
+        legacy, blank = User.objects.create_user('legacy'), User.objects.create_user('blank')
+        Profile.objects.filter(user=legacy).update(INV_CODE='Ab3dE6gH')
+        Profile.objects.filter(user=blank).update(INV_CODE=None)
+
+        call_command('backfill_inv_codes', stdout=StringIO())
+        self.assertEqual(Profile.objects.get(user=legacy).INV_CODE, 'Ab3dE6gH')
+        self.assertEqual(Profile.objects.get(user=blank).INV_CODE, inv_code_for(blank.id))
+
+        call_command('backfill_inv_codes', reissue=True, stdout=StringIO())
+        self.assertEqual(Profile.objects.get(user=legacy).INV_CODE, inv_code_for(legacy.id))
@@ -1,16 +1,21 @@
 import os
 from django.shortcuts import get_object_or_404, render, redirect
 from django.db import transaction
+from django.db.models import Prefetch
 from django.contrib import messages
 from django.contrib.auth import update_session_auth_hash 
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.hashers import check_password, make_password
 from .forms import UserRegisterForm, UserUpdateForm, ProfileUpdateForm, PlayerForm, VolleyBallForm, BasketBallForm
 from .models import Profile, SportProfile, User
+from .middleware import query_budget
+from .profiling import list_captures, capture_file
 from ligameet.models import Sport, Event, Invitation, TeamParticipant, Team, JoinRequest
+from ligameet.pagination import CursorPage, CursorPaginator
 import json
-from django.http import JsonResponse
+from django.http import JsonResponse, FileResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 import random
 import string
@@ -21,6 +26,7 @@ from django.conf import settings
 from paypal.standard.forms import PayPalPaymentsForm
 from django.urls import reverse
 import uuid
+from urllib.parse import urlencode
 from datetime import datetime
 from django.core.exceptions import ObjectDoesNotExist
 import logging
@@ -28,6 +34,7 @@ from django.utils import timezone
 
 
 @csrf_exempt
+@query_budget(18)
 def register_user(request):
     if request.method == 'POST':
         body = json.loads(request.body)
@@ -89,6 +96,7 @@ def register_user(request):
     return JsonResponse({'error': 'Invalid request method'}, status=400)
 
 @csrf_exempt
+@query_budget(4)
 def login_user(request):
     if request.method == 'POST':
         body = json.loads(request.body)
@@ -129,6 +137,7 @@ def login_user(request):
     return JsonResponse({'error': 'Invalid request method'}, status=400)
 
 
+@query_budget(3)
 def get_sports(request):
     sports = Sport.objects.values('id', 'SPORT_NAME', 'IMAGE')  # Include the fields you need
     # Add the full URL for the image
@@ -140,6 +149,7 @@ def get_sports(request):
 
 
 @csrf_exempt
+@query_budget(6)
 def update_user_sport(request):
     if request.method == 'POST':
         try:
@@ -162,12 +172,24 @@ def update_user_sport(request):
 
 
 @csrf_exempt
+@query_budget(4)
 def get_events(request):
     if request.method == 'GET':
-        events = Event.objects.all()
+        # The body stays a plain list for the app; the cursor for the next/previous page goes in headers.
+        # Paging is opt-in: without `limit` or `cursor` every event comes back, as clients that predate it expect
+        events = Event.objects.select_related('EVENT_ORGANIZER').prefetch_related('SPORT')
+        limit, cursor = request.GET.get('limit', ''), request.GET.get('cursor')
+        if not limit and not cursor:
+            page = CursorPage(
+                list(events.order_by('-EVENT_DATE_START', '-id')),
+                has_next=False, has_previous=False, next_token=None, previous_token=None,
+            )
+        else:
+            limit = min(int(limit), 200) if limit.isdigit() and int(limit) > 0 else 50
+            page = CursorPaginator(events, ('-EVENT_DATE_START', '-id'), limit).page(cursor)
         events_list = []
 
-        for event in events:
+        for event in page:
             events_list.append({
                 'id': event.id,
                 'name': event.EVENT_NAME,
@@ -185,7 +207,17 @@ def get_events(request):
                 'registration_deadline': event.REGISTRATION_DEADLINE,
             })
 
-        return JsonResponse(events_list, safe=False)
+        response = JsonResponse(events_list, safe=False)
+        links = []
+        if page.next_token:
+            response['X-Next-Cursor'] = page.next_token
+            links.append(f'<{request.build_absolute_uri("?" + urlencode({"cursor": page.next_token, "limit": limit}))}>; rel="next"')
+        if page.previous_token:
+            response['X-Previous-Cursor'] = page.previous_token
+            links.append(f'<{request.build_absolute_uri("?" + urlencode({"cursor": page.previous_token, "limit": limit}))}>; rel="prev"')
+        if links:
+            response['Link'] = ', '.join(links)
+        return response
 
     return JsonResponse({'error': 'Invalid request method'}, status=400)
 
@@ -193,9 +225,10 @@ def get_events(request):
 
 
 @csrf_exempt
+@query_budget(3)
 def get_invitations(request, user_id):
     if request.method == 'GET':
-        invitations = Invitation.objects.filter(user_id=user_id)
+        invitations = Invitation.objects.filter(user_id=user_id).select_related('team')
         invitations_list = []
 
         for invitation in invitations:
@@ -219,6 +252,7 @@ def get_invitations(request, user_id):
 
 
 @csrf_exempt
+@query_budget(8)
 def update_invitation_status(request):
     if request.method == 'POST':
         try:
@@ -268,6 +302,7 @@ def update_invitation_status(request):
 
 
 @csrf_exempt
+@query_budget(5)
 def fetch_account_details(request):
     if request.method == 'GET':
         user_id = request.GET.get('user_id')
@@ -276,6 +311,7 @@ def fetch_account_details(request):
         try:
             user = User.objects.get(id=user_id)
             profile = Profile.objects.get(user=user)
+            sports = [sport.SPORT_ID.SPORT_NAME for sport in profile.sports.select_related('SPORT_ID')]
 
             account_details = {
                 'username': user.username,
@@ -291,8 +327,8 @@ def fetch_account_details(request):
                 'phone': profile.PHONE,
                 'role': profile.role,
                 'image_url': request.build_absolute_uri(profile.image.url) if profile.image else None,
-                'sports': [sport.SPORT_ID.SPORT_NAME for sport in profile.sports.all()],
-                'has_selected_sport': profile.sports.exists(),
+                'sports': sports,
+                'has_selected_sport': bool(sports),
             }
             return JsonResponse({'account_details': account_details}, status=200)
         except ObjectDoesNotExist:
@@ -308,6 +344,7 @@ def fetch_account_details(request):
 logger = logging.getLogger(__name__)
 
 @csrf_exempt
+@query_budget(4)
 def update_account_details(request):
     if request.method == 'PUT':
         try:
@@ -338,6 +375,7 @@ def update_account_details(request):
 
 
 @csrf_exempt
+@query_budget(6)
 def fetch_teams(request):
     if request.method == 'GET':
         user_id = request.GET.get('user_id')
@@ -352,7 +390,9 @@ def fetch_teams(request):
                 return JsonResponse({'teams': []}, status=200)
 
             selected_sports = sport_profiles.values_list('SPORT_ID', flat=True)
-            teams = Team.objects.filter(SPORT_ID__in=selected_sports).prefetch_related('teamparticipant_set', 'COACH_ID')
+            teams = Team.objects.filter(SPORT_ID__in=selected_sports).select_related('COACH_ID').prefetch_related(
+                Prefetch('teamparticipant_set', queryset=TeamParticipant.objects.select_related('USER_ID'))
+            )
 
             teams_data = [
                 {
@@ -382,6 +422,7 @@ def fetch_teams(request):
 
 
 @csrf_exempt
+@query_budget(6)
 def join_team(request):
     if request.method == 'POST':
         user_id = request.POST.get('user_id')
@@ -413,6 +454,7 @@ def join_team(request):
 
 
 @csrf_exempt
+@query_budget(7)
 def team_leave(request):
     if request.method == 'POST':
         try:
@@ -718,3 +760,21 @@ def reset_password_view(request):
     else:
         # No need to render a separate template since everything is in profile.html
         return redirect('profile')  # Redirect to the profile page
+
+
+@staff_member_required
+def profiling_captures(request):
+    return render(request, 'users/profiling_captures.html', {
+        'captures': list_captures(),
+        'title': 'Request profiles',
+        'sample_percent': getattr(settings, 'PROFILING_SAMPLE_PERCENT', 0),
+        'header_name': getattr(settings, 'PROFILING_HEADER', 'X-Profile'),
+    })
+
+
+@staff_member_required
+def profiling_capture_download(request, capture_id, kind):
+    path = capture_file(capture_id, kind)
+    if path is None:
+        raise Http404('No such capture')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path))